@@ -1,10 +1,25 @@
 import os
+import time
+# شروع import برای گزارش زمان راه‌اندازی
+_started = time.perf_counter()
 import logging
-from flask import Flask, request
+import threading
+from flask import Flask, request, jsonify, g, Response
 import telebot
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-import sqlite3
 from datetime import datetime
+from config import DATABASE_PATH, DB_WARMUP, DAILY_PRODUCTION, DEFAULT_PRODUCTION, WEBHOOK_ASYNC, WEBHOOK_QUEUE_SIZE, DISPATCHER_WORKERS, DISPATCHER_DRAIN_TIMEOUT
+from dispatcher import UpdateDispatcher, update_type
+from database import connect, ensure_column, seed_version, schema_version, set_schema_version
+from production import RESOURCE_KEYS, accrue
+from keyboards import registry as keyboards
+from router import CallbackRouter
+from telegram_client import TelegramClient
+from render_cache import RenderCache
+from metrics import registry as metrics
+from sql_profiler import profiler
+
+_imported = time.perf_counter()
 
 # تنظیمات
 TOKEN = os.environ.get('BOT_TOKEN', '')
@@ -13,7 +28,10 @@ CHANNEL_ID = os.environ.get('CHANNEL_ID', '@ancient_war_news')
 ADMIN_IDS = [OWNER_ID]
 
 # ایجاد ربات
-bot = telebot.TeleBot(TOKEN)
+# در حالت صف، هندلرها در ترد همان بخش اجرا می‌شوند تا ترتیب آپدیت‌های هر کاربر حفظ شود
+bot = telebot.TeleBot(TOKEN, threaded=not WEBHOOK_ASYNC)
+# همه درخواست‌های خروجی از استخر اتصال مشترک و با ادغام ویرایش‌های یک پیام
+telegram = TelegramClient().install()
 app = Flask(__name__)
 
 # تنظیمات لاگ
@@ -23,9 +41,62 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# دیتابیس
+# معیارهای /metrics (شمارنده‌های هر ترد، بدون قفل در مسیر درخواست)
+REQUEST_DURATION = metrics.histogram('http_request_duration_seconds', 'Flask request latency', ('endpoint', 'status'))
+UPDATES = metrics.counter('telegram_updates_total', 'Updates received on the webhook by type', ('type',))
+
+# مسیرهایی که به دیتابیس نیاز ندارند (بررسی سلامت و پایش) منتظر آماده‌سازی آن نمی‌مانند
+NO_DATABASE_ENDPOINTS = ('index', 'metrics_endpoint', 'sql_stats')
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    if request.endpoint not in NO_DATABASE_ENDPOINTS:
+        ensure_db()
+
+@app.after_request
+def observe_request(response):
+    started = g.get('started')
+    if started is not None:
+        REQUEST_DURATION.observe(time.perf_counter() - started,
+                                 endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
+
+@app.teardown_request
+def release_connection(exc):
+    # اتصال PostgreSQL ترد به استخر برمی‌گردد تا تردهای وب‌سرور اتصال نگه ندارند
+    connections.release()
+
+# دیتابیس (اتصال جداگانه برای هر ترد)؛ جدول‌ها در اولین استفاده ساخته می‌شوند (ensure_db)
+connections = connect(DATABASE_PATH)
+
+def get_db():
+    ensure_db()
+    return connections.get()
+
+# کشورهای پیش‌فرض
+COUNTRIES = [
+    ('پارس', 'اسب'),
+    ('روم', 'آهن'),
+    ('مصر', 'طلا'),
+    ('چین', 'غذا'),
+    ('یونان', 'سنگ'),
+    ('بابل', 'دانش'),
+    ('آشور', 'نفت'),
+    ('کارتاژ', 'کشتی'),
+    ('هند', 'ادویه'),
+    ('مقدونیه', 'فیل')
+]
+
+# نسخه طرح؛ شماره را پس از هر تغییر جدول‌های init_db افزایش دهید
+APP_SCHEMA = seed_version(2, COUNTRIES, DAILY_PRODUCTION, DEFAULT_PRODUCTION)
+
 def init_db():
-    conn = sqlite3.connect('game.db', check_same_thread=False)
+    """ساخت جدول‌ها و داده‌های اولیه؛ اگر نسخه طرح ثبت‌شده به‌روز باشد فقط یک SELECT اجرا می‌شود"""
+    conn = connections.get()
+    if schema_version(conn, 'app_schema') == APP_SCHEMA:
+        return False
+    
     cursor = conn.cursor()
     
     # جدول بازیکنان
@@ -40,9 +111,14 @@ def init_db():
             food INTEGER DEFAULT 100,
             army INTEGER DEFAULT 50,
             defense INTEGER DEFAULT 50,
-            join_date TIMESTAMP
+            join_date TIMESTAMP,
+            resources_at TIMESTAMP
         )
     ''')
+    ensure_column(conn, 'players', 'resources_at', 'TIMESTAMP')
+    # بازیکنان قدیمی از همین لحظه تولید انباشته دارند
+    cursor.execute('UPDATE players SET resources_at = ? WHERE resources_at IS NULL AND country IS NOT NULL',
+                  (datetime.now(),))
     
     # جدول کشورها
     cursor.execute('''
@@ -55,34 +131,239 @@ def init_db():
         )
     ''')
     
-    # کشورهای پیش‌فرض
-    countries = [
-        ('پارس', 'اسب'),
-        ('روم', 'آهن'),
-        ('مصر', 'طلا'),
-        ('چین', 'غذا'),
-        ('یونان', 'سنگ'),
-        ('بابل', 'دانش'),
-        ('آشور', 'نفت'),
-        ('کارتاژ', 'کشتی'),
-        ('هند', 'ادویه'),
-        ('مقدونیه', 'فیل')
-    ]
-    
-    for name, resource in countries:
-        cursor.execute('INSERT OR IGNORE INTO countries (name, special_resource) VALUES (?, ?)', 
+    for name, resource in COUNTRIES:
+        cursor.execute('INSERT INTO countries (name, special_resource) VALUES (?, ?) ON CONFLICT DO NOTHING', 
                       (name, resource))
     
+    # جدول نرخ تولید روزانه هر کشور (برای به‌روزرسانی یکجای منابع در worker)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS production_rates (
+            country TEXT PRIMARY KEY,
+            gold INTEGER DEFAULT 0,
+            iron INTEGER DEFAULT 0,
+            stone INTEGER DEFAULT 0,
+            food INTEGER DEFAULT 0
+        )
+    ''')
+    
+    rates = []
+    for name, _ in COUNTRIES:
+        production = DAILY_PRODUCTION.get(name, DEFAULT_PRODUCTION)
+        rates.append((name, production['gold'], production['iron'], production['stone'], production['food']))
+    
+    cursor.executemany('''
+        INSERT INTO production_rates (country, gold, iron, stone, food) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (country) DO UPDATE SET
+            gold = excluded.gold, iron = excluded.iron, stone = excluded.stone, food = excluded.food
+    ''', rates)
+    
+    # جدول روابط دیپلماتیک (پیشنهادهای منقضی‌شده در worker پاک می‌شوند)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diplomacy (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            season_id INTEGER,
+            from_country_id INTEGER,
+            to_country_id INTEGER,
+            relation_type TEXT, -- 'ALLIANCE', 'PEACE', 'TRADE'
+            status TEXT DEFAULT 'pending', -- 'pending', 'accepted', 'rejected'
+            created_at TIMESTAMP,
+            expires_at TIMESTAMP,
+            FOREIGN KEY (from_country_id) REFERENCES countries(id),
+            FOREIGN KEY (to_country_id) REFERENCES countries(id)
+        )
+    ''')
+    # ایندکس‌های DELETE پاک‌سازی worker
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_diplomacy_expires ON diplomacy (expires_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_diplomacy_status ON diplomacy (status, created_at)')
+    
+    set_schema_version(conn, 'app_schema', APP_SCHEMA)
     conn.commit()
-    return conn
+    return True
+
+# کش کشورها (نام، منبع ویژه، کنترل‌کننده و بازیکن)؛ در ensure_db ساخته می‌شود
+catalog = None
+
+# رتبه‌بندی بازیکنان بر اساس قدرت (منابع ثبت‌شده + ارتش و دفاع)؛ در ensure_db ساخته می‌شود
+# منابع به صورت تنبل محاسبه می‌شوند؛ پیش از خواندن رتبه‌بندی accrue_power تولید انباشته را ثبت می‌کند
+POWER_SQL = 'gold + iron + stone + food + army * 10 + defense * 5'
+leaderboard = None
 
-db_conn = init_db()
+# منابع بازیکن (تولید روزانه هنگام خواندن محاسبه می‌شود)
+def player_resources(cursor, user_id, now=None):
+    """منابع فعلی بازیکن همراه با تولید انباشته؛ خروجی: (منابع، زمان ثبت جدید، تعداد روزها)"""
+    cursor.execute('''
+        SELECT p.gold, p.iron, p.stone, p.food, p.resources_at,
+               r.gold, r.iron, r.stone, r.food
+        FROM players p
+        LEFT JOIN production_rates r ON r.country = p.country
+        WHERE p.user_id = ?
+    ''', (user_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    
+    rate = dict(zip(RESOURCE_KEYS, row[5:])) if row[5] is not None else None
+    return accrue(dict(zip(RESOURCE_KEYS, row[:4])), rate, row[4], now)
+
+def materialize_player(cursor, user_id, now=None):
+    """ثبت تولید انباشته بازیکن در دیتابیس؛ قبل از تغییر منابع یا کشور بازیکن"""
+    result = player_resources(cursor, user_id, now)
+    if not result or not result[2]:
+        return
+    
+    resources, since, _ = result
+    cursor.execute('''
+        UPDATE players SET gold = ?, iron = ?, stone = ?, food = ?, resources_at = ?
+        WHERE user_id = ?
+    ''', (*(resources[key] for key in RESOURCE_KEYS), since, user_id))
+
+# تعداد روزهای کامل از resources_at تا ? و زمان ثبت جدید (همان محاسبه production.accrue) در گویش هر backend
+ACCRUED_DAYS_SQL = {
+    'sqlite': "(CAST(strftime('%s', ?) AS INTEGER) - CAST(strftime('%s', resources_at) AS INTEGER)) / 86400",
+    'postgres': "FLOOR(EXTRACT(EPOCH FROM (CAST(? AS TIMESTAMP) - resources_at)) / 86400)::INTEGER",
+}
+ADVANCED_SINCE_SQL = {
+    'sqlite': "strftime('%Y-%m-%d %H:%M:%f', players.resources_at, '+' || d.days || ' days')",
+    'postgres': "players.resources_at + d.days * INTERVAL '1 day'",
+}
+
+def materialize_all_players(conn, now=None):
+    """ثبت تولید انباشته همه بازیکنان با یک UPDATE مجموعه‌ای؛ خروجی: تعداد بازیکنان به‌روزشده"""
+    cursor = conn.execute(f'''
+        UPDATE players
+        SET gold = players.gold + r.gold * d.days,
+            iron = players.iron + r.iron * d.days,
+            stone = players.stone + r.stone * d.days,
+            food = players.food + r.food * d.days,
+            resources_at = {ADVANCED_SINCE_SQL[connections.backend]}
+        FROM production_rates r, (
+            SELECT user_id, resources_at, {ACCRUED_DAYS_SQL[connections.backend]} AS days
+            FROM players
+            WHERE country IS NOT NULL AND resources_at IS NOT NULL
+        ) d
+        WHERE r.country = players.country AND d.user_id = players.user_id AND d.days > 0
+          AND d.resources_at = players.resources_at
+    ''', (now or datetime.now(),))
+    # شرط resources_at: ردیفی که تراکنش هم‌زمان دیگری ثبت کرده دوباره افزوده نمی‌شود
+    return cursor.rowcount
+
+def accrue_power(now=None):
+    """ثبت تولید انباشته همه بازیکنان پیش از خواندن رتبه‌بندی؛ خروجی: تعداد بازیکنان به‌روزشده"""
+    with connections.transaction() as conn:
+        updated = materialize_all_players(conn, now)
+        if updated:
+            leaderboard.bump(conn)
+    # بدون روز کامل جدید رتبه‌بندی همان فهرست قبلی است
+    if updated:
+        leaderboard.invalidate()
+    return updated
+
+def process_updates(updates):
+    """پردازش آپدیت‌ها در ترد صف و بازگرداندن اتصال آن به استخر"""
+    try:
+        bot.process_new_updates(updates)
+    finally:
+        connections.release()
+
+# صف پردازش آپدیت‌ها (در حالت وب‌هوک ناهمگام)
+dispatcher = UpdateDispatcher(
+    process_updates,
+    workers=DISPATCHER_WORKERS,
+    maxsize=WEBHOOK_QUEUE_SIZE,
+    drain_timeout=DISPATCHER_DRAIN_TIMEOUT
+)
+
+# ارسال گروهی اطلاعیه‌ها در پس‌زمینه؛ در ensure_db ساخته و راه‌اندازی می‌شود
+broadcaster = None
+
+# زمان‌های راه‌اندازی (میلی‌ثانیه) برای لاگ و /stats
+startup = {'imports_ms': round((_imported - _started) * 1000, 1), 'setup_ms': None, 'database_ms': None}
+_db_ready = False
+_db_lock = threading.Lock()
+
+def ensure_db():
+    """آماده‌سازی دیتابیس و اجزای وابسته به آن در اولین استفاده (نه هنگام import)"""
+    global catalog, leaderboard, broadcaster, _db_ready
+    if _db_ready:
+        return
+    with _db_lock:
+        if _db_ready:
+            return
+        started = time.perf_counter()
+        created = init_db()
+        schema_done = time.perf_counter()
+        
+        from catalog import CountryCatalog
+        from leaderboard import Leaderboard
+        from broadcast import Broadcaster
+        from scheduler import Scheduler
+        catalog = CountryCatalog(connections)
+        leaderboard = Leaderboard(
+            connections, 'leaderboard_power',
+            load_sql=f'SELECT user_id, {POWER_SQL} FROM players WHERE country IS NOT NULL',
+            score_sql=f'SELECT {POWER_SQL} FROM players WHERE user_id = ? AND country IS NOT NULL'
+        )
+        # ادامه ارسال‌های ناتمام پس از راه‌اندازی مجدد
+        broadcaster = Broadcaster(
+            connections,
+            lambda chat_id, text, parse_mode: bot.send_message(chat_id, text, parse_mode=parse_mode)
+        )
+        broadcaster.start()
+        # وضعیت کارهای worker از جدول scheduler_jobs (worker در پروسس جداگانه اجرا می‌شود)
+        metrics.collector(Scheduler(connections).collect)
+        _db_ready = True
+        
+        finished = time.perf_counter()
+        startup['database_ms'] = round((finished - started) * 1000, 1)
+        logger.info(f"Database ready in {startup['database_ms']:.0f} ms "
+                    f"(schema {'initialized' if created else 'up to date'} in {(schema_done - started) * 1000:.0f} ms, "
+                    f"caches and broadcaster {(finished - schema_done) * 1000:.0f} ms)")
+
+def announce(text):
+    """ارسال اطلاعیه به کانال و همه بازیکنان؛ خروجی: تعداد گیرندگان"""
+    cursor = get_db().cursor()
+    cursor.execute('SELECT user_id FROM players WHERE country IS NOT NULL ORDER BY user_id')
+    recipients = ([CHANNEL_ID] if CHANNEL_ID else []) + [player_id for (player_id,) in cursor.fetchall()]
+    broadcaster.enqueue(text, recipients)
+    return len(recipients)
+
+# آخرین رندر هر پیام؛ رندر تکراری فقط با پاسخ به callback جواب داده می‌شود
+renders = RenderCache()
+
+def render(call, text, reply_markup=None, parse_mode=None):
+    """ویرایش پیام callback، مگر اینکه متن و کیبورد با آخرین رندر همین پیام یکی باشد"""
+    chat_id, message_id = call.message.chat.id, call.message.message_id
+    if not renders.changed(chat_id, message_id, text, reply_markup, parse_mode):
+        bot.answer_callback_query(call.id)
+        return
+    
+    try:
+        bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=text,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup
+        )
+    except telebot.apihelper.ApiTelegramException as e:
+        if 'message is not modified' not in (e.description or ''):
+            renders.forget(chat_id, message_id)
+            raise
+        renders.not_modified()
+        bot.answer_callback_query(call.id)
+    except Exception:
+        renders.forget(chat_id, message_id)
+        raise
 
-# منوها
+# منوها (به صورت JSON آماده در کش نگهداری می‌شوند)
 def main_menu(user_id):
+    role = 'owner' if user_id in ADMIN_IDS else 'player'
+    return keyboards.get(('main_menu', role), lambda: build_main_menu(role))
+
+def build_main_menu(role):
     keyboard = InlineKeyboardMarkup()
     
-    if user_id in ADMIN_IDS:
+    if role == 'owner':
         keyboard.row(
             InlineKeyboardButton("👑 افزودن بازیکن", callback_data="add_player"),
             InlineKeyboardButton("🌍 کشورها", callback_data="view_countries")
@@ -92,6 +373,7 @@ def main_menu(user_id):
             InlineKeyboardButton("⏹️ پایان فصل", callback_data="end_season")
         )
         keyboard.row(
+            InlineKeyboardButton("🏆 رتبه‌بندی", callback_data="leaderboard"),
             InlineKeyboardButton("🔄 ریست", callback_data="reset_game")
         )
     else:
@@ -103,27 +385,40 @@ def main_menu(user_id):
             InlineKeyboardButton("⚔️ ارتش", callback_data="army_info"),
             InlineKeyboardButton("🤝 دیپلماسی", callback_data="diplomacy")
         )
+        keyboard.row(
+            InlineKeyboardButton("🏆 رتبه‌بندی", callback_data="leaderboard")
+        )
     
     return keyboard
 
 def countries_menu():
+    # فقط با تغییر مالکیت کشورها (نسخه کش کشورها) دوباره ساخته می‌شود
+    return keyboards.get(('countries_menu',), build_countries_menu, version=catalog.version())
+
+def build_countries_menu():
     keyboard = InlineKeyboardMarkup()
-    cursor = db_conn.cursor()
-    cursor.execute('SELECT name FROM countries WHERE controller = "AI"')
-    countries = cursor.fetchall()
+    countries = [country['name'] for country in catalog.available()]
     
     for i in range(0, len(countries), 2):
         row = []
         if i < len(countries):
-            row.append(InlineKeyboardButton(f"🏛️ {countries[i][0]}", callback_data=f"select_{countries[i][0]}"))
+            row.append(InlineKeyboardButton(f"🏛️ {countries[i]}", callback_data=f"select_{countries[i]}"))
         if i + 1 < len(countries):
-            row.append(InlineKeyboardButton(f"🏛️ {countries[i+1][0]}", callback_data=f"select_{countries[i+1][0]}"))
+            row.append(InlineKeyboardButton(f"🏛️ {countries[i+1]}", callback_data=f"select_{countries[i+1]}"))
         if row:
             keyboard.row(*row)
     
     keyboard.row(InlineKeyboardButton("🔙 بازگشت", callback_data="main_menu"))
     return keyboard
 
+def build_reset_confirmation():
+    keyboard = InlineKeyboardMarkup()
+    keyboard.row(
+        InlineKeyboardButton("✅ بله، ریست کن", callback_data="confirm_reset"),
+        InlineKeyboardButton("❌ خیر، لغو", callback_data="main_menu")
+    )
+    return keyboard
+
 # هندلرهای ربات
 @bot.message_handler(commands=['start', 'help'])
 def send_welcome(message):
@@ -131,10 +426,9 @@ def send_welcome(message):
     username = message.from_user.username or message.from_user.first_name
     
     # ثبت کاربر در دیتابیس
-    cursor = db_conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO players (user_id, username, join_date) VALUES (?, ?, ?)',
-                  (user_id, username, datetime.now()))
-    db_conn.commit()
+    with connections.transaction() as conn:
+        conn.execute('INSERT INTO players (user_id, username, join_date) VALUES (?, ?, ?) ON CONFLICT DO NOTHING',
+                     (user_id, username, datetime.now()))
     
     welcome_text = f"""👋 سلام {message.from_user.first_name}!
 به بازی جنگ جهانی باستان خوش آمدید.
@@ -145,85 +439,90 @@ def send_welcome(message):
     
     bot.send_message(message.chat.id, welcome_text, reply_markup=main_menu(user_id))
 
+# مسیریاب callbackها؛ دسترسی مالک به صورت اعلانی روی هر مسیر بررسی می‌شود
+router = CallbackRouter(
+    is_admin=lambda user_id: user_id in ADMIN_IDS,
+    on_denied=lambda call: bot.answer_callback_query(call.id, "⛔ دسترسی ممنوع!")
+)
+
+metrics.collector(router.collect)
+
 @bot.callback_query_handler(func=lambda call: True)
 def handle_callback(call):
+    router.dispatch(call)
+
+@router.route("main_menu")
+def show_main_menu(call):
     user_id = call.from_user.id
     
-    if call.data == "main_menu":
-        bot.edit_message_text(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            text=f"منوی اصلی\nشما: {'👑 مالک' if user_id in ADMIN_IDS else '🎮 بازیکن'}",
-            reply_markup=main_menu(user_id)
-        )
+    render(
+        call,
+        text=f"منوی اصلی\nشما: {'👑 مالک' if user_id in ADMIN_IDS else '🎮 بازیکن'}",
+        reply_markup=main_menu(user_id)
+    )
+
+@router.route("add_player", admin_only=True)
+def add_player(call):
+    render(
+        call,
+        text="🏛️ انتخاب کشور برای بازیکن جدید:\n\nکشورهای آزاد:",
+        reply_markup=countries_menu()
+    )
+
+@router.prefix("select_", admin_only=True)
+def select_country(call, country_name):
+    render(
+        call,
+        text=f"کشور '{country_name}' انتخاب شد.\n\nلطفاً آیدی عددی کاربر را ارسال کنید:"
+    )
+    # ذخیره کشور انتخاب شده
+    bot.register_next_step_handler(call.message, lambda m: add_player_step(m, country_name))
+
+@router.route("view_countries")
+def view_countries(call):
+    user_id = call.from_user.id
     
-    elif call.data == "add_player":
-        if user_id not in ADMIN_IDS:
-            bot.answer_callback_query(call.id, "⛔ دسترسی ممنوع!")
-            return
-        
-        bot.edit_message_text(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            text="🏛️ انتخاب کشور برای بازیکن جدید:\n\nکشورهای آزاد:",
-            reply_markup=countries_menu()
-        )
+    text = "🌍 **لیست کشورهای باستانی:**\n\n"
+    for country in catalog.all():
+        name, resource, controller = country['name'], country['special_resource'], country['controller']
+        player = country['username'] or 'بدون بازیکن'
+        controller_icon = "🤖" if controller == "AI" else "👤"
+        text += f"🏛️ **{name}**\n"
+        text += f"   منبع ویژه: {resource}\n"
+        text += f"   کنترل: {controller_icon} {player}\n"
+        text += f"   {'─'*20}\n"
     
-    elif call.data.startswith("select_"):
-        if user_id not in ADMIN_IDS:
-            bot.answer_callback_query(call.id, "⛔ دسترسی ممنوع!")
-            return
-        
-        country_name = call.data.replace("select_", "")
-        bot.edit_message_text(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            text=f"کشور '{country_name}' انتخاب شد.\n\nلطفاً آیدی عددی کاربر را ارسال کنید:"
-        )
-        # ذخیره کشور انتخاب شده
-        bot.register_next_step_handler(call.message, lambda m: add_player_step(m, country_name))
-    
-    elif call.data == "view_countries":
-        cursor = db_conn.cursor()
-        cursor.execute('''
-            SELECT c.name, c.special_resource, c.controller, 
-                   COALESCE(p.username, 'بدون بازیکن') as player_name
-            FROM countries c
-            LEFT JOIN players p ON c.player_id = p.user_id
-        ''')
-        countries = cursor.fetchall()
-        
-        text = "🌍 **لیست کشورهای باستانی:**\n\n"
-        for name, resource, controller, player in countries:
-            controller_icon = "🤖" if controller == "AI" else "👤"
-            text += f"🏛️ **{name}**\n"
-            text += f"   منبع ویژه: {resource}\n"
-            text += f"   کنترل: {controller_icon} {player}\n"
-            text += f"   {'─'*20}\n"
-        
-        bot.edit_message_text(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            text=text,
-            parse_mode='Markdown',
-            reply_markup=main_menu(user_id)
-        )
+    render(
+        call,
+        text=text,
+        parse_mode='Markdown',
+        reply_markup=main_menu(user_id)
+    )
+
+@router.route("my_country")
+def my_country(call):
+    user_id = call.from_user.id
     
-    elif call.data == "my_country":
-        cursor = db_conn.cursor()
-        cursor.execute('''
-            SELECT c.name, c.special_resource, 
-                   p.gold, p.iron, p.stone, p.food, p.army, p.defense
-            FROM players p
-            JOIN countries c ON p.country = c.name
-            WHERE p.user_id = ?
-        ''', (user_id,))
-        
-        player_data = cursor.fetchone()
-        
-        if player_data:
-            name, resource, gold, iron, stone, food, army, defense = player_data
-            text = f"""🏛️ **کشور شما: {name}**
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT c.name, c.special_resource, 
+               p.gold, p.iron, p.stone, p.food, p.army, p.defense, p.resources_at,
+               r.gold, r.iron, r.stone, r.food
+        FROM players p
+        JOIN countries c ON p.country = c.name
+        LEFT JOIN production_rates r ON r.country = p.country
+        WHERE p.user_id = ?
+    ''', (user_id,))
+    
+    player_data = cursor.fetchone()
+    
+    if player_data:
+        name, resource = player_data[:2]
+        army, defense = player_data[6:8]
+        rate = dict(zip(RESOURCE_KEYS, player_data[9:])) if player_data[9] is not None else None
+        resources, _, _ = accrue(dict(zip(RESOURCE_KEYS, player_data[2:6])), rate, player_data[8])
+        gold, iron, stone, food = (resources[key] for key in RESOURCE_KEYS)
+        text = f"""🏛️ **کشور شما: {name}**
 
 🎁 منبع ویژه: {resource}
 
@@ -236,25 +535,25 @@ def handle_callback(call):
 ⚔️ **نظامی:**
 👮 ارتش: {army}
 🛡️ دفاع: {defense}"""
-        else:
-            text = "⚠️ شما هنوز کشوری ندارید!\nلطفاً از مالک درخواست کشور کنید."
-        
-        bot.edit_message_text(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            text=text,
-            parse_mode='Markdown',
-            reply_markup=main_menu(user_id)
-        )
+    else:
+        text = "⚠️ شما هنوز کشوری ندارید!\nلطفاً از مالک درخواست کشور کنید."
     
-    elif call.data == "view_resources":
-        cursor = db_conn.cursor()
-        cursor.execute('SELECT gold, iron, stone, food FROM players WHERE user_id = ?', (user_id,))
-        resources = cursor.fetchone()
-        
-        if resources:
-            gold, iron, stone, food = resources
-            text = f"""📊 **منابع شما:**
+    render(
+        call,
+        text=text,
+        parse_mode='Markdown',
+        reply_markup=main_menu(user_id)
+    )
+
+@router.route("view_resources")
+def view_resources(call):
+    user_id = call.from_user.id
+    
+    result = player_resources(get_db().cursor(), user_id)
+    
+    if result:
+        gold, iron, stone, food = (result[0][key] for key in RESOURCE_KEYS)
+        text = f"""📊 **منابع شما:**
 
 💰 طلا: {gold}
 ⚒️ آهن: {iron}
@@ -262,70 +561,61 @@ def handle_callback(call):
 🍖 غذا: {food}
 
 💡 راهنمایی: از این منابع برای ساخت ارتش و توسعه کشور استفاده کنید."""
-        else:
-            text = "⚠️ شما هنوز ثبت‌نام نکرده‌اید. /start را بزنید."
+    else:
+        text = "⚠️ شما هنوز ثبت‌نام نکرده‌اید. /start را بزنید."
+    
+    render(
+        call,
+        text=text,
+        parse_mode='Markdown',
+        reply_markup=main_menu(user_id)
+    )
+
+@router.route("start_season", admin_only=True)
+def start_season(call):
+    user_id = call.from_user.id
+    
+    try:
+        # ارسال پیام به کانال و بازیکنان در پس‌زمینه
+        recipients = announce(
+            "🎉 **شروع فصل جدید جنگ‌های باستان!**\n\n"
+            "جهان باستان زنده شد! کشورها برای فتح جهان آماده می‌شوند...\n\n"
+            "ساخته شده توسط @amele55\n"
+            "ورژن 1 ربات"
+        )
         
-        bot.edit_message_text(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            text=text,
-            parse_mode='Markdown',
+        render(
+            call,
+            text=f"✅ فصل جدید با موفقیت شروع شد!\nپیام برای {recipients} گیرنده در صف ارسال قرار گرفت.",
+            reply_markup=main_menu(user_id)
+        )
+    except Exception as e:
+        render(
+            call,
+            text=f"❌ خطا در شروع فصل: {str(e)}",
             reply_markup=main_menu(user_id)
         )
+
+@router.route("end_season", admin_only=True)
+def end_season(call):
+    user_id = call.from_user.id
     
-    elif call.data == "start_season":
-        if user_id not in ADMIN_IDS:
-            bot.answer_callback_query(call.id, "⛔ دسترسی ممنوع!")
-            return
+    try:
+        # ثبت تولید انباشته همه بازیکنان تا امتیاز نهایی کامل باشد
+        accrue_power()
         
-        try:
-            # ارسال پیام به کانال
-            bot.send_message(
-                CHANNEL_ID,
-                "🎉 **شروع فصل جدید جنگ‌های باستان!**\n\n"
-                "جهان باستان زنده شد! کشورها برای فتح جهان آماده می‌شوند...\n\n"
-                "ساخته شده توسط @amele55\n"
-                "ورژن 1 ربات"
-            )
-            
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text="✅ فصل جدید با موفقیت شروع شد!\nپیام در کانال ارسال شد.",
-                reply_markup=main_menu(user_id)
-            )
-        except Exception as e:
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=f"❌ خطا در شروع فصل: {str(e)}",
-                reply_markup=main_menu(user_id)
-            )
-    
-    elif call.data == "end_season":
-        if user_id not in ADMIN_IDS:
-            bot.answer_callback_query(call.id, "⛔ دسترسی ممنوع!")
-            return
+        # پیدا کردن برنده از رتبه‌بندی
+        winner = None
+        top = leaderboard.top(1)
+        if top:
+            cursor = get_db().cursor()
+            cursor.execute('SELECT user_id, username, country FROM players WHERE user_id = ?', (top[0][0],))
+            winner = (*cursor.fetchone(), top[0][1])
         
-        try:
-            # پیدا کردن برنده (ساده‌سازی شده)
-            cursor = db_conn.cursor()
-            cursor.execute('''
-                SELECT p.user_id, p.username, c.name, 
-                       (p.gold + p.iron + p.stone + p.food + p.army * 10 + p.defense * 5) as score
-                FROM players p
-                JOIN countries c ON p.country = c.name
-                WHERE c.controller = 'HUMAN'
-                ORDER BY score DESC
-                LIMIT 1
-            ''')
-            winner = cursor.fetchone()
-            
-            if winner:
-                user_id_winner, username, country, score = winner
-                bot.send_message(
-                    CHANNEL_ID,
-                    f"""🏆 **پایان فصل جنگ‌های باستان**
+        if winner:
+            user_id_winner, username, country, score = winner
+            recipients = announce(
+                f"""🏆 **پایان فصل جنگ‌های باستان**
 
 👑 فاتح نهایی جهان:
 🏛️ **{country}**
@@ -336,100 +626,133 @@ def handle_callback(call):
 ساخته شده توسط @amele55
 منتظر فصل بعد باشید
 ورژن 1 ربات"""
-                )
-                
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text=f"✅ فصل با موفقیت پایان یافت!\n🏆 برنده: {country}",
-                    reply_markup=main_menu(user_id)
-                )
-            else:
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text="⚠️ هیچ بازیکن انسانی برای برنده شدن وجود ندارد!",
-                    reply_markup=main_menu(user_id)
-                )
-        except Exception as e:
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=f"❌ خطا در پایان فصل: {str(e)}",
-                reply_markup=main_menu(user_id)
             )
-    
-    elif call.data == "reset_game":
-        if user_id not in ADMIN_IDS:
-            bot.answer_callback_query(call.id, "⛔ دسترسی ممنوع!")
-            return
-        
-        keyboard = InlineKeyboardMarkup()
-        keyboard.row(
-            InlineKeyboardButton("✅ بله، ریست کن", callback_data="confirm_reset"),
-            InlineKeyboardButton("❌ خیر، لغو", callback_data="main_menu")
-        )
-        
-        bot.edit_message_text(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            text="⚠️ **هشدار: ریست کامل بازی**\n\nآیا مطمئن هستید؟\nهمه داده‌ها پاک می‌شوند!",
-            reply_markup=keyboard
-        )
-    
-    elif call.data == "confirm_reset":
-        if user_id not in ADMIN_IDS:
-            return
-        
-        try:
-            cursor = db_conn.cursor()
-            # ریست بازیکنان
-            cursor.execute('UPDATE players SET country = NULL, gold = 100, iron = 100, stone = 100, food = 100, army = 50, defense = 50')
-            # ریست کشورها
-            cursor.execute('UPDATE countries SET controller = "AI", player_id = NULL')
-            db_conn.commit()
             
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text="✅ بازی با موفقیت ریست شد!\nهمه کشورها آزاد شدند.",
+            render(
+                call,
+                text=f"✅ فصل با موفقیت پایان یافت!\n🏆 برنده: {country}\n📣 اطلاعیه برای {recipients} گیرنده در صف ارسال قرار گرفت.",
                 reply_markup=main_menu(user_id)
             )
-        except Exception as e:
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=f"❌ خطا در ریست بازی: {str(e)}",
+        else:
+            render(
+                call,
+                text="⚠️ هیچ بازیکن انسانی برای برنده شدن وجود ندارد!",
                 reply_markup=main_menu(user_id)
             )
+    except Exception as e:
+        render(
+            call,
+            text=f"❌ خطا در پایان فصل: {str(e)}",
+            reply_markup=main_menu(user_id)
+        )
+
+@router.route("leaderboard")
+def show_leaderboard(call):
+    user_id = call.from_user.id
+    
+    accrue_power()
+    top = leaderboard.top(10)
+    text = "🏆 **رتبه‌بندی بازیکنان:**\n\n"
+    if top:
+        cursor = get_db().cursor()
+        cursor.execute(f"SELECT user_id, username, country FROM players WHERE user_id IN ({', '.join('?' * len(top))})",
+                      [player_id for player_id, _ in top])
+        players = {row[0]: row[1:] for row in cursor.fetchall()}
+        medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+        for rank, (player_id, power) in enumerate(top, 1):
+            username, country = players.get(player_id, (f"player_{player_id}", "?"))
+            text += f"{medals.get(rank, f'{rank}.')} {username} ({country}) — {power}\n"
+    else:
+        text += "هنوز بازیکنی ثبت نشده است.\n"
+    
+    rank = leaderboard.rank(user_id)
+    if rank:
+        text += f"\n📍 رتبه شما: {rank} از {len(leaderboard)}"
+    
+    render(
+        call,
+        text=text,
+        parse_mode='Markdown',
+        reply_markup=main_menu(user_id)
+    )
+
+@router.route("reset_game", admin_only=True)
+def reset_game(call):
+    render(
+        call,
+        text="⚠️ **هشدار: ریست کامل بازی**\n\nآیا مطمئن هستید؟\nهمه داده‌ها پاک می‌شوند!",
+        reply_markup=keyboards.get(('confirm_reset',), build_reset_confirmation)
+    )
+
+@router.route("confirm_reset", admin_only=True)
+def confirm_reset(call):
+    user_id = call.from_user.id
+    
+    try:
+        with connections.transaction() as conn:
+            cursor = conn.cursor()
+            # ریست بازیکنان
+            cursor.execute('UPDATE players SET country = NULL, gold = 100, iron = 100, stone = 100, food = 100, army = 50, defense = 50, resources_at = NULL')
+            # ریست کشورها
+            cursor.execute("UPDATE countries SET controller = 'AI', player_id = NULL")
+            catalog.bump(conn)
+            leaderboard.bump(conn)
+        catalog.invalidate()
+        leaderboard.invalidate()
+        
+        render(
+            call,
+            text="✅ بازی با موفقیت ریست شد!\nهمه کشورها آزاد شدند.",
+            reply_markup=main_menu(user_id)
+        )
+    except Exception as e:
+        render(
+            call,
+            text=f"❌ خطا در ریست بازی: {str(e)}",
+            reply_markup=main_menu(user_id)
+        )
 
 def add_player_step(message, country_name):
     try:
         new_user_id = int(message.text)
         
-        cursor = db_conn.cursor()
-        
-        # بررسی اینکه کشور آزاد است
-        cursor.execute('SELECT controller FROM countries WHERE name = ?', (country_name,))
-        country = cursor.fetchone()
-        
-        if not country or country[0] != "AI":
+        # رد سریع بدون مراجعه به دیتابیس؛ بررسی قطعی در UPDATE شرطی انجام می‌شود
+        country = catalog.by_name(country_name)
+        if not country or country['controller'] != "AI":
             bot.reply_to(message, "❌ این کشور قبلاً اشغال شده است!")
             return
         
-        # اختصاص کشور به بازیکن
-        cursor.execute('UPDATE countries SET controller = "HUMAN", player_id = ? WHERE name = ?',
-                      (new_user_id, country_name))
-        
-        # به‌روزرسانی بازیکن
-        cursor.execute('UPDATE players SET country = ? WHERE user_id = ?', (country_name, new_user_id))
+        with connections.transaction() as conn:
+            cursor = conn.cursor()
+            
+            # اختصاص کشور به بازیکن (فقط اگر کشور هنوز آزاد باشد)
+            cursor.execute("UPDATE countries SET controller = 'HUMAN', player_id = ? WHERE name = ? AND controller = 'AI'",
+                          (new_user_id, country_name))
+            
+            assigned = cursor.rowcount > 0
+            
+            if assigned:
+                # ثبت تولید کشور قبلی و شروع تولید کشور جدید از همین لحظه
+                materialize_player(cursor, new_user_id)
+                cursor.execute('UPDATE players SET country = ?, resources_at = ? WHERE user_id = ?',
+                              (country_name, datetime.now(), new_user_id))
+                
+                # اگر بازیکن وجود ندارد، ایجاد کن
+                if cursor.rowcount == 0:
+                    cursor.execute('INSERT INTO players (user_id, username, country, join_date, resources_at) VALUES (?, ?, ?, ?, ?)',
+                                  (new_user_id, f"player_{new_user_id}", country_name, datetime.now(), datetime.now()))
+                
+                catalog.bump(conn)
+                leaderboard_version = leaderboard.bump(conn)
         
-        # اگر بازیکن وجود ندارد، ایجاد کن
-        if cursor.rowcount == 0:
-            cursor.execute('INSERT INTO players (user_id, username, country, join_date) VALUES (?, ?, ?, ?)',
-                          (new_user_id, f"player_{new_user_id}", country_name, datetime.now()))
+        # در صورت شکست هم کش محلی قدیمی بوده است
+        catalog.invalidate()
+        if assigned:
+            leaderboard.refresh(new_user_id, leaderboard_version)
         
-        db_conn.commit()
+        if not assigned:
+            bot.reply_to(message, "❌ این کشور قبلاً اشغال شده است!")
+            return
         
         # اطلاع به مالک
         bot.reply_to(message, f"✅ بازیکن با آیدی {new_user_id} به کشور '{country_name}' اضافه شد!")
@@ -455,11 +778,50 @@ def add_player_step(message, country_name):
 def webhook():
     if request.headers.get('content-type') == 'application/json':
         json_string = request.get_data().decode('utf-8')
-        update = telebot.types.Update.de_json(json_string)
+        try:
+            update = telebot.types.Update.de_json(json_string)
+        except (ValueError, KeyError, TypeError):
+            return 'Bad Request', 400
+        if update is None:
+            return 'Bad Request', 400
+        UPDATES.inc(type=update_type(update))
+        
+        if WEBHOOK_ASYNC:
+            # صف پر است؛ تلگرام درخواست را دوباره ارسال می‌کند
+            if not dispatcher.submit(update):
+                return 'Service Unavailable', 503
+            return ''
+        
         bot.process_new_updates([update])
         return ''
     return 'Bad Request', 400
 
+@app.route('/stats')
+def stats():
+    return jsonify({
+        'dispatcher': dispatcher.get_stats(),
+        'router': router.get_stats(),
+        'broadcast': broadcaster.get_status(),
+        'telegram': telegram.get_stats(),
+        'render': renders.get_stats(),
+        'startup': startup
+    })
+
+@app.route('/stats/sql')
+def sql_stats():
+    """پرهزینه‌ترین دستورهای SQL این پروسس؛ ?order=total|calls|avg|max|rows&limit=20&format=text"""
+    order = request.args.get('order', 'total')
+    if order not in ('total', 'calls', 'avg', 'max', 'rows'):
+        return 'Bad Request', 400
+    limit = request.args.get('limit', 20, type=int)
+    if request.args.get('format') == 'text':
+        return Response(profiler.format_report(order, limit), mimetype='text/plain')
+    return jsonify(profiler.report(order, limit))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return 'Ancient War Bot is running!'
@@ -471,6 +833,22 @@ def set_webhook():
     bot.set_webhook(url=webhook_url)
     return f'Webhook set to {webhook_url}'
 
+def warm_up():
+    """آماده‌سازی دیتابیس در پس‌زمینه تا اولین درخواست منتظر آن نماند"""
+    try:
+        ensure_db()
+    except Exception as e:
+        # اولین درخواستی که به دیتابیس نیاز دارد دوباره تلاش می‌کند
+        logger.error(f"Database warm-up failed: {e}")
+    finally:
+        connections.release()
+
+startup['setup_ms'] = round((time.perf_counter() - _imported) * 1000, 1)
+logger.info(f"Startup: imports {startup['imports_ms']:.0f} ms, setup {startup['setup_ms']:.0f} ms "
+            f"(database {'warming up in background' if DB_WARMUP else 'deferred to first use'})")
+if DB_WARMUP:
+    threading.Thread(target=warm_up, name='db-warmup', daemon=True).start()
+
 # اجرای برنامه
 if __name__ == '__main__':
     # در Render از محیطی استفاده می‌کنیم
@@ -487,5 +865,6 @@ if __name__ == '__main__':
     else:
         # برای توسعه محلی، polling
         logger.info("Starting bot in polling mode...")
+        ensure_db()
         bot.remove_webhook()
         bot.polling(none_stop=True)
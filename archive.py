@@ -0,0 +1,227 @@
+"""
+بایگانی فصل‌های تمام‌شده در فایل
+
+پس از پایان فصل کشورها، بازیکنان، جنگ‌ها، روابط دیپلماتیک و رویدادهای آن در پوشه
+season_<id> زیر SEASON_ARCHIVE_DIR نوشته و جنگ‌ها، دیپلماسی و رویدادهای فصل از
+دیتابیس حذف می‌شوند.
+
+- هر جدول یک فایل <table>.bin از تکه‌های پشت سر هم: طول (4 بایت)، تعداد ردیف (4 بایت)
+  و سپس JSON ستونی فشرده‌شده با zlib ({"columns": [...], "data": [ستون اول، ستون دوم، ...]})
+- manifest.json مشخصات فصل، ستون‌ها و محل هر تکه را نگه می‌دارد
+- خواندن با mmap و باز کردن فقط تکه‌های لازم، بدون بارگذاری در دیتابیس
+"""
+import os
+import json
+import mmap
+import zlib
+import shutil
+import struct
+import logging
+from datetime import datetime
+from functools import cached_property
+from config import SEASON_ARCHIVE_DIR, SEASON_ARCHIVE_CHUNK_ROWS
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_HEADER = struct.Struct('<II')
+
+def _values(row):
+    return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return str(value)
+
+class _TableWriter:
+    """نوشتن ردیف‌های یک جدول به صورت تکه‌های ستونی فشرده"""
+
+    def __init__(self, path, chunk_rows):
+        self.file = open(path, 'wb')
+        self.chunk_rows = chunk_rows
+        self.columns = None
+        self.rows = []
+        self.chunks = []
+        self.count = 0
+
+    def write(self, columns, row):
+        if self.columns is None:
+            self.columns = list(columns)
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self.rows:
+            return
+        data = [list(column) for column in zip(*self.rows)]
+        payload = zlib.compress(json.dumps({'columns': self.columns, 'data': data},
+                                           default=_json_default, ensure_ascii=False).encode('utf-8'))
+        offset = self.file.tell()
+        self.file.write(_CHUNK_HEADER.pack(len(payload), len(self.rows)))
+        self.file.write(payload)
+        self.chunks.append([offset, len(self.rows)])
+        self.count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self._flush()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        return {'rows': self.count, 'columns': self.columns or [], 'chunks': self.chunks}
+
+class SeasonArchive:
+    """خواندن تنبل بایگانی یک فصل؛ فایل‌ها فقط هنگام نیاز با mmap باز می‌شوند"""
+
+    def __init__(self, path):
+        self.path = path
+        self._maps = {}
+
+    @cached_property
+    def manifest(self):
+        with open(os.path.join(self.path, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    @property
+    def season(self):
+        return self.manifest['season']
+
+    def tables(self):
+        return list(self.manifest['tables'])
+
+    def count(self, table):
+        return self.manifest['tables'][table]['rows']
+
+    def _map(self, table):
+        data = self._maps.get(table)
+        if data is None:
+            with open(os.path.join(self.path, f"{table}.bin"), 'rb') as f:
+                # فایل خالی قابل mmap نیست
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+            self._maps[table] = data
+        return data
+
+    def _chunk(self, table, offset):
+        data = self._map(table)
+        length, _ = _CHUNK_HEADER.unpack_from(data, offset)
+        start = offset + _CHUNK_HEADER.size
+        chunk = json.loads(zlib.decompress(data[start:start + length]))
+        return [dict(zip(chunk['columns'], row)) for row in zip(*chunk['data'])]
+
+    def rows(self, table, offset=0, limit=None):
+        """ردیف‌های جدول از ردیف offset؛ تکه‌های پیش از آن باز نمی‌شوند"""
+        if limit is not None and limit <= 0:
+            return
+        position = 0
+        for chunk_offset, count in self.manifest['tables'][table]['chunks']:
+            if position + count <= offset:
+                position += count
+                continue
+            for row in self._chunk(table, chunk_offset)[max(0, offset - position):]:
+                yield row
+                if limit is not None:
+                    limit -= 1
+                    if limit == 0:
+                        return
+            position += count
+
+    def close(self):
+        for data in self._maps.values():
+            if isinstance(data, mmap.mmap):
+                data.close()
+        self._maps = {}
+
+class SeasonArchiver:
+    """نوشتن بایگانی فصل و حذف داده‌های آن از دیتابیس"""
+
+    # (جدول، ستون کلید برای پیمایش، فیلتر فصل)
+    TABLES = (
+        ('countries', 'id', False),
+        ('players', 'user_id', False),
+        ('battles', 'id', True),
+        ('diplomacy', 'id', True),
+    )
+
+    def __init__(self, connections, events, directory=SEASON_ARCHIVE_DIR, chunk_rows=SEASON_ARCHIVE_CHUNK_ROWS):
+        self.connections = connections
+        self.events = events
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+
+    def path(self, season_id):
+        return os.path.join(self.directory, f"season_{int(season_id)}")
+
+    def _select(self, table, key, season_id):
+        # پیمایش با کلید به جای خواندن کل جدول در حافظه
+        conn = self.connections.get()
+        last = None
+        while True:
+            conditions, params = [], []
+            if season_id is not None:
+                conditions.append('season_id = ?')
+                params.append(season_id)
+            if last is not None:
+                conditions.append(f'{key} > ?')
+                params.append(last)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            cursor = conn.execute(f'SELECT * FROM {table} {where} ORDER BY {key} LIMIT ?', params + [self.chunk_rows])
+            columns = [description[0] for description in cursor.description]
+            rows = [_values(row) for row in cursor.fetchall()]
+            for row in rows:
+                yield columns, row
+            if len(rows) < self.chunk_rows:
+                return
+            last = rows[-1][columns.index(key)]
+
+    def archive(self, season_id, prune=True):
+        """بایگانی فصل؛ خروجی: مسیر پوشه بایگانی"""
+        conn = self.connections.get()
+        cursor = conn.execute('SELECT * FROM seasons WHERE id = ?', (season_id,))
+        columns = [description[0] for description in cursor.description]
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"season {season_id} not found")
+        season = dict(zip(columns, _values(row)))
+
+        self.events.flush()
+        final = self.path(season_id)
+        staging = final + '.tmp'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        tables = {}
+        for table, key, by_season in self.TABLES:
+            writer = _TableWriter(os.path.join(staging, f"{table}.bin"), self.chunk_rows)
+            for columns, row in self._select(table, key, season_id if by_season else None):
+                writer.write(columns, row)
+            tables[table] = writer.close()
+
+        writer = _TableWriter(os.path.join(staging, 'events.bin'), self.chunk_rows)
+        for event in self.events.iter_season(season_id, self.chunk_rows):
+            writer.write(event.keys(), tuple(event.values()))
+        tables['events'] = writer.close()
+
+        with open(os.path.join(staging, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump({'season': season, 'archived_at': datetime.now(), 'tables': tables},
+                      f, default=_json_default, ensure_ascii=False)
+
+        # جایگزینی اتمیک؛ بایگانی ناقص هرگز در مسیر نهایی قرار نمی‌گیرد
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(staging, final)
+        logger.info(f"Season {season_id} archived to {final}: "
+                    + ', '.join(f"{table} {info['rows']}" for table, info in tables.items()))
+
+        with self.connections.transaction() as tx:
+            tx.execute('UPDATE seasons SET archive_path = ? WHERE id = ?', (final, season_id))
+            if prune:
+                tx.execute('DELETE FROM battles WHERE season_id = ?', (season_id,))
+                tx.execute('DELETE FROM diplomacy WHERE season_id = ?', (season_id,))
+        if prune:
+            self.events.drop_season(season_id)
+        return final
+
+    def open(self, season_id):
+        """بایگانی فصل یا None اگر بایگانی نشده است"""
+        path = self.path(season_id)
+        return SeasonArchive(path) if os.path.exists(os.path.join(path, 'manifest.json')) else None
@@ -0,0 +1,152 @@
+"""
+فرمول جنگ و پیش‌بینی مونت‌کارلو
+
+- resolve_battle: یک جنگ با تابع تصادفی داده‌شده (مورد استفاده GameLogic.simulate_battle)
+- simulate_many: همان فرمول برای هزاران تکرار در یک محاسبه برداری NumPy
+- BattleRandom: مولد قطعی هر جنگ برای بازپخش دقیق جنگ‌های ثبت‌شده
+"""
+import secrets
+import numpy as np
+
+# ضرایب قدرت: (ارتش، دفاع)
+ATTACKER_WEIGHTS = (1.5, 0.5)
+DEFENDER_WEIGHTS = (1.0, 2.0)  # دفاع برای مدافع مهم‌تر است
+LUCK_RANGE = (0.8, 1.2)
+LUCK_POWER = 50
+
+# (حداقل نسبت قدرت، نتیجه، بازه تلفات حمله‌کننده، بازه تلفات مدافع، ضریب غنیمت) به ترتیب نزولی
+OUTCOMES = (
+    (2.0, 'attacker_decisive_win', (0.05, 0.15), (0.6, 0.9), 0.4),
+    (1.2, 'attacker_win', (0.15, 0.25), (0.4, 0.6), 0.3),
+    (0.8, 'draw', (0.3, 0.4), (0.3, 0.4), 0.0),
+    (0.5, 'defender_win', (0.4, 0.6), (0.15, 0.25), 0.0),
+    (None, 'defender_decisive_win', (0.6, 0.9), (0.05, 0.15), 0.0),
+)
+
+# بازه سهم غنیمت از هر منبع مدافع
+LOOT_RANGES = {
+    'gold': (0.5, 1.0),
+    'iron': (0.3, 0.7),
+    'stone': (0.3, 0.7),
+    'food': (0.4, 0.8),
+}
+
+# فیلدهای کشور که در فرمول جنگ استفاده می‌شوند (برای ذخیره ورودی‌های بازپخش)
+ATTACKER_FIELDS = ('army', 'defense')
+DEFENDER_FIELDS = ('army', 'defense') + tuple(LOOT_RANGES)
+
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+
+def _mix(value):
+    # تابع نهایی splitmix64
+    value = (value ^ (value >> 30)) * 0xBF58476D1CE4E5B9 & _MASK
+    value = (value ^ (value >> 27)) * 0x94D049BB133111EB & _MASK
+    return value ^ (value >> 31)
+
+def new_seed():
+    """seed تصادفی جدید (63 بیتی تا در ستون INTEGER هر دو دیتابیس جا شود)"""
+    return secrets.randbits(63)
+
+class BattleRandom:
+    """مولد شمارنده‌ای: عدد nام فقط تابع کلید و n است و وضعیت مشترکی بین نخ‌ها ندارد"""
+
+    def __init__(self, *key):
+        state = 0
+        for part in key:
+            state = _mix((state + _GOLDEN + (part or 0)) & _MASK)
+        self.key = state
+        self.counter = 0
+
+    def random(self):
+        """عدد اعشاری 53 بیتی در بازه [0, 1)"""
+        self.counter += 1
+        return (_mix((self.key + self.counter * _GOLDEN) & _MASK) >> 11) * (1.0 / (1 << 53))
+
+    def uniform(self, a, b):
+        return a + (b - a) * self.random()
+
+def battle_rng(season_id, attacker_id, defender_id, seed):
+    """مولد یک جنگ؛ با همین چهار مقدار همیشه همان دنباله تولید می‌شود"""
+    return BattleRandom(season_id, attacker_id, defender_id, seed)
+
+def battle_inputs(attacker, defender):
+    """وضعیت ورودی جنگ که برای بازپخش کافی است"""
+    return {
+        'attacker': {key: attacker[key] for key in ATTACKER_FIELDS},
+        'defender': {key: defender[key] for key in DEFENDER_FIELDS},
+    }
+
+def _power(country, weights, luck):
+    return country['army'] * weights[0] + country['defense'] * weights[1] + luck * LUCK_POWER
+
+def resolve_battle(attacker, defender, uniform):
+    """نتیجه یک جنگ؛ uniform(a, b) منبع اعداد تصادفی است"""
+    attacker_power = _power(attacker, ATTACKER_WEIGHTS, uniform(*LUCK_RANGE))
+    defender_power = _power(defender, DEFENDER_WEIGHTS, uniform(*LUCK_RANGE))
+    power_ratio = 10.0 if defender_power == 0 else attacker_power / defender_power
+
+    for threshold, result, attacker_loss, defender_loss, loot_multiplier in OUTCOMES:
+        if threshold is None or power_ratio > threshold:
+            break
+
+    attacker_losses = int(attacker['army'] * uniform(*attacker_loss))
+    defender_losses = int(defender['army'] * uniform(*defender_loss))
+
+    # غنائم فقط اگر حمله‌کننده برنده شد
+    if result.startswith('attacker'):
+        loot = {key: int(defender[key] * loot_multiplier * uniform(*spread)) for key, spread in LOOT_RANGES.items()}
+    else:
+        loot = dict.fromkeys(LOOT_RANGES, 0)
+
+    return {
+        'result': result,
+        'attacker_losses': attacker_losses,
+        'defender_losses': defender_losses,
+        'loot': loot,
+        'power_ratio': round(power_ratio, 2),
+        'attacker_power': round(attacker_power, 2),
+        'defender_power': round(defender_power, 2)
+    }
+
+# جدول‌های برداری OUTCOMES
+_THRESHOLDS = np.array(sorted(threshold for threshold, *_ in OUTCOMES if threshold is not None))
+_RANGES = np.array([attacker_loss + defender_loss for _, _, attacker_loss, defender_loss, _ in OUTCOMES])
+_LOOT_MULTIPLIERS = np.array([outcome[4] for outcome in OUTCOMES])
+_ATTACKER_WINS = np.array([outcome[1].startswith('attacker') for outcome in OUTCOMES])
+
+def simulate_many(attacker, defender, trials=10000, rng=None):
+    """پیش‌بینی جنگ با trials تکرار؛ rng می‌تواند seed یا numpy.random.Generator باشد"""
+    rng = np.random.default_rng(rng)
+
+    luck = rng.uniform(*LUCK_RANGE, size=(2, trials))
+    attacker_power = _power(attacker, ATTACKER_WEIGHTS, luck[0])
+    defender_power = _power(defender, DEFENDER_WEIGHTS, luck[1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        power_ratio = np.where(defender_power == 0, 10.0, attacker_power / defender_power)
+
+    # شماره ردیف OUTCOMES: تعداد آستانه‌هایی که نسبت قدرت از آن‌ها بیشتر نیست
+    outcome = len(_THRESHOLDS) - np.searchsorted(_THRESHOLDS, power_ratio, side='left')
+    ranges = _RANGES[outcome]
+    attacker_losses = (attacker['army'] * rng.uniform(ranges[:, 0], ranges[:, 1])).astype(np.int64)
+    defender_losses = (defender['army'] * rng.uniform(ranges[:, 2], ranges[:, 3])).astype(np.int64)
+
+    wins = _ATTACKER_WINS[outcome]
+    multipliers = _LOOT_MULTIPLIERS[outcome]
+    expected_loot = {}
+    for key, spread in LOOT_RANGES.items():
+        loot = (defender[key] * multipliers * rng.uniform(*spread, size=trials)).astype(np.int64)
+        expected_loot[key] = round(float(np.where(wins, loot, 0).mean()), 2)
+
+    counts = np.bincount(outcome, minlength=len(OUTCOMES))
+    return {
+        'trials': trials,
+        'outcomes': {result: round(int(count) / trials, 4) for (_, result, *_), count in zip(OUTCOMES, counts)},
+        'win_probability': round(float(wins.mean()), 4),
+        'expected_attacker_losses': round(float(attacker_losses.mean()), 2),
+        'expected_defender_losses': round(float(defender_losses.mean()), 2),
+        'expected_loot': expected_loot,
+        'power_ratio_percentiles': {
+            f"p{p}": round(float(value), 2) for p, value in zip((10, 50, 90), np.percentile(power_ratio, (10, 50, 90)))
+        }
+    }
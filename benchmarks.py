@@ -0,0 +1,692 @@
+"""
+بنچمارک‌های عملکرد بازی
+
+اجرا:
+    python benchmarks.py                 # همه بنچمارک‌ها
+    python benchmarks.py resource_accrual
+    python benchmarks.py leaderboard
+    python benchmarks.py battle_prediction
+    python benchmarks.py attack_throughput
+    python benchmarks.py broadcast
+    python benchmarks.py telegram_client
+    python benchmarks.py event_journal
+    python benchmarks.py season_archive
+    python benchmarks.py cold_start                   # شکست اگر import برنامه از بودجه زمان بیشتر شود
+    python benchmarks.py webhook                      # بار آزمایشی وب‌هوک با آپدیت‌های مصنوعی
+    python benchmarks.py webhook --save-baseline      # ذخیره نتیجه به عنوان مبنا
+    python benchmarks.py webhook --tolerance 0.3      # شکست در صورت بدتر شدن بیش از ۳۰٪ نسبت به مبنا
+
+بنچمارک‌هایی که نتیجه (dict سناریو -> معیارها) برمی‌گردانند با فایل مبنا مقایسه می‌شوند.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# دیتابیس موقت؛ باید قبل از import کردن app تنظیم شود
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='bench_'), 'game.db'))
+# توکن ساختگی؛ درخواست‌های ربات به Bot API محلی فرستاده می‌شوند
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks_baseline.json')
+
+BENCHMARKS = {}
+
+def benchmark(func):
+    """ثبت یک تابع bench_* در فهرست بنچمارک‌ها"""
+    BENCHMARKS[func.__name__[len('bench_'):]] = func
+    return func
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def seed_players(conn, count, days_ago=0):
+    """ساخت count بازیکن با کشورهای چرخشی در جدول players برنامه"""
+    countries = [row[0] for row in conn.execute('SELECT name FROM countries ORDER BY id').fetchall()]
+    since = datetime.now() - timedelta(days=days_ago)
+    conn.execute('DELETE FROM players')
+    conn.executemany(
+        'INSERT INTO players (user_id, username, country, join_date, resources_at) VALUES (?, ?, ?, ?, ?)',
+        ((1000 + i, f"player_{i}", countries[i % len(countries)], since, since) for i in range(count))
+    )
+    conn.commit()
+
+def logic_db():
+    """Database بازی (طرح جدول‌های database.py) در فایلی جدا از دیتابیس app"""
+    from database import Database
+    return Database(os.path.join(os.path.dirname(os.environ['DATABASE_PATH']), 'logic.db'))
+
+def _nightly_production(conn):
+    # روش قبلی: نوشتن تولید روزانه برای همه بازیکنان، فعال یا غیرفعال
+    conn.execute('''
+        UPDATE players
+        SET gold = players.gold + r.gold, iron = players.iron + r.iron,
+            stone = players.stone + r.stone, food = players.food + r.food
+        FROM production_rates r
+        WHERE r.country = players.country
+    ''')
+    conn.commit()
+
+@benchmark
+def bench_resource_accrual(sizes=(1000, 10000, 100000), active_ratio=0.05):
+    """تولید تنبل منابع: هزینه خواندن بازیکنان فعال در برابر نوشتن شبانه برای همه"""
+    import app
+
+    conn = app.get_db()
+    cursor = conn.cursor()
+    for size in sizes:
+        seed_players(conn, size, days_ago=3)
+        active = [1000 + i for i in range(0, size, int(1 / active_ratio))]
+
+        def read_active():
+            for user_id in active:
+                app.player_resources(cursor, user_id)
+
+        def materialize_active():
+            with app.connections.transaction() as tx:
+                for user_id in active:
+                    app.materialize_player(tx.cursor(), user_id)
+
+        reads, _ = timed(read_active)
+        writes, _ = timed(materialize_active)
+        nightly, _ = timed(_nightly_production, conn)
+        print(f"{size:>7} players, {len(active):>5} active: "
+              f"lazy reads {reads * 1000:8.1f} ms ({reads / len(active) * 1e6:.0f} us/read) "
+              f"| materialize {writes * 1000:8.1f} ms | nightly batch {nightly * 1000:8.1f} ms")
+
+@benchmark
+def bench_leaderboard(sizes=(1000, 10000, 100000), lookups=1000):
+    """رتبه‌بندی: پرسش کامل پایان فصل در برابر فهرست مرتب درون‌پروسسی"""
+    import random
+    import app
+
+    conn = app.get_db()
+    for size in sizes:
+        seed_players(conn, size)
+        # قدرت متفاوت برای هر بازیکن
+        conn.execute('UPDATE players SET gold = (user_id * 7919) % 100003')
+        conn.execute("UPDATE countries SET controller = 'HUMAN'")
+        conn.commit()
+        app.leaderboard.invalidate()
+        user_ids = [1000 + random.randrange(size) for _ in range(lookups)]
+
+        def full_query():
+            # پرسش قبلی دکمه پایان فصل
+            conn.execute('''
+                SELECT p.user_id, p.username, c.name, 
+                       (p.gold + p.iron + p.stone + p.food + p.army * 10 + p.defense * 5) as score
+                FROM players p
+                JOIN countries c ON p.country = c.name
+                WHERE c.controller = 'HUMAN'
+                ORDER BY score DESC
+                LIMIT 10
+            ''').fetchall()
+
+        def refresh_scores():
+            for user_id in user_ids:
+                with app.connections.transaction() as tx:
+                    tx.execute('UPDATE players SET army = army + 1 WHERE user_id = ?', (user_id,))
+                    version = app.leaderboard.bump(tx)
+                app.leaderboard.refresh(user_id, version)
+
+        query, _ = timed(full_query)
+        load, _ = timed(app.leaderboard.top, 10)
+        top, _ = timed(lambda: [app.leaderboard.top(10) for _ in range(lookups)])
+        rank, _ = timed(lambda: [app.leaderboard.rank(user_id) for user_id in user_ids])
+        update, _ = timed(refresh_scores)
+        print(f"{size:>7} players: full query {query * 1000:7.1f} ms | load {load * 1000:7.1f} ms "
+              f"| top10 {top / lookups * 1e6:5.1f} us | rank {rank / lookups * 1e6:5.1f} us "
+              f"| write+refresh {update / lookups * 1e6:6.0f} us")
+
+@benchmark
+def bench_battle_prediction(trials=(1000, 10000, 100000)):
+    """پیش‌بینی مونت‌کارلو: محاسبه برداری در برابر فراخوانی simulate_battle در حلقه"""
+    import random
+    from game_logic import GameLogic
+    from battle import resolve_battle
+
+    db = logic_db()
+    logic = GameLogic(db)
+    db.update_country_military(1, army_size=140)
+    logic.predict_battle(1, 2, 10)  # گرم کردن NumPy
+    attacker, defender = db.get_country_by_id(1), db.get_country_by_id(2)
+    for count in trials:
+        loop, _ = timed(lambda: [logic.simulate_battle(1, 2) for _ in range(count)])
+        pure, _ = timed(lambda: [resolve_battle(attacker, defender, random.uniform) for _ in range(count)])
+        vectorized, prediction = timed(logic.predict_battle, 1, 2, count)
+        print(f"{count:>7} trials: simulate_battle loop {loop * 1000:8.1f} ms "
+              f"| formula loop {pure * 1000:8.1f} ms | vectorized {vectorized * 1000:6.1f} ms "
+              f"({loop / vectorized:.0f}x) | win probability {prediction['win_probability']:.3f}")
+
+@benchmark
+def bench_attack_throughput(threads=(1, 4, 8), attacks_per_thread=250):
+    """حمله اتمیک: تعداد حمله در ثانیه با چند حمله‌کننده همزمان"""
+    import random
+    import threading
+    from game_logic import GameLogic
+
+    db = logic_db()
+    logic = GameLogic(db)
+    country_ids = [row['id'] for row in db.conn.execute('SELECT id FROM countries').fetchall()]
+
+    def resources_total():
+        row = db.conn.execute('SELECT SUM(gold + iron + stone + food) AS total FROM countries').fetchone()
+        return row['total']
+
+    for count in threads:
+        db.reset_game()
+        db.conn.execute('UPDATE countries SET army = 500, gold = 100000, iron = 100000, stone = 100000, food = 100000')
+        db.conn.commit()
+        before = resources_total()
+        failures = []
+
+        def attacker(seed):
+            rng = random.Random(seed)
+            for _ in range(attacks_per_thread):
+                attacker_id, defender_id = rng.sample(country_ids, 2)
+                try:
+                    logic.attack_country(attacker_id, defender_id, None)
+                except Exception as e:
+                    failures.append(e)
+
+        workers = [threading.Thread(target=attacker, args=(i,)) for i in range(count)]
+        elapsed, _ = timed(lambda: ([w.start() for w in workers], [w.join() for w in workers]))
+        done = count * attacks_per_thread - len(failures)
+        # غنائم فقط جابه‌جا می‌شوند؛ مجموع منابع باید ثابت بماند
+        conserved = resources_total() == before
+        print(f"{count:>3} attackers: {done / elapsed:8.0f} attacks/s ({done} attacks, {len(failures)} failed) "
+              f"| resources conserved: {'yes' if conserved else 'NO'}")
+
+class _FakeBotAPI:
+    """سرور محلی شبیه Bot API با محدودیت نرخ تلگرام (پاسخ 429 با retry_after)؛ rate=None یعنی بدون محدودیت"""
+
+    def __init__(self, rate=30, chat_rate=1, latency=0.0):
+        import json
+        import threading
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        from urllib.parse import parse_qs, urlsplit
+
+        self.rate = rate
+        self.chat_interval = 1.0 / chat_rate
+        self.latency = latency
+        self.tokens = float(rate or 0)
+        self.updated = time.monotonic()
+        self.chat_last = {}
+        self.delivered = {}
+        self.rejected = 0
+        self.methods = {}
+        lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                # pyTelegramBotAPI پارامترها را در query string می‌فرستد
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+                params = parse_qs(urlsplit(self.path).query)
+                params.update(parse_qs(body))
+                chat_id = params.get('chat_id', [''])[0]
+                method = urlsplit(self.path).path.rsplit('/', 1)[-1]
+                time.sleep(fake.latency)
+                with lock:
+                    fake.methods[method] = fake.methods.get(method, 0) + 1
+                    allowed = fake._allow(chat_id)
+                    if allowed:
+                        fake.delivered[chat_id] = fake.delivered.get(chat_id, 0) + 1
+                    else:
+                        fake.rejected += 1
+                if allowed and method == 'answerCallbackQuery':
+                    status, payload = 200, {'ok': True, 'result': True}
+                elif allowed:
+                    status, payload = 200, {'ok': True, 'result': {
+                        'message_id': 1, 'date': int(time.time()), 'chat': {'id': 1, 'type': 'private'}, 'text': ''}}
+                else:
+                    status, payload = 429, {'ok': False, 'error_code': 429,
+                                            'description': 'Too Many Requests: retry after 1', 'parameters': {'retry_after': 1}}
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/bot{{0}}/{{1}}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _allow(self, chat_id):
+        if self.rate is None:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # کمی تحمل برای تأخیر شبکه محلی
+        if self.tokens < 0.9 or now - self.chat_last.get(chat_id, -60) < self.chat_interval * 0.9:
+            return False
+        self.tokens -= 1
+        self.chat_last[chat_id] = now
+        return True
+
+@benchmark
+def bench_broadcast(recipients=300, naive=60):
+    """ارسال گروهی: سرعت، تعداد 429 و ادامه پس از توقف در برابر یک Bot API محلی"""
+    import telebot
+    from telebot import apihelper
+    from broadcast import Broadcaster
+    from database import connect
+
+    fake = _FakeBotAPI()
+    apihelper.API_URL = fake.url
+    bot = telebot.TeleBot('0:benchmark', threaded=False)
+    send = lambda chat_id, text, parse_mode: bot.send_message(chat_id, text, parse_mode=parse_mode)
+    connections = connect(os.path.join(os.path.dirname(os.environ['DATABASE_PATH']), 'broadcast.db'))
+
+    # روش قبلی: ارسال پشت سر هم بدون محدودکننده
+    def send_all():
+        for i in range(naive):
+            try:
+                send(f"naive_{i}", 'hello', None)
+            except apihelper.ApiTelegramException:
+                pass
+
+    elapsed, _ = timed(send_all)
+    fake.delivered.clear()
+    rejected_naive, fake.rejected = fake.rejected, 0
+    print(f"   naive: {naive} messages in {elapsed:.2f}s, {rejected_naive} rejected with 429")
+
+    time.sleep(1.5)
+    broadcaster = Broadcaster(connections, send)
+    with connections.transaction() as conn:
+        conn.execute('DELETE FROM broadcast_recipients')
+        conn.execute('DELETE FROM broadcasts')
+    chat_ids = [100000 + i for i in range(recipients)]
+    started = time.perf_counter()
+    broadcast_id = broadcaster.enqueue('📣 benchmark', chat_ids + chat_ids[:10])
+
+    # توقف در میانه کار و ادامه با نمونه‌ای تازه (شبیه راه‌اندازی مجدد)
+    time.sleep(recipients / 30 / 3)
+    broadcaster.stop()
+    sent_before_restart = sum(fake.delivered.values())
+    broadcaster = Broadcaster(connections, send)
+    broadcaster.start()
+    while broadcaster.get_status(1)['running']:
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started
+
+    status = broadcaster.get_status(1)['broadcasts'][0]
+    exactly_once = len(fake.delivered) == recipients and set(fake.delivered.values()) == {1}
+    print(f"   limited: {status['sent']}/{status['total']} sent ({status['failed']} failed) in {elapsed:.2f}s "
+          f"= {status['rate']} msg/s, {fake.rejected} rejected with 429")
+    print(f"   restart after {sent_before_restart} messages | broadcast {broadcast_id} {status['status']} "
+          f"| delivered exactly once: {'yes' if exactly_once else 'NO'}")
+
+@benchmark
+def bench_telegram_client(threads=8, calls=150, edits=25):
+    """کلاینت خروجی: p50/p99 هر متد با اتصال جدید، Session هر ترد و استخر مشترک؛ ادغام ویرایش‌ها"""
+    import threading
+    import statistics
+    import telebot
+    from telebot import apihelper
+    from telegram_client import TelegramClient
+
+    fake = _FakeBotAPI(rate=None, latency=0.001)
+    apihelper.API_URL = fake.url
+    bot = telebot.TeleBot('0:benchmark', threaded=False)
+    methods = {
+        'sendMessage': lambda i: bot.send_message(1, 'hello'),
+        'editMessageText': lambda i: bot.edit_message_text('hello', 1, i),
+        'answerCallbackQuery': lambda i: bot.answer_callback_query(str(i)),
+    }
+
+    def run(label):
+        latencies = {name: [] for name in methods}
+
+        def worker(offset):
+            for i in range(calls):
+                name = list(methods)[i % len(methods)]
+                started = time.perf_counter()
+                methods[name](offset * calls + i)
+                latencies[name].append((time.perf_counter() - started) * 1000)
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        elapsed, _ = timed(lambda: ([w.start() for w in workers], [w.join() for w in workers]))
+        print(f"   {label} ({threads * calls / elapsed:.0f} calls/s)")
+        for name, values in latencies.items():
+            p50 = statistics.median(values)
+            p99 = statistics.quantiles(values, n=100)[98]
+            print(f"      {name:<20} p50 {p50:6.2f} ms   p99 {p99:6.2f} ms")
+
+    defaults = (apihelper.SESSION_TIME_TO_LIVE, apihelper.CUSTOM_REQUEST_SENDER)
+    try:
+        apihelper.SESSION_TIME_TO_LIVE = 0
+        run('new connection per call')
+        apihelper.SESSION_TIME_TO_LIVE = defaults[0]
+        run('per-thread session (pyTelegramBotAPI default)')
+        client = TelegramClient(pool_size=threads).install()
+        run('shared keep-alive pool')
+
+        # چند ترد که یک پیام را پشت سر هم ویرایش می‌کنند (مثل ضربه‌های پیاپی روی یک دکمه)
+        fake.latency = 0.005
+        fake.methods.clear()
+        workers = [threading.Thread(target=lambda: [bot.edit_message_text(f"edit {i}", 1, 7) for i in range(edits)])
+                   for _ in range(threads)]
+        [w.start() for w in workers]
+        [w.join() for w in workers]
+        print(f"   coalescing: {threads * edits} edits of one message, {fake.methods.get('editMessageText', 0)} sent, "
+              f"{client.coalesced} coalesced")
+    finally:
+        apihelper.SESSION_TIME_TO_LIVE, apihelper.CUSTOM_REQUEST_SENDER = defaults
+        fake.server.shutdown()
+
+@benchmark
+def bench_event_journal(events=20000, page=50):
+    """رویدادها: commit جداگانه هر رویداد در برابر نوشتن دسته‌ای، و صفحه‌بندی OFFSET در برابر مکان‌نما"""
+    from events import EventJournal, partition_table
+
+    db = logic_db()
+    db.events.drop_all()
+    conn = db.conn
+
+    def insert_each():
+        # روش قبلی add_event: یک INSERT و یک commit برای هر رویداد
+        conn.execute('CREATE TABLE IF NOT EXISTS events_single (id INTEGER PRIMARY KEY AUTOINCREMENT, season_id INTEGER, '
+                     'event_type TEXT, from_country_id INTEGER, to_country_id INTEGER, description TEXT, created_at TIMESTAMP)')
+        for i in range(events):
+            conn.execute('INSERT INTO events_single (season_id, event_type, from_country_id, to_country_id, description, created_at) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', (1, 'WAR', 1, 2, f"event {i}", datetime.now()))
+            conn.commit()
+
+    journal = EventJournal(db.connections, flush_interval=0)
+
+    def append_all():
+        for i in range(events):
+            journal.append(1, 'WAR', 1, 2, f"event {i}")
+        journal.flush()
+
+    single, _ = timed(insert_each)
+    batched, _ = timed(append_all)
+    print(f"   write {events} events: commit each {events / single:8.0f} events/s | "
+          f"batched ({journal.batch_size}/commit) {events / batched:8.0f} events/s")
+
+    table = partition_table(1)
+
+    def read_offset():
+        for offset in range(0, events, page):
+            conn.execute(f'SELECT * FROM {table} ORDER BY id LIMIT ? OFFSET ?', (page, offset)).fetchall()
+
+    def read_cursor():
+        after_id = 0
+        while after_id is not None:
+            _, after_id = journal.page(1, after_id, page)
+
+    offset, _ = timed(read_offset)
+    cursor, _ = timed(read_cursor)
+    print(f"   read all in pages of {page}: OFFSET {offset * 1000:7.1f} ms | cursor {cursor * 1000:7.1f} ms")
+
+    dropped, _ = timed(journal.drop_season, 1)
+    print(f"   drop season ({events} events): {dropped * 1000:.1f} ms")
+    conn.execute('DROP TABLE events_single')
+    conn.commit()
+
+@benchmark
+def bench_season_archive(battles=20000, page=50):
+    """بایگانی فصل: زمان نوشتن، اندازه فایل و خواندن تنبل یک صفحه از بایگانی"""
+    db = logic_db()
+    db.reset_game()
+    db.archiver.directory = os.path.join(os.path.dirname(os.environ['DATABASE_PATH']), 'archive')
+    season_id = db.start_season(1)
+    with db.connections.transaction() as conn:
+        conn.executemany(
+            'INSERT INTO battles (season_id, attacker_id, defender_id, result, loot, seed, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((season_id, 1 + i % 10, 1 + (i + 1) % 10, 'attacker', '{"gold": 10}', i, datetime.now()) for i in range(battles))
+        )
+    for i in range(battles):
+        db.add_event(season_id, 'WAR', 1 + i % 10, 1 + (i + 1) % 10, f"event {i}")
+
+    elapsed, _ = timed(db.end_season, season_id, 1, None)
+    archive = db.get_season_history(1)[0]['archive']
+    size = sum(os.path.getsize(os.path.join(archive.path, name)) for name in os.listdir(archive.path))
+    print(f"   archive {battles} battles + {battles} events: {elapsed * 1000:7.1f} ms | {size / 1024:7.1f} KB on disk")
+
+    middle, rows = timed(lambda: list(archive.rows('battles', battles // 2, page)))
+    full, _ = timed(lambda: sum(1 for _ in archive.rows('battles')))
+    print(f"   read {len(rows)} battles from the middle: {middle * 1000:6.2f} ms | all battles: {full * 1000:7.1f} ms")
+    archive.close()
+
+@benchmark
+def bench_cold_start(runs=5, budget_ms=1500):
+    """شروع سرد: زمان import برنامه و اولین درخواست با دیتابیس تازه و دیتابیس آماده (پروسس جدید در هر اجرا)"""
+    import subprocess
+
+    script = (
+        "import json, time\n"
+        "started = time.perf_counter()\n"
+        "import app\n"
+        "imported = time.perf_counter()\n"
+        "app.app.test_client().get('/stats')\n"
+        "finished = time.perf_counter()\n"
+        "app.broadcaster.stop()\n"
+        "print(json.dumps({'import_ms': (imported - started) * 1000, 'total_ms': (finished - started) * 1000, **app.startup}))\n"
+    )
+    directory = tempfile.mkdtemp(prefix='bench_cold_')
+    # آماده‌سازی پس‌زمینه خاموش است تا زمان اولین پاسخ شامل ساخت دیتابیس باشد
+    env = {**os.environ, 'DB_WARMUP': '0'}
+    env.pop('DATABASE_URL', None)
+
+    def run(path):
+        output = subprocess.run([sys.executable, '-c', script], env={**env, 'DATABASE_PATH': path},
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    results = {}
+    for scenario in ('fresh_db', 'warm_db'):
+        samples = []
+        for i in range(runs):
+            path = os.path.join(directory, f"{scenario}_{i}.db" if scenario == 'fresh_db' else 'warm.db')
+            if scenario == 'warm_db' and i == 0:
+                run(path)
+            samples.append(run(path))
+
+        totals = [sample['total_ms'] for sample in samples]
+        over_budget = sum(sample['import_ms'] > budget_ms for sample in samples)
+        results[scenario] = {
+            'import_ms': round(_percentile([sample['import_ms'] for sample in samples], 50), 1),
+            'database_ms': round(_percentile([sample['database_ms'] for sample in samples], 50), 1),
+            'p50_ms': round(_percentile(totals, 50), 1),
+            'p95_ms': round(_percentile(totals, 95), 1),
+            'failures': over_budget,
+        }
+        result = results[scenario]
+        print(f"   {scenario:<9} import {result['import_ms']:6.0f} ms | database init {result['database_ms']:5.1f} ms "
+              f"| to first response p50 {result['p50_ms']:6.0f} p95 {result['p95_ms']:6.0f} ms "
+              f"| {over_budget}/{runs} imports over {budget_ms} ms budget")
+    return results
+
+def _update(update_id, user_id, text=None, data=None):
+    """آپدیت مصنوعی تلگرام: پیام متنی یا فشردن دکمه (هر آپدیت پیام جداگانه‌ای دارد)"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}", 'username': f"user{user_id}"}
+    chat = {'id': user_id, 'type': 'private'}
+    if data is None:
+        message = {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'chat_instance': str(user_id), 'data': data, 'from': user,
+        'message': {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'text': 'menu'}}}
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+@benchmark
+def bench_webhook(rounds=3, players=50):
+    """بار آزمایشی وب‌هوک: سرعت، p50/p95/p99 و تعداد پرسش SQL و درخواست Bot API برای هر سناریو"""
+    from telebot import apihelper
+    import app
+    from sql_profiler import profiler
+
+    fake = _FakeBotAPI(rate=None)
+    apihelper.API_URL = fake.url
+    # پردازش آپدیت در همان درخواست (مثل ترد workerهای dispatcher) تا زمان پاسخ کل کار را بسنجد
+    app.bot.threaded = False
+    client = app.app.test_client()
+    path = '/' + app.TOKEN
+
+    conn = app.get_db()
+    seed_players(conn, players)
+    app.leaderboard.invalidate()
+    app.catalog.invalidate()
+    countries = [row[0] for row in conn.execute('SELECT name FROM countries ORDER BY id').fetchall()]
+    player_ids = [1000 + i for i in range(players)]
+    owner = app.OWNER_ID
+    player_routes = ('main_menu', 'my_country', 'view_resources', 'view_countries', 'leaderboard')
+    owner_routes = ('main_menu', 'add_player', 'view_countries', 'leaderboard', 'reset_game')
+
+    ids = iter(range(1, 10 ** 9))
+
+    def add_player_flow():
+        # مالک کشور را انتخاب و آیدی بازیکن را ارسال می‌کند؛ در پایان هر دور بازی ریست می‌شود
+        for _ in range(rounds):
+            for i, country in enumerate(countries):
+                yield _update(next(ids), owner, data=f"select_{country}")
+                yield _update(next(ids), owner, text=str(5000 + i))
+            yield _update(next(ids), owner, data='confirm_reset')
+
+    scenarios = {
+        'start': lambda: (_update(next(ids), 100000 + i, text='/start') for i in range(100 * rounds)),
+        'player_callbacks': lambda: (_update(next(ids), player_ids[i % players], data=player_routes[i % len(player_routes)])
+                                     for i in range(100 * rounds)),
+        'owner_callbacks': lambda: (_update(next(ids), owner, data=owner_routes[i % len(owner_routes)])
+                                    for i in range(50 * rounds)),
+        'seasons': lambda: (_update(next(ids), owner, data=('start_season', 'end_season')[i % 2]) for i in range(10 * rounds)),
+        'add_player': add_player_flow,
+    }
+
+    def total_queries():
+        return sum(row['calls'] for row in profiler.report(limit=None))
+
+    results = {}
+    for name, updates in scenarios.items():
+        updates = [json.dumps(update) for update in updates()]
+        latencies = []
+        failures = 0
+        queries_before, api_before = total_queries(), sum(fake.methods.values())
+        started = time.perf_counter()
+        for body in updates:
+            request_started = time.perf_counter()
+            try:
+                status = client.post(path, data=body, content_type='application/json').status_code
+            except Exception:
+                status = None
+            latencies.append((time.perf_counter() - request_started) * 1000)
+            failures += status != 200
+        elapsed = time.perf_counter() - started
+
+        count = len(updates)
+        results[name] = {
+            'updates': count,
+            'throughput': round(count / elapsed, 1),
+            'p50_ms': round(_percentile(latencies, 50), 3),
+            'p95_ms': round(_percentile(latencies, 95), 3),
+            'p99_ms': round(_percentile(latencies, 99), 3),
+            'queries_per_update': round((total_queries() - queries_before) / count, 2),
+            'api_calls_per_update': round((sum(fake.methods.values()) - api_before) / count, 2),
+            'failures': failures,
+        }
+        result = results[name]
+        print(f"   {name:<17} {result['throughput']:>8.0f} upd/s | p50 {result['p50_ms']:6.2f} p95 {result['p95_ms']:6.2f} "
+              f"p99 {result['p99_ms']:6.2f} ms | {result['queries_per_update']:5.1f} queries, "
+              f"{result['api_calls_per_update']:.1f} API calls per update | {failures} failed")
+
+    app.broadcaster.stop()
+    fake.server.shutdown()
+    return results
+
+# معیارهای مقایسه با مبنا: (نام، آیا مقدار جدید نسبت به مبنا بدتر است)
+_REGRESSION_CHECKS = (
+    ('p95_ms', lambda new, base, tolerance: new > base * (1 + tolerance) + 2),
+    ('p99_ms', lambda new, base, tolerance: new > base * (1 + tolerance) + 2),
+    ('throughput', lambda new, base, tolerance: new < base * (1 - tolerance)),
+    ('queries_per_update', lambda new, base, tolerance: new > base * 1.1 + 0.5),
+    ('failures', lambda new, base, tolerance: new > base),
+)
+
+def compare_baseline(name, results, baseline, tolerance):
+    """فهرست بدتر شدن‌ها نسبت به مبنا؛ زمان‌ها ۲ میلی‌ثانیه حاشیه نویز دارند و تعداد پرسش‌ها (قطعی) فقط ۱۰٪"""
+    regressions = []
+    for scenario, result in results.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        for metric, regressed in _REGRESSION_CHECKS:
+            if metric in result and metric in base and regressed(result[metric], base[metric], tolerance):
+                regressions.append(f"{name}.{scenario}.{metric}: {base[metric]} -> {result[metric]}")
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='بنچمارک‌های عملکرد بازی')
+    parser.add_argument('names', nargs='*', help=f"available: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='فایل مبنا (JSON)')
+    parser.add_argument('--save-baseline', action='store_true', help='ذخیره نتیجه‌ها به عنوان مبنای جدید')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='بدتر شدن مجاز زمان‌ها نسبت به مبنا')
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    for name in args.names:
+        if name not in BENCHMARKS:
+            print(f"unknown benchmark: {name} (available: {', '.join(BENCHMARKS)})")
+            return 1
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    elif not args.save_baseline:
+        # بدون مبنا هیچ بدتر شدنی دیده نمی‌شود؛ اجرای بدون مبنا خطاست
+        print(f"baseline {args.baseline} not found; run with --save-baseline to create it")
+        return 1
+
+    regressions = []
+    for name in args.names or BENCHMARKS:
+        print(f"== {name}: {BENCHMARKS[name].__doc__}")
+        results = BENCHMARKS[name]()
+        if not isinstance(results, dict):
+            continue
+        # شکست (مثل خطای درخواست یا عبور از بودجه زمان) حتی بدون مبنا گزارش می‌شود
+        regressions += [f"{name}.{scenario}.failures: {result['failures']}"
+                        for scenario, result in results.items() if result.get('failures')]
+        if args.save_baseline:
+            baseline[name] = results
+        elif name in baseline:
+            regressions += compare_baseline(name, results, baseline[name], args.tolerance)
+        else:
+            regressions.append(f"{name}: no baseline entry (run with --save-baseline)")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"baseline saved to {args.baseline}")
+    if regressions:
+        print(f"REGRESSION against {args.baseline}:")
+        for regression in regressions:
+            print(f"   {regression}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
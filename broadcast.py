@@ -0,0 +1,347 @@
+"""
+ارسال گروهی پیام با رعایت محدودیت‌های نرخ تلگرام
+
+- سطل توکن سراسری (پیش‌فرض ۳۰ پیام در ثانیه) و فاصله حداقل برای هر چت (۱ پیام در ثانیه)
+- توقف کل ارسال به اندازه retry_after پس از پاسخ 429
+- گیرنده‌ای که ارسالش خطا داد با next_attempt_at به انتهای صف می‌رود و ارسال به بقیه ادامه می‌یابد
+- وضعیت هر گیرنده در دیتابیس ذخیره می‌شود تا پس از راه‌اندازی مجدد ارسال از همان‌جا ادامه یابد
+- قفل در دیتابیس تا با چند پروسس gunicorn هر پیام فقط یک بار ارسال شود
+"""
+import os
+import time
+import atexit
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from config import BROADCAST_RATE, BROADCAST_CHAT_RATE, BROADCAST_MAX_ATTEMPTS
+from production import parse_time
+from database import ensure_column
+
+logger = logging.getLogger(__name__)
+
+# خطاهایی که تکرار ارسال فایده‌ای ندارد (چت نامعتبر، ربات مسدود شده)
+_PERMANENT_ERRORS = (400, 403)
+
+def _values(row):
+    return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+def _retry_after(error):
+    """مدت انتظار درخواستی تلگرام در خطای 429، یا None"""
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    parameters = (getattr(error, 'result_json', None) or {}).get('parameters') or {}
+    return float(parameters.get('retry_after', 1))
+
+class TokenBucket:
+    """سطل توکن با ظرفیت یک ثانیه ارسال"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """برداشتن یک توکن؛ خروجی: چند ثانیه تا مجاز شدن ارسال باید صبر کرد"""
+        with self._lock:
+            now = time.monotonic()
+            if now > self.updated:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+            self.tokens -= 1
+            return max(0.0, self.updated - now + max(0.0, -self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """عدم صدور توکن تا seconds ثانیه بعد (پس از 429)"""
+        with self._lock:
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+class Broadcaster:
+    """صف ارسال گروهی با وضعیت ذخیره‌شده در جدول‌های broadcasts و broadcast_recipients"""
+
+    def __init__(self, connections, send, rate=BROADCAST_RATE, chat_rate=BROADCAST_CHAT_RATE,
+                 max_attempts=BROADCAST_MAX_ATTEMPTS, lock_timeout=120, batch_size=100):
+        self.connections = connections
+        self.send = send  # send(chat_id, text, parse_mode)
+        self.limiter = TokenBucket(rate)
+        self.chat_interval = 1.0 / chat_rate
+        self._chat_next = {}
+        self.max_attempts = max_attempts
+        self.lock_timeout = lock_timeout
+        self.batch_size = batch_size
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self.stats = {'sent': 0, 'failed': 0, 'rate_limited': 0, 'retries': 0}
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.connections.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT,
+                    parse_mode TEXT,
+                    status TEXT DEFAULT 'pending', -- 'pending', 'sending', 'done'
+                    total INTEGER DEFAULT 0,
+                    sent INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    send_seconds REAL DEFAULT 0, -- زمان صرف‌شده برای ارسال (برای محاسبه سرعت)
+                    created_at TIMESTAMP,
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    locked_by TEXT,
+                    locked_until TIMESTAMP
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                    broadcast_id INTEGER,
+                    chat_id TEXT,
+                    status TEXT DEFAULT 'pending', -- 'pending', 'sent', 'failed'
+                    attempts INTEGER DEFAULT 0,
+                    error TEXT,
+                    sent_at TIMESTAMP,
+                    next_attempt_at TIMESTAMP, -- زمان تلاش دوباره پس از خطای موقت
+                    PRIMARY KEY (broadcast_id, chat_id)
+                )
+            ''')
+            ensure_column(conn, 'broadcast_recipients', 'next_attempt_at', 'TIMESTAMP')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients (broadcast_id, status)')
+
+    def enqueue(self, text, recipients, parse_mode=None):
+        """ثبت پیام و گیرندگان در صف؛ ارسال در ترد پس‌زمینه انجام می‌شود"""
+        chat_ids = list(dict.fromkeys(str(chat_id) for chat_id in recipients if chat_id))
+        with self.connections.transaction() as conn:
+            row = conn.execute('''
+                INSERT INTO broadcasts (text, parse_mode, total, created_at)
+                VALUES (?, ?, ?, ?)
+                RETURNING id
+            ''', (text, parse_mode, len(chat_ids), datetime.now())).fetchone()
+            broadcast_id = _values(row)[0]
+            conn.executemany('INSERT INTO broadcast_recipients (broadcast_id, chat_id) VALUES (?, ?)',
+                             [(broadcast_id, chat_id) for chat_id in chat_ids])
+
+        logger.info(f"Broadcast {broadcast_id} queued for {len(chat_ids)} recipients")
+        self.start()
+        return broadcast_id
+
+    def start(self):
+        """راه‌اندازی ترد ارسال (ادامه ارسال‌های ناتمام پس از راه‌اندازی مجدد)"""
+        with self._lock:
+            self._wakeup.set()
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='broadcaster', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        """توقف ترد ارسال؛ گیرندگان باقی‌مانده در دیتابیس منتظر اجرای بعدی می‌مانند"""
+        self._stopping.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                broadcast = self._claim()
+                if broadcast is not None:
+                    self._process(*broadcast)
+                    continue
+                wait = self._foreign_lock_wait()
+            except Exception as e:
+                logger.error(f"Broadcaster error: {e}")
+                wait = 5
+
+            # اتصال در زمان انتظار یا پس از پایان ترد در استخر بماند
+            self.connections.release()
+            with self._lock:
+                if wait is None and not self._wakeup.is_set():
+                    self._thread = None
+                    return
+            self._wakeup.wait(wait or 0)
+
+        self.connections.release()
+        with self._lock:
+            self._thread = None
+
+    def _claim(self):
+        """قفل کردن قدیمی‌ترین ارسال ناتمام؛ خروجی: (شناسه، متن، parse_mode) یا None"""
+        conn = self.connections.get()
+        candidates = conn.execute("SELECT id FROM broadcasts WHERE status != 'done' ORDER BY id").fetchall()
+        now = datetime.now()
+        for row in candidates:
+            broadcast_id = _values(row)[0]
+            with self.connections.transaction() as tx:
+                cursor = tx.execute('''
+                    UPDATE broadcasts
+                    SET status = 'sending', locked_by = ?, locked_until = ?, started_at = COALESCE(started_at, ?)
+                    WHERE id = ? AND status != 'done'
+                      AND (locked_until IS NULL OR locked_until < ? OR locked_by = ?)
+                ''', (self.owner, now + timedelta(seconds=self.lock_timeout), now, broadcast_id, now, self.owner))
+                claimed = cursor.rowcount == 1
+            if claimed:
+                row = conn.execute('SELECT id, text, parse_mode FROM broadcasts WHERE id = ?', (broadcast_id,)).fetchone()
+                return _values(row)
+        return None
+
+    def _foreign_lock_wait(self):
+        """ثانیه تا آزاد شدن قفل ارسالی که پروسس دیگری گرفته است، یا None"""
+        row = self.connections.get().execute(
+            "SELECT MIN(locked_until) FROM broadcasts WHERE status != 'done'"
+        ).fetchone()
+        locked_until = _values(row)[0]
+        if locked_until is None:
+            return None
+        if isinstance(locked_until, str):
+            locked_until = datetime.fromisoformat(locked_until)
+        return min(self.lock_timeout, max(1.0, (locked_until - datetime.now()).total_seconds()))
+
+    def _process(self, broadcast_id, text, parse_mode):
+        logger.info(f"Broadcast {broadcast_id} sending")
+        conn = self.connections.get()
+        checkpoint = time.monotonic()
+
+        while not self._stopping.is_set():
+            rows = conn.execute('''
+                SELECT chat_id, attempts FROM broadcast_recipients
+                WHERE broadcast_id = ? AND status = 'pending'
+                  AND (next_attempt_at IS NULL OR next_attempt_at <= ?)
+                ORDER BY chat_id
+                LIMIT ?
+            ''', (broadcast_id, datetime.now(), self.batch_size)).fetchall()
+            if not rows:
+                retry_at = self._next_attempt_at(broadcast_id)
+                if retry_at is None:
+                    break
+                # فقط گیرندگانی مانده‌اند که زمان تلاش دوباره‌شان نرسیده است؛ قفل در checkpoint تمدید می‌شود
+                self._stopping.wait(min(self.lock_timeout / 2, max(0.0, (retry_at - datetime.now()).total_seconds())))
+
+            for row in rows:
+                if self._stopping.is_set():
+                    break
+                self._deliver(broadcast_id, text, parse_mode, *_values(row))
+
+            # تمدید قفل و ثبت زمان صرف‌شده
+            now = time.monotonic()
+            self._checkpoint(broadcast_id, now - checkpoint)
+            checkpoint = now
+        else:
+            self._checkpoint(broadcast_id, time.monotonic() - checkpoint, release=True)
+            return
+
+        self._checkpoint(broadcast_id, time.monotonic() - checkpoint, done=True)
+        row = conn.execute('SELECT sent, failed, send_seconds FROM broadcasts WHERE id = ?', (broadcast_id,)).fetchone()
+        sent, failed, seconds = _values(row)
+        logger.info(f"Broadcast {broadcast_id} done: {sent} sent, {failed} failed, "
+                    f"{sent / seconds if seconds else 0:.1f} msg/s")
+
+    def _next_attempt_at(self, broadcast_id):
+        """نزدیک‌ترین زمان تلاش دوباره گیرندگان در انتظار، یا None اگر گیرنده‌ای نمانده است"""
+        row = self.connections.get().execute('''
+            SELECT COUNT(*), MIN(next_attempt_at) FROM broadcast_recipients
+            WHERE broadcast_id = ? AND status = 'pending'
+        ''', (broadcast_id,)).fetchone()
+        pending, retry_at = _values(row)
+        if not pending:
+            return None
+        return parse_time(retry_at) or datetime.now()
+
+    def _checkpoint(self, broadcast_id, elapsed, done=False, release=False):
+        now = datetime.now()
+        with self.connections.transaction() as conn:
+            if done:
+                conn.execute('''
+                    UPDATE broadcasts
+                    SET status = 'done', finished_at = ?, send_seconds = send_seconds + ?, locked_by = NULL, locked_until = NULL
+                    WHERE id = ?
+                ''', (now, elapsed, broadcast_id))
+            elif release:
+                conn.execute('''
+                    UPDATE broadcasts
+                    SET send_seconds = send_seconds + ?, locked_by = NULL, locked_until = NULL
+                    WHERE id = ? AND locked_by = ?
+                ''', (elapsed, broadcast_id, self.owner))
+            else:
+                conn.execute('''
+                    UPDATE broadcasts
+                    SET send_seconds = send_seconds + ?, locked_until = ?
+                    WHERE id = ? AND locked_by = ?
+                ''', (elapsed, now + timedelta(seconds=self.lock_timeout), broadcast_id, self.owner))
+
+    def _chat_wait(self, chat_id):
+        # فاصله حداقل بین دو پیام به یک چت (سطل توکن با ظرفیت یک)
+        now = time.monotonic()
+        if len(self._chat_next) > 10000:
+            self._chat_next = {key: at for key, at in self._chat_next.items() if at > now}
+        next_at = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = next_at + self.chat_interval
+        return next_at - now
+
+    def _deliver(self, broadcast_id, text, parse_mode, chat_id, attempts):
+        wait = max(self.limiter.reserve(), self._chat_wait(chat_id))
+        if wait > 0 and self._stopping.wait(wait):
+            return
+
+        next_attempt_at = None
+        try:
+            self.send(chat_id, text, parse_mode)
+            status, error = 'sent', None
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                # گیرنده در وضعیت pending می‌ماند و در دور بعد دوباره ارسال می‌شود
+                self.stats['rate_limited'] += 1
+                self.limiter.pause(retry_after)
+                logger.warning(f"Broadcast {broadcast_id} rate limited, pausing {retry_after:.0f}s")
+                return
+
+            attempts += 1
+            error = str(e)[:500]
+            if getattr(e, 'error_code', None) in _PERMANENT_ERRORS or attempts >= self.max_attempts:
+                status = 'failed'
+            else:
+                # تلاش دوباره پس از چند ثانیه؛ ارسال به گیرندگان دیگر منتظر این چت نمی‌ماند
+                status = 'pending'
+                next_attempt_at = datetime.now() + timedelta(seconds=min(2 ** attempts, 30))
+                self.stats['retries'] += 1
+
+        with self.connections.transaction() as conn:
+            conn.execute('''
+                UPDATE broadcast_recipients
+                SET status = ?, attempts = ?, error = ?, sent_at = ?, next_attempt_at = ?
+                WHERE broadcast_id = ? AND chat_id = ?
+            ''', (status, attempts, error, datetime.now() if status == 'sent' else None,
+                  next_attempt_at, broadcast_id, chat_id))
+            if status != 'pending':
+                conn.execute('UPDATE broadcasts SET sent = sent + ?, failed = failed + ? WHERE id = ?',
+                             (int(status == 'sent'), int(status == 'failed'), broadcast_id))
+        if status != 'pending':
+            self.stats[status] += 1
+
+    def get_status(self, limit=5):
+        """وضعیت آخرین ارسال‌ها همراه با سرعت (پیام در ثانیه)"""
+        cursor = self.connections.get().execute('''
+            SELECT id, status, total, sent, failed, send_seconds, created_at, finished_at
+            FROM broadcasts
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (limit,))
+        columns = [description[0] for description in cursor.description]
+        broadcasts = []
+        for row in cursor.fetchall():
+            broadcast = dict(zip(columns, _values(row)))
+            seconds = broadcast['send_seconds']
+            broadcast['rate'] = round(broadcast['sent'] / seconds, 2) if seconds else None
+            broadcasts.append(broadcast)
+        return {'running': self._thread is not None, **self.stats, 'broadcasts': broadcasts}
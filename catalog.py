@@ -0,0 +1,114 @@
+"""
+کش درون‌پروسسی فهرست کشورها
+
+فقط فیلدهای ثابت و مالکیت کشورها (شناسه، نام، منبع ویژه، کنترل‌کننده، بازیکن)
+نگهداری می‌شوند؛ منابع و ارتش همچنان از دیتابیس خوانده می‌شوند.
+هر نوشتن روی مالکیت، شمارنده نسخه در جدول catalog_versions را افزایش می‌دهد
+تا پروسس‌های دیگر gunicorn هم کش خود را تازه کنند.
+"""
+import time
+import threading
+from config import CATALOG_SYNC_INTERVAL
+
+def ensure_version(conn, name):
+    """ساخت جدول نسخه‌ها و ردیف name در صورت نبود"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER DEFAULT 0
+        )
+    ''')
+    conn.execute('INSERT INTO catalog_versions (name, version) VALUES (?, 0) ON CONFLICT DO NOTHING', (name,))
+
+def read_version(conn, name):
+    row = conn.execute('SELECT version FROM catalog_versions WHERE name = ?', (name,)).fetchone()
+    return row['version'] if isinstance(row, dict) else row[0]
+
+def bump_version(conn, name):
+    """افزایش نسخه در تراکنش نوشتن؛ خروجی: نسخه جدید"""
+    row = conn.execute('UPDATE catalog_versions SET version = version + 1 WHERE name = ? RETURNING version', (name,)).fetchone()
+    return row['version'] if isinstance(row, dict) else row[0]
+
+class CountryCatalog:
+    """کش کشورها با کلید شناسه و نام"""
+
+    def __init__(self, connections, sync_interval=CATALOG_SYNC_INTERVAL):
+        self.connections = connections
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        # (کشورها بر اساس شناسه، کشورها بر اساس نام)؛ به صورت یکجا جایگزین می‌شود
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0
+        self.stats = {'hits': 0, 'loads': 0}
+        self._create_table()
+
+    def _create_table(self):
+        with self.connections.transaction() as conn:
+            ensure_version(conn, 'countries')
+
+    def _read_version(self, conn):
+        return read_version(conn, 'countries')
+
+    def _load(self):
+        conn = self.connections.get()
+        version = self._read_version(conn)
+        cursor = conn.execute('''
+            SELECT c.id, c.name, c.special_resource, c.controller, c.player_id, p.username
+            FROM countries c
+            LEFT JOIN players p ON c.player_id = p.user_id
+            ORDER BY c.id
+        ''')
+        columns = [description[0] for description in cursor.description]
+        countries = [row if isinstance(row, dict) else dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        self._snapshot = (
+            {country['id']: country for country in countries},
+            {country['name']: country for country in countries},
+        )
+        self._version = version
+        self._checked_at = time.monotonic()
+        self.stats['loads'] += 1
+        return self._snapshot
+
+    def _current(self):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            if not self.sync_interval or time.monotonic() - self._checked_at < self.sync_interval:
+                self.stats['hits'] += 1
+                return snapshot
+            # بررسی نسخه حداکثر یک بار در هر sync_interval ثانیه
+            if self._read_version(self.connections.get()) == self._version:
+                self._checked_at = time.monotonic()
+                self.stats['hits'] += 1
+                return snapshot
+
+        with self._lock:
+            return self._load()
+
+    def version(self):
+        """نسخه داده‌های فعلی کش (برای کلید کش‌های وابسته مانند کیبوردها)"""
+        self._current()
+        return self._version
+
+    def all(self):
+        """همه کشورها به ترتیب شناسه"""
+        return list(self._current()[0].values())
+
+    def available(self):
+        """کشورهای آزاد (تحت کنترل AI)"""
+        return [country for country in self.all() if country['controller'] == 'AI']
+
+    def get(self, country_id):
+        return self._current()[0].get(country_id)
+
+    def by_name(self, name):
+        return self._current()[1].get(name)
+
+    def bump(self, conn):
+        """افزایش نسخه در همان تراکنش نوشتن؛ پس از commit باید invalidate فراخوانی شود"""
+        bump_version(conn, 'countries')
+
+    def invalidate(self):
+        """پاک کردن کش این پروسس؛ بارگذاری بعدی از دیتابیس انجام می‌شود"""
+        self._snapshot = None
@@ -4,9 +4,18 @@ import os
 OWNER_ID = 8588773170
 BOT_TOKEN = os.environ.get('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 CHANNEL_ID = os.environ.get('CHANNEL_ID', '@your_channel_username')
+NEWS_CHANNEL_URL = os.environ.get('NEWS_CHANNEL_URL', f"https://t.me/{CHANNEL_ID.lstrip('@')}")
 
 # تنظیمات دیتابیس
 DATABASE_PATH = os.environ.get('DATABASE_PATH', 'game.db')
+# در صورت تنظیم، به جای SQLite از PostgreSQL استفاده می‌شود
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+# هر ترد تا پایان درخواست یا کار پس‌زمینه یک اتصال از استخر نگه می‌دارد؛ DB_POOL_MAX باید از مجموع
+# تردهای هم‌زمان هر پروسس (تردهای وب‌سرور + DISPATCHER_WORKERS + تردهای telebot + ارسال گروهی و رویدادها) بیشتر باشد
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 20))
+# آماده‌سازی دیتابیس در ترد پس‌زمینه بلافاصله پس از import (0: فقط در اولین درخواست)
+DB_WARMUP = os.environ.get('DB_WARMUP', '1') == '1'
 
 # لیست کشورهای باستانی
 ANCIENT_COUNTRIES = [
@@ -30,9 +39,73 @@ BASE_RESOURCES = {
     'food': 100
 }
 
+# تولید روزانه منابع بر اساس نام کشور
+DAILY_PRODUCTION = {
+    'هخامنشیان': {'gold': 80, 'iron': 40, 'stone': 30, 'food': 60},
+    'رومیان': {'gold': 60, 'iron': 80, 'stone': 50, 'food': 50},
+    'مغول‌ها': {'gold': 40, 'iron': 60, 'stone': 20, 'food': 80},
+    'اسپارتان‌ها': {'gold': 50, 'iron': 70, 'stone': 40, 'food': 40},
+    'وایکینگ‌ها': {'gold': 70, 'iron': 50, 'stone': 30, 'food': 70},
+    'سامورایی‌ها': {'gold': 65, 'iron': 60, 'stone': 35, 'food': 55},
+    'مصریان': {'gold': 90, 'iron': 30, 'stone': 45, 'food': 60},
+    'عثمانی‌ها': {'gold': 70, 'iron': 70, 'stone': 40, 'food': 50},
+    'مایاها': {'gold': 50, 'iron': 40, 'stone': 70, 'food': 60},
+    'بریتانیا': {'gold': 75, 'iron': 50, 'stone': 30, 'food': 70},
+    'فرانک‌ها': {'gold': 60, 'iron': 80, 'stone': 40, 'food': 40},
+    'چینی‌ها': {'gold': 70, 'iron': 50, 'stone': 80, 'food': 60}
+}
+DEFAULT_PRODUCTION = {'gold': 50, 'iron': 40, 'stone': 30, 'food': 50}
+
 # تنظیمات فصل
 SEASON_DURATION = 7  # روز
 
 # تنظیمات سرور
 WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
 PORT = int(os.environ.get('PORT', 5000))
+
+# تنظیمات صف وب‌هوک
+WEBHOOK_ASYNC = os.environ.get('WEBHOOK_ASYNC', '0') == '1'
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 1000))
+DISPATCHER_WORKERS = int(os.environ.get('DISPATCHER_WORKERS', 4))
+DISPATCHER_DRAIN_TIMEOUT = float(os.environ.get('DISPATCHER_DRAIN_TIMEOUT', 25))
+
+# تنظیمات اتصال SQLite
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5))  # ثانیه
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16384))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+
+# زمان‌بندی کارهای worker (قالب cron)
+CLEANUP_SCHEDULE = os.environ.get('CLEANUP_SCHEDULE', '0 3 * * *')
+
+# فاصله بررسی نسخه کش کشورها بین پروسس‌ها (ثانیه، 0 = بدون بررسی)
+CATALOG_SYNC_INTERVAL = float(os.environ.get('CATALOG_SYNC_INTERVAL', 5))
+
+# ارسال گروهی پیام (محدودیت‌های تلگرام: ۳۰ پیام در ثانیه، ۱ پیام در ثانیه برای هر چت)
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 30))
+BROADCAST_CHAT_RATE = float(os.environ.get('BROADCAST_CHAT_RATE', 1))
+BROADCAST_MAX_ATTEMPTS = int(os.environ.get('BROADCAST_MAX_ATTEMPTS', 5))
+
+# اتصال خروجی به Bot API (استخر اتصال‌های keep-alive و سیاست تلاش مجدد)
+TELEGRAM_POOL_SIZE = int(os.environ.get('TELEGRAM_POOL_SIZE', 16))
+TELEGRAM_CONNECT_TIMEOUT = float(os.environ.get('TELEGRAM_CONNECT_TIMEOUT', 5))
+TELEGRAM_READ_TIMEOUT = float(os.environ.get('TELEGRAM_READ_TIMEOUT', 15))
+TELEGRAM_RETRIES = int(os.environ.get('TELEGRAM_RETRIES', 2))
+TELEGRAM_RETRY_BACKOFF = float(os.environ.get('TELEGRAM_RETRY_BACKOFF', 0.5))
+
+# کش آخرین رندر هر پیام (برای حذف ویرایش‌های بدون تغییر)
+# کش بین پروسس‌ها مشترک نیست؛ TTL طولانی با چند worker ویرایش‌های لازم را حذف می‌کند (render_cache.py)
+RENDER_CACHE_SIZE = int(os.environ.get('RENDER_CACHE_SIZE', 10000))
+RENDER_CACHE_TTL = float(os.environ.get('RENDER_CACHE_TTL', 5))  # ثانیه
+
+# پروفایل SQL: دستورهای کندتر از این مقدار در لاگ slow_sql ثبت می‌شوند
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', '')  # مسیر فایل لاگ جداگانه (اختیاری)
+
+# ثبت دسته‌ای رویدادها (events.py)
+EVENT_BATCH_SIZE = int(os.environ.get('EVENT_BATCH_SIZE', 200))
+EVENT_FLUSH_INTERVAL = float(os.environ.get('EVENT_FLUSH_INTERVAL', 2))  # ثانیه، 0 = فقط با پر شدن دسته
+
+# بایگانی فصل‌های تمام‌شده (archive.py)
+SEASON_ARCHIVE_DIR = os.environ.get('SEASON_ARCHIVE_DIR', os.path.join(os.path.dirname(DATABASE_PATH) or '.', 'archive'))
+SEASON_ARCHIVE_CHUNK_ROWS = int(os.environ.get('SEASON_ARCHIVE_CHUNK_ROWS', 1000))
@@ -1,12 +1,370 @@
+import re
+import json
+import time
+import zlib
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from config import DATABASE_PATH, ANCIENT_COUNTRIES, BASE_RESOURCES
+from functools import lru_cache
+from production import RESOURCE_KEYS, accrue, accrued_days
+from catalog import CountryCatalog, ensure_version
+from leaderboard import Leaderboard
+from events import EventJournal
+from sql_profiler import profiler
+from config import (
+    DATABASE_PATH, DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, ANCIENT_COUNTRIES, BASE_RESOURCES,
+    DAILY_PRODUCTION, DEFAULT_PRODUCTION,
+    SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE, SQLITE_SYNCHRONOUS
+)
+
+# ستون‌هایی از countries که با apply_deltas به صورت نسبی تغییر می‌کنند
+DELTA_COLUMNS = RESOURCE_KEYS + ('army', 'defense')
+
+def _dict_factory(cursor, row):
+    return {column[0]: row[i] for i, column in enumerate(cursor.description)}
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """کرسر SQLite که زمان اجرا و fetch و تعداد ردیف‌های هر دستور را در sql_profiler ثبت می‌کند"""
+    
+    _call = None
+    
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._call = profiler.executed(sql, time.perf_counter() - started, self.rowcount)
+    
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._call = profiler.executed(sql, time.perf_counter() - started, self.rowcount)
+    
+    # SQLite ردیف‌ها را هنگام fetch تولید می‌کند؛ زمان آن هم جزو هزینه دستور است
+    def _fetched(self, started, rows):
+        if self._call is not None:
+            profiler.fetched(self._call, rows, time.perf_counter() - started)
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None)
+        return row
+    
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows))
+        return rows
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        return rows
+    
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0)
+            raise
+        self._fetched(started, 1)
+        return row
+
+class InstrumentedConnection(sqlite3.Connection):
+    """اتصال SQLite که همه دستورها (از جمله conn.execute) را از InstrumentedCursor عبور می‌دهد"""
+    
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class ConnectionManager:
+    """یک اتصال SQLite برای هر ترد، در حالت WAL تا خواننده‌ها پشت نویسنده‌ها نمانند"""
+    
+    backend = 'sqlite'
+    
+    def __init__(self, path=DATABASE_PATH, dict_rows=False):
+        self.path = path
+        self.dict_rows = dict_rows
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+    
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # check_same_thread=False فقط برای بستن همه اتصال‌ها از ترد اصلی
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False,
+                                   factory=InstrumentedConnection)
+            if self.dict_rows:
+                conn.row_factory = _dict_factory
+            self._configure(conn)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+    
+    def _configure(self, conn):
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}')
+        cursor.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+        cursor.execute(f'PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT * 1000)}')
+        cursor.execute('PRAGMA temp_store = MEMORY')
+        cursor.close()
+    
+    @contextmanager
+    def transaction(self):
+        """اجرای چند دستور نوشتنی در یک تراکنش؛ فراخوانی تو در تو به تراکنش بیرونی می‌پیوندد"""
+        conn = self.get()
+        if getattr(self._local, 'in_transaction', False):
+            yield conn
+            return
+        
+        self._local.in_transaction = True
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._local.in_transaction = False
+    
+    def release(self):
+        """اتصال SQLite ارزان است و برای ترد باقی می‌ماند؛ برای هم‌خوانی با PostgresConnectionManager"""
+    
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+# تبدیل دستورات نوشته‌شده برای SQLite به گویش PostgreSQL
+_FOREIGN_KEY = re.compile(r',(\s*--[^\n]*)?\s*FOREIGN KEY\s*\([^)]*\)\s*REFERENCES\s+\w+\s*\([^)]*\)', re.IGNORECASE)
+
+@lru_cache(maxsize=512)
+def translate_sql(sql, has_params=True):
+    """جایگزینی ? با %s و تبدیل تعریف جدول‌ها به انواع PostgreSQL"""
+    if sql.lstrip().upper().startswith('CREATE TABLE'):
+        # شناسه‌های تلگرام از محدوده INTEGER در PostgreSQL بزرگ‌ترند
+        sql = re.sub(r'INTEGER PRIMARY KEY AUTOINCREMENT', 'BIGSERIAL PRIMARY KEY', sql, flags=re.IGNORECASE)
+        sql = re.sub(r'\bINTEGER\b', 'BIGINT', sql, flags=re.IGNORECASE)
+        # کلیدهای خارجی در SQLite هم اعمال نمی‌شوند و وابستگی چرخشی جدول‌ها را می‌شکنند
+        sql = _FOREIGN_KEY.sub(r'\1', sql)
+    
+    if not has_params:
+        return sql
+    
+    out = []
+    in_string = False
+    for char in sql:
+        if char == "'":
+            in_string = not in_string
+        if char == '%':
+            out.append('%%')
+        elif char == '?' and not in_string:
+            out.append('%s')
+        else:
+            out.append(char)
+    return ''.join(out)
+
+class PostgresCursor:
+    """کرسر psycopg2 با رابط مشابه sqlite3"""
+    
+    def __init__(self, cursor):
+        self._cursor = cursor
+    
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(translate_sql(sql, bool(params)), tuple(params) or None)
+        finally:
+            # psycopg2 همه ردیف‌ها را در execute می‌خواند؛ rowcount تعداد ردیف‌های خوانده یا تغییرکرده است
+            profiler.executed(sql, time.perf_counter() - started, self._cursor.rowcount)
+        return self
+    
+    def executemany(self, sql, seq_of_params):
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(translate_sql(sql), [tuple(p) for p in seq_of_params])
+        finally:
+            profiler.executed(sql, time.perf_counter() - started, self._cursor.rowcount)
+        return self
+    
+    def __iter__(self):
+        return iter(self._cursor)
+    
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class PostgresConnection:
+    """اتصال psycopg2 با رابط مشابه sqlite3 (cursor/execute/commit/rollback)"""
+    
+    def __init__(self, raw, dict_rows=False):
+        self.raw = raw
+        self.dict_rows = dict_rows
+    
+    def cursor(self):
+        if self.dict_rows:
+            from psycopg2.extras import RealDictCursor
+            return PostgresCursor(self.raw.cursor(cursor_factory=RealDictCursor))
+        return PostgresCursor(self.raw.cursor())
+    
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+    
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+    
+    def commit(self):
+        self.raw.commit()
+    
+    def rollback(self):
+        self.raw.rollback()
+
+class PostgresConnectionManager:
+    """استخر اتصال PostgreSQL؛ هر ترد اتصال اختصاصی خود را از استخر می‌گیرد"""
+    
+    backend = 'postgres'
+    
+    def __init__(self, dsn=DATABASE_URL, dict_rows=False, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX):
+        self.dsn = dsn
+        self.dict_rows = dict_rows
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()
+    
+    @property
+    def pool(self):
+        # اتصال‌ها در اولین استفاده باز می‌شوند، نه هنگام import (شروع سریع‌تر پروسس)
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    from psycopg2.pool import ThreadedConnectionPool
+                    self._pool = ThreadedConnectionPool(self.minconn, self.maxconn, self.dsn)
+        return self._pool
+    
+    def get(self):
+        # کلید ترد باعث می‌شود هر ترد همیشه همان اتصال را دریافت کند
+        raw = self.pool.getconn(key=threading.get_ident())
+        self._local.checked_out = True
+        # خواندن‌ها نباید تراکنش باز نگه دارند؛ تراکنش فقط در transaction() شروع می‌شود
+        if not raw.autocommit and not getattr(self._local, 'in_transaction', False):
+            raw.rollback()
+            raw.autocommit = True
+        return PostgresConnection(raw, self.dict_rows)
+    
+    @contextmanager
+    def transaction(self):
+        """اجرای چند دستور در یک تراکنش؛ فراخوانی تو در تو به تراکنش بیرونی می‌پیوندد"""
+        conn = self.get()
+        if getattr(self._local, 'in_transaction', False):
+            yield conn
+            return
+        
+        conn.raw.autocommit = False
+        self._local.in_transaction = True
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._local.in_transaction = False
+            conn.raw.autocommit = True
+    
+    def release(self):
+        """بازگرداندن اتصال ترد جاری به استخر؛ در پایان هر درخواست یا کار پس‌زمینه فراخوانی شود"""
+        if getattr(self._local, 'checked_out', False) and not getattr(self._local, 'in_transaction', False):
+            key = threading.get_ident()
+            self.pool.putconn(self.pool.getconn(key=key), key=key)
+            self._local.checked_out = False
+    
+    def close_all(self):
+        if self._pool is not None:
+            self._pool.closeall()
+
+def ensure_column(conn, table, column, declaration):
+    """افزودن ستون جدید به جدول موجود (برای دیتابیس‌هایی که قبلاً ساخته شده‌اند)"""
+    cursor = conn.execute(f'SELECT * FROM {table} LIMIT 0')
+    if column not in [description[0] for description in cursor.description]:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+def seed_version(schema, *seeds):
+    """نسخه طرح: شماره تغییرات جدول‌ها همراه با چکسام داده‌های اولیه (تغییر تنظیمات هم مقداردهی دوباره را فعال می‌کند)"""
+    return zlib.crc32(repr((schema, seeds)).encode('utf-8'))
+
+def schema_version(conn, name):
+    """نسخه ثبت‌شده طرح name در catalog_versions، یا None برای دیتابیس تازه"""
+    try:
+        row = conn.execute('SELECT version FROM catalog_versions WHERE name = ?', (name,)).fetchone()
+    except Exception:
+        # جدول catalog_versions هنوز ساخته نشده است
+        return None
+    if row is None:
+        return None
+    return row['version'] if isinstance(row, dict) else row[0]
+
+def set_schema_version(conn, name, version):
+    ensure_version(conn, name)
+    conn.execute('UPDATE catalog_versions SET version = ? WHERE name = ?', (version, name))
+
+def connect(path=DATABASE_PATH, dict_rows=False):
+    """مدیر اتصال مناسب: PostgreSQL اگر DATABASE_URL تنظیم شده باشد، وگرنه SQLite"""
+    if DATABASE_URL:
+        return PostgresConnectionManager(DATABASE_URL, dict_rows=dict_rows)
+    return ConnectionManager(path, dict_rows=dict_rows)
+
+# نسخه طرح database.py؛ شماره را پس از هر تغییر create_tables افزایش دهید
+DATABASE_SCHEMA = seed_version(1, ANCIENT_COUNTRIES)
 
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
-        self.create_tables()
-        self.initialize_countries()
+    def __init__(self, path=DATABASE_PATH):
+        self.connections = connect(path, dict_rows=True)
+        self.catalog = CountryCatalog(self.connections)
+        self.events = EventJournal(self.connections)
+        self._archiver = None
+        # رتبه‌بندی بازیکنان فعال بر اساس امتیاز جنگ‌ها
+        self.leaderboard = Leaderboard(
+            self.connections, 'leaderboard_score',
+            load_sql='SELECT user_id, score FROM players WHERE is_active = 1',
+            score_sql='SELECT score FROM players WHERE user_id = ? AND is_active = 1'
+        )
+        
+        # ساخت جدول‌ها و کشورهای اولیه فقط برای دیتابیس تازه یا طرح قدیمی
+        if schema_version(self.conn, 'database_schema') != DATABASE_SCHEMA:
+            self.create_tables()
+            self.initialize_countries()
+            set_schema_version(self.conn, 'database_schema', DATABASE_SCHEMA)
+            self.conn.commit()
+    
+    @property
+    def conn(self):
+        return self.connections.get()
+    
+    @property
+    def archiver(self):
+        # ماژول بایگانی فقط در پایان فصل یا خواندن تاریخچه لازم است
+        if self._archiver is None:
+            from archive import SeasonArchiver
+            self._archiver = SeasonArchiver(self.connections, self.events)
+        return self._archiver
     
     def create_tables(self):
         cursor = self.conn.cursor()
@@ -17,12 +375,14 @@ class Database:
                 user_id INTEGER PRIMARY KEY,
                 username TEXT,
                 country_id INTEGER,
-                is_ai BOOLEAN DEFAULT 0,
-                is_active BOOLEAN DEFAULT 1,
+                is_ai INTEGER DEFAULT 0,
+                is_active INTEGER DEFAULT 1,
                 join_date TIMESTAMP,
+                score INTEGER DEFAULT 0,
                 FOREIGN KEY (country_id) REFERENCES countries(id)
             )
         ''')
+        ensure_column(self.conn, 'players', 'score', 'INTEGER DEFAULT 0')
         
         # جدول کشورها
         cursor.execute('''
@@ -41,9 +401,11 @@ class Database:
                 defense INTEGER DEFAULT 50,
                 created_at TIMESTAMP,
                 last_updated TIMESTAMP,
+                resources_at TIMESTAMP, -- زمان آخرین ثبت تولید انباشته
                 FOREIGN KEY (player_id) REFERENCES players(user_id)
             )
         ''')
+        ensure_column(self.conn, 'countries', 'resources_at', 'TIMESTAMP')
         
         # جدول فصل‌ها
         cursor.execute('''
@@ -54,41 +416,76 @@ class Database:
                 end_date TIMESTAMP,
                 winner_country_id INTEGER,
                 winner_player_id INTEGER,
-                is_active BOOLEAN DEFAULT 0,
+                is_active INTEGER DEFAULT 0,
                 FOREIGN KEY (winner_country_id) REFERENCES countries(id),
                 FOREIGN KEY (winner_player_id) REFERENCES players(user_id)
             )
         ''')
+        ensure_column(self.conn, 'seasons', 'archive_path', 'TEXT')
+        
+        # رویدادها در جدول جداگانه هر فصل (events.py)؛ جدول قدیمی events منتقل می‌شود
+        self.events.import_table('events')
+        
+        # جدول جنگ‌ها
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS battles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                season_id INTEGER,
+                attacker_id INTEGER,
+                defender_id INTEGER,
+                result TEXT,
+                loot TEXT, -- JSON
+                seed INTEGER, -- seed مولد تصادفی جنگ برای بازپخش
+                inputs TEXT, -- JSON وضعیت ارتش‌ها و منابع در لحظه جنگ
+                created_at TIMESTAMP,
+                FOREIGN KEY (season_id) REFERENCES seasons(id),
+                FOREIGN KEY (attacker_id) REFERENCES countries(id),
+                FOREIGN KEY (defender_id) REFERENCES countries(id)
+            )
+        ''')
         
-        # جدول رویدادها
+        # جدول روابط دیپلماتیک
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS events (
+            CREATE TABLE IF NOT EXISTS diplomacy (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 season_id INTEGER,
-                event_type TEXT, -- 'WAR', 'ALLIANCE', 'TREASON', 'RESOURCE_CHANGE'
                 from_country_id INTEGER,
                 to_country_id INTEGER,
-                description TEXT,
+                relation_type TEXT, -- 'ALLIANCE', 'PEACE', 'TRADE'
+                status TEXT DEFAULT 'pending', -- 'pending', 'accepted', 'rejected'
                 created_at TIMESTAMP,
+                expires_at TIMESTAMP,
                 FOREIGN KEY (season_id) REFERENCES seasons(id),
                 FOREIGN KEY (from_country_id) REFERENCES countries(id),
                 FOREIGN KEY (to_country_id) REFERENCES countries(id)
             )
         ''')
         
+        # ایندکس‌های پرسش‌های پرتکرار
+        for name, definition in (
+            ('idx_players_country', 'players (country_id)'),
+            ('idx_players_score', 'players (score)'),
+            ('idx_countries_controller', 'countries (controller)'),
+            ('idx_countries_player', 'countries (player_id)'),
+            ('idx_battles_season', 'battles (season_id)'),
+            ('idx_diplomacy_expires', 'diplomacy (expires_at)'),
+            ('idx_diplomacy_status', 'diplomacy (status, created_at)'),
+        ):
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+        
         self.conn.commit()
     
     def initialize_countries(self):
         cursor = self.conn.cursor()
         
-        # ابتدا کشورهای قدیمی را حذف کنیم
-        cursor.execute('DELETE FROM countries')
-        
+        # به‌روزرسانی مشخصات ثابت؛ منابع و مالکیت کشورهای موجود حفظ می‌شوند
         for country in ANCIENT_COUNTRIES:
             cursor.execute('''
                 INSERT INTO countries 
                 (id, name, special_resource, color, controller, created_at, last_updated)
                 VALUES (?, ?, ?, ?, 'AI', ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    name = excluded.name, special_resource = excluded.special_resource, color = excluded.color
             ''', (
                 country['id'],
                 country['name'],
@@ -98,50 +495,63 @@ class Database:
                 datetime.now()
             ))
         
+        self.catalog.bump(self.conn)
         self.conn.commit()
+        self.catalog.invalidate()
     
     def add_player(self, user_id, username, country_id=None):
-        cursor = self.conn.cursor()
-        
         if country_id:
-            # بررسی اینکه کشور قبلاً اشغال نشده باشد
-            cursor.execute('''
-                SELECT controller FROM countries WHERE id = ?
-            ''', (country_id,))
-            country = cursor.fetchone()
+            # بررسی اینکه کشور قبلاً اشغال نشده باشد (از کش؛ بررسی قطعی در UPDATE شرطی)
+            country = self.catalog.get(country_id)
             
-            if country and country[0] != 'AI':
+            if country and country['controller'] != 'AI':
                 return False
+        
+        # اختصاص کشور و ثبت بازیکن در یک تراکنش
+        with self.connections.transaction() as conn:
+            cursor = conn.cursor()
             
-            # اختصاص کشور به بازیکن
-            cursor.execute('''
-                UPDATE countries 
-                SET controller = 'HUMAN', player_id = ?, last_updated = ?
-                WHERE id = ? AND controller = 'AI'
-            ''', (user_id, datetime.now(), country_id))
+            if country_id:
+                # اختصاص کشور به بازیکن
+                cursor.execute('''
+                    UPDATE countries 
+                    SET controller = 'HUMAN', player_id = ?, last_updated = ?, resources_at = ?
+                    WHERE id = ? AND controller = 'AI'
+                ''', (user_id, datetime.now(), datetime.now(), country_id))
+                
+                # کشور همزمان گرفته شد؛ چیزی نوشته نشده است
+                claimed = cursor.rowcount > 0
+            else:
+                claimed = True
             
-            if cursor.rowcount == 0:
-                return False
+            if claimed:
+                # اضافه کردن یا به‌روزرسانی بازیکن
+                cursor.execute('''
+                    INSERT INTO players 
+                    (user_id, username, country_id, is_ai, join_date)
+                    VALUES (?, ?, ?, 0, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        username = excluded.username,
+                        country_id = excluded.country_id,
+                        is_ai = 0,
+                        join_date = excluded.join_date
+                ''', (user_id, username, country_id, datetime.now()))
+                
+                self.catalog.bump(conn)
+                version = self.leaderboard.bump(conn)
         
-        # اضافه کردن یا به‌روزرسانی بازیکن
-        cursor.execute('''
-            INSERT OR REPLACE INTO players 
-            (user_id, username, country_id, is_ai, join_date)
-            VALUES (?, ?, ?, 0, ?)
-        ''', (user_id, username, country_id, datetime.now()))
-        
-        self.conn.commit()
+        self.catalog.invalidate()
+        if not claimed:
+            return False
+        self.leaderboard.refresh(user_id, version)
         return True
     
     def get_available_countries(self):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT id, name, special_resource 
-            FROM countries 
-            WHERE controller = 'AI'
-            ORDER BY name
-        ''')
-        return cursor.fetchall()
+        countries = sorted(self.catalog.available(), key=lambda country: country['name'])
+        return [
+            {'id': country['id'], 'name': country['name'], 'special_resource': country['special_resource']}
+            for country in countries
+        ]
     
     def get_player_country(self, user_id):
         cursor = self.conn.cursor()
@@ -150,7 +560,7 @@ class Database:
             JOIN players p ON c.id = p.country_id
             WHERE p.user_id = ? AND p.is_ai = 0
         ''', (user_id,))
-        return cursor.fetchone()
+        return self._accrue(cursor.fetchone())
     
     def get_all_countries(self):
         cursor = self.conn.cursor()
@@ -164,7 +574,7 @@ class Database:
             LEFT JOIN players p ON c.player_id = p.user_id
             ORDER BY c.id
         ''')
-        return cursor.fetchall()
+        return [self._accrue(country) for country in cursor.fetchall()]
     
     def start_season(self, season_number):
         cursor = self.conn.cursor()
@@ -172,12 +582,14 @@ class Database:
             INSERT INTO seasons 
             (season_number, start_date, is_active)
             VALUES (?, ?, 1)
+            RETURNING id
         ''', (season_number, datetime.now()))
+        season_id = cursor.fetchone()['id']
         
         self.conn.commit()
-        return cursor.lastrowid
+        return season_id
     
-    def end_season(self, season_id, winner_country_id, winner_player_id):
+    def end_season(self, season_id, winner_country_id, winner_player_id, archive=True):
         cursor = self.conn.cursor()
         cursor.execute('''
             UPDATE seasons 
@@ -189,6 +601,13 @@ class Database:
         ''', (datetime.now(), winner_country_id, winner_player_id, season_id))
         
         self.conn.commit()
+        
+        if archive:
+            # انتقال جنگ‌ها، دیپلماسی و رویدادهای فصل به فایل بایگانی (archive.py)
+            self.archiver.archive(season_id)
+        else:
+            # رویدادهای بافرشده فصل پیش از بسته شدن آن نوشته می‌شوند
+            self.events.flush()
     
     def get_active_season(self):
         cursor = self.conn.cursor()
@@ -201,71 +620,223 @@ class Database:
         return cursor.fetchone()
     
     def update_country_resources(self, country_id, resources):
-        cursor = self.conn.cursor()
+        """افزودن/کسر منابع و نیروها (مقادیر نسبی)؛ خروجی False یعنی منابع کافی نبود"""
+        return self.apply_deltas(country_id, resources) is not None
+    
+    def apply_deltas(self, country_id, deltas):
+        """تغییر نسبی با SET col = col + ?؛ اگر ستونی منفی شود هیچ تغییری اعمال نمی‌شود
         
-        cursor.execute('''
+        خروجی: ردیف جدید کشور، یا None اگر کشور نبود یا منابع کافی نبود
+        """
+        unknown = set(deltas) - set(DELTA_COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown country columns: {', '.join(sorted(unknown))}")
+        
+        changes = [(column, deltas[column]) for column in DELTA_COLUMNS if deltas.get(column)]
+        assignments = [f"{column} = {column} + ?" for column, _ in changes]
+        # شرط کافی بودن منابع برای هر کسر، در همان دستور UPDATE
+        guards = [f"{column} >= ?" for column, amount in changes if amount < 0]
+        params = [amount for _, amount in changes] + [datetime.now(), country_id]
+        params += [-amount for _, amount in changes if amount < 0]
+        
+        with self.connections.transaction() as conn:
+            # تولید انباشته باید پیش از بررسی موجودی ثبت شود
+            self.materialize_country(country_id)
+            cursor = conn.execute(f'''
+                UPDATE countries 
+                SET {', '.join(assignments + ['last_updated = ?'])}
+                WHERE {' AND '.join(['id = ?'] + guards)}
+                RETURNING *
+            ''', params)
+            return cursor.fetchone()
+    
+    def get_country_by_id(self, country_id):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM countries WHERE id = ?', (country_id,))
+        return self._accrue(cursor.fetchone())
+    
+    def lock_countries(self, *country_ids):
+        """خواندن چند کشور با یک دستور و قفل نوشتن روی آن‌ها؛ فقط داخل transaction()"""
+        placeholders = ', '.join('?' * len(country_ids))
+        if self.connections.backend == 'postgres':
+            # قفل ردیف‌ها به ترتیب شناسه تا دو حمله متقابل دچار بن‌بست نشوند
+            cursor = self.conn.execute(f'''
+                SELECT * FROM countries 
+                WHERE id IN ({placeholders})
+                ORDER BY id
+                FOR UPDATE
+            ''', country_ids)
+        else:
+            # در SQLite نوشتن در ابتدای تراکنش قفل نوشتن را از همان ابتدا می‌گیرد
+            cursor = self.conn.execute(f'''
+                UPDATE countries 
+                SET last_updated = ?
+                WHERE id IN ({placeholders})
+                RETURNING *
+            ''', (datetime.now(), *country_ids))
+        return {country['id']: self._accrue(country) for country in cursor.fetchall()}
+    
+    def save_country(self, country):
+        """نوشتن منابع و نیروهای کشور قفل‌شده (همراه تولید انباشته) در تراکنش جاری"""
+        self.conn.execute('''
             UPDATE countries 
-            SET gold = ?, iron = ?, stone = ?, food = ?, last_updated = ?
+            SET gold = ?, iron = ?, stone = ?, food = ?, army = ?, defense = ?, resources_at = ?, last_updated = ?
             WHERE id = ?
         ''', (
-            resources.get('gold', 0),
-            resources.get('iron', 0),
-            resources.get('stone', 0),
-            resources.get('food', 0),
+            country['gold'],
+            country['iron'],
+            country['stone'],
+            country['food'],
+            country['army'],
+            country['defense'],
+            country['resources_at'],
             datetime.now(),
-            country_id
+            country['id']
         ))
+    
+    def _accrue(self, country, now=None):
+        """افزودن تولید انباشته کشورهای انسانی به ردیف خوانده‌شده (بدون نوشتن)"""
+        if not country or country['controller'] != 'HUMAN':
+            return country
         
-        self.conn.commit()
+        rate = DAILY_PRODUCTION.get(country['name'], DEFAULT_PRODUCTION)
+        resources, since, days = accrue(country, rate, country['resources_at'], now)
+        if days:
+            country = {**country, **resources, 'resources_at': since}
+        return country
     
-    def get_country_by_id(self, country_id):
+    def pending_production_days(self, country_id):
+        """تعداد روزهای تولید که هنوز در دیتابیس ثبت نشده‌اند"""
         cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM countries WHERE id = ?', (country_id,))
-        return cursor.fetchone()
+        cursor.execute('SELECT controller, resources_at FROM countries WHERE id = ?', (country_id,))
+        country = cursor.fetchone()
+        if not country or country['controller'] != 'HUMAN':
+            return 0
+        return accrued_days(country['resources_at'])
     
-    def reset_game(self):
+    def materialize_country(self, country_id):
+        """ثبت تولید انباشته کشور در دیتابیس؛ قبل از هر نوشتن روی منابع فراخوانی می‌شود"""
         cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM countries WHERE id = ?', (country_id,))
+        stored = cursor.fetchone()
+        country = self._accrue(stored)
+        if not country or country is stored:
+            return None
         
-        # پایان دادن به فصل فعال
-        cursor.execute('''
-            UPDATE seasons 
-            SET is_active = 0, end_date = ?
-            WHERE is_active = 1
-        ''', (datetime.now(),))
+        # شرط resources_at از ثبت دوباره همزمان همان روزها جلوگیری می‌کند
+        # داخل تراکنش فراخواننده (مثل apply_deltas) به همان تراکنش می‌پیوندد
+        with self.connections.transaction():
+            cursor.execute('''
+                UPDATE countries 
+                SET gold = ?, iron = ?, stone = ?, food = ?, resources_at = ?
+                WHERE id = ? AND resources_at = ?
+            ''', (
+                country['gold'],
+                country['iron'],
+                country['stone'],
+                country['food'],
+                country['resources_at'],
+                country_id,
+                stored['resources_at']
+            ))
         
-        # حذف بازیکنان
-        cursor.execute('DELETE FROM players')
+        return country if cursor.rowcount > 0 else None
+    
+    def reset_game(self):
+        with self.connections.transaction() as conn:
+            cursor = conn.cursor()
+            
+            # پایان دادن به فصل فعال
+            cursor.execute('''
+                UPDATE seasons 
+                SET is_active = 0, end_date = ?
+                WHERE is_active = 1
+            ''', (datetime.now(),))
+            
+            # حذف بازیکنان
+            cursor.execute('DELETE FROM players')
+            
+            # ریست کشورها
+            cursor.execute('''
+                UPDATE countries 
+                SET controller = 'AI', 
+                    player_id = NULL,
+                    gold = 100,
+                    iron = 100,
+                    stone = 100,
+                    food = 100,
+                    army = 50,
+                    defense = 50,
+                    last_updated = ?,
+                    resources_at = NULL
+            ''', (datetime.now(),))
+            
+            self.catalog.bump(conn)
+            self.leaderboard.bump(conn)
         
-        # ریست کشورها
-        cursor.execute('''
-            UPDATE countries 
-            SET controller = 'AI', 
-                player_id = NULL,
-                gold = 100,
-                iron = 100,
-                stone = 100,
-                food = 100,
-                army = 50,
-                defense = 50,
-                last_updated = ?
-        ''', (datetime.now(),))
-        
-        # حذف رویدادها
-        cursor.execute('DELETE FROM events')
+        self.catalog.invalidate()
+        self.leaderboard.invalidate()
         
-        self.conn.commit()
+        # حذف رویدادها (حذف جدول هر فصل به جای DELETE همه ردیف‌ها)
+        self.events.drop_all()
         return True
     
     def add_event(self, season_id, event_type, from_country_id, to_country_id, description):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO events 
-            (season_id, event_type, from_country_id, to_country_id, description, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (season_id, event_type, from_country_id, to_country_id, description, datetime.now()))
+        """ثبت رویداد در بافر؛ نوشتن در دیتابیس دسته‌ای انجام می‌شود (events.py)"""
+        self.events.append(season_id, event_type, from_country_id, to_country_id, description)
+    
+    def get_events(self, season_id, after_id=0, limit=50, event_type=None):
+        """یک صفحه از رویدادهای فصل؛ خروجی: (رویدادها، after_id صفحه بعد یا None)"""
+        return self.events.page(season_id, after_id, limit, event_type)
+    
+    def record_battle(self, attacker_id, defender_id, season_id, result, loot, seed=None, inputs=None):
+        # داخل تراکنش حمله به همان تراکنش می‌پیوندد
+        with self.connections.transaction() as conn:
+            battle_id = conn.execute('''
+                INSERT INTO battles 
+                (season_id, attacker_id, defender_id, result, loot, seed, inputs, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+            ''', (
+                season_id,
+                attacker_id,
+                defender_id,
+                result,
+                json.dumps(loot),
+                seed,
+                json.dumps(inputs) if inputs is not None else None,
+                datetime.now()
+            )).fetchone()['id']
         
-        self.conn.commit()
-        return cursor.lastrowid
+        return battle_id
+    
+    def get_battle(self, battle_id):
+        """جنگ ثبت‌شده؛ جنگ‌های فصل‌های تمام‌شده از فایل بایگانی خوانده می‌شوند"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM battles WHERE id = ?', (battle_id,))
+        battle = cursor.fetchone() or self._archived_battle(battle_id)
+        if battle:
+            battle = {**battle, 'loot': json.loads(battle['loot'] or '{}'), 'inputs': json.loads(battle['inputs'] or 'null')}
+        return battle
+    
+    def _archived_battle(self, battle_id):
+        # جنگ‌های فصل پس از بایگانی از جدول battles حذف شده‌اند (archive.py)
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT id FROM seasons WHERE archive_path IS NOT NULL ORDER BY id DESC')
+        for season in cursor.fetchall():
+            archive = self.archiver.open(season['id'])
+            if archive is None:
+                continue
+            try:
+                # ردیف‌های بایگانی به ترتیب شناسه نوشته شده‌اند
+                for battle in archive.rows('battles'):
+                    if battle['id'] == battle_id:
+                        return battle
+                    if battle['id'] > battle_id:
+                        break
+            finally:
+                archive.close()
+        return None
     
     def get_player_by_id(self, user_id):
         cursor = self.conn.cursor()
@@ -273,22 +844,34 @@ class Database:
         return cursor.fetchone()
     
     def remove_player(self, user_id):
-        cursor = self.conn.cursor()
-        
-        # آزاد کردن کشور بازیکن
-        cursor.execute('''
-            UPDATE countries 
-            SET controller = 'AI', player_id = NULL
-            WHERE player_id = ?
-        ''', (user_id,))
-        
-        # حذف بازیکن
-        cursor.execute('DELETE FROM players WHERE user_id = ?', (user_id,))
+        with self.connections.transaction() as conn:
+            # ثبت تولید انباشته پیش از واگذاری کشور به AI
+            player = self.get_player_by_id(user_id)
+            if player and player['country_id']:
+                self.materialize_country(player['country_id'])
+            
+            cursor = conn.cursor()
+            
+            # آزاد کردن کشور بازیکن
+            cursor.execute('''
+                UPDATE countries 
+                SET controller = 'AI', player_id = NULL, resources_at = NULL
+                WHERE player_id = ?
+            ''', (user_id,))
+            
+            # حذف بازیکن
+            cursor.execute('DELETE FROM players WHERE user_id = ?', (user_id,))
+            removed = cursor.rowcount > 0
+            
+            self.catalog.bump(conn)
+            version = self.leaderboard.bump(conn)
         
-        self.conn.commit()
-        return cursor.rowcount > 0
+        self.catalog.invalidate()
+        self.leaderboard.refresh(user_id, version)
+        return removed
     
     def get_season_history(self, limit=10):
+        """فصل‌های اخیر؛ برای فصل‌های بایگانی‌شده archive خواننده تنبل فایل بایگانی است"""
         cursor = self.conn.cursor()
         cursor.execute('''
             SELECT s.*, c.name as winner_country_name
@@ -297,9 +880,35 @@ class Database:
             ORDER BY s.start_date DESC
             LIMIT ?
         ''', (limit,))
-        return cursor.fetchall()
+        from archive import SeasonArchive
+        return [
+            {**season, 'archive': SeasonArchive(season['archive_path']) if season['archive_path'] else None}
+            for season in cursor.fetchall()
+        ]
+    
+    def get_top_players(self, limit=10):
+        """بازیکنان برتر بر اساس امتیاز (از رتبه‌بندی درون‌پروسسی)"""
+        top = self.leaderboard.top(limit)
+        if not top:
+            return []
+        
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT p.user_id, p.username, p.score, c.id AS country_id, c.name AS country_name,
+                   c.army * 10 + c.defense * 5 AS total_power
+            FROM players p
+            JOIN countries c ON c.id = p.country_id
+            WHERE p.user_id IN ({', '.join('?' * len(top))})
+        ''', [user_id for user_id, _ in top])
+        players = {player['user_id']: player for player in cursor.fetchall()}
+        return [players[user_id] for user_id, _ in top if user_id in players]
+    
+    def get_player_rank(self, user_id):
+        """رتبه بازیکن در جدول امتیازها (از ۱)"""
+        return self.leaderboard.rank(user_id)
     
     def update_country_military(self, country_id, army_size=None, defense_level=None):
+        self.materialize_country(country_id)
         cursor = self.conn.cursor()
         
         update_fields = []
@@ -331,4 +940,5 @@ class Database:
         return cursor.rowcount > 0
     
     def close(self):
-        self.conn.close()
+        self.events.close()
+        self.connections.close_all()
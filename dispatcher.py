@@ -0,0 +1,209 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# علامت توقف برای تردهای پردازشگر
+_STOP = object()
+
+# فیلدهای آپدیت که کاربر/چت فرستنده را مشخص می‌کنند
+_UPDATE_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query',
+    'chosen_inline_result', 'channel_post', 'edited_channel_post',
+    'shipping_query', 'pre_checkout_query', 'poll_answer',
+    'my_chat_member', 'chat_member', 'chat_join_request',
+)
+
+
+def update_type(update):
+    """نوع آپدیت (نام اولین فیلد پرشده آن)"""
+    for field in _UPDATE_FIELDS:
+        if getattr(update, field, None) is not None:
+            return field
+    return 'unknown'
+
+
+def partition_key(update):
+    """شناسه کاربر (یا چت) فرستنده آپدیت برای تقسیم‌بندی"""
+    for field in _UPDATE_FIELDS:
+        obj = getattr(update, field, None)
+        if obj is None:
+            continue
+
+        user = getattr(obj, 'from_user', None) or getattr(obj, 'user', None)
+        if user is not None:
+            return user.id
+
+        chat = getattr(obj, 'chat', None)
+        if chat is not None:
+            return chat.id
+
+    return update.update_id
+
+
+class _Partition:
+    """صف و ترد اختصاصی یک بخش؛ آپدیت‌های یک کاربر همیشه به ترتیب اجرا می‌شوند"""
+
+    def __init__(self, index, maxsize):
+        self.index = index
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = None
+        self.pending = Counter()
+        self.busy = False
+        self.stats = {
+            'enqueued': 0,
+            'rejected': 0,
+            'processed': 0,
+            'failed': 0,
+            'max_depth': 0,
+        }
+
+
+class UpdateDispatcher:
+    """توزیع آپدیت‌ها بین بخش‌ها: ترتیب‌دار برای هر کاربر، موازی بین کاربران"""
+
+    def __init__(self, handler, workers=4, maxsize=1000, drain_timeout=25):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.drain_timeout = drain_timeout
+        partition_size = max(1, maxsize // self.workers)
+        self.partitions = [_Partition(i, partition_size) for i in range(self.workers)]
+        self._lock = threading.Lock()
+        self._started = False
+        self._stopping = False
+
+    def start(self):
+        """راه‌اندازی تردها (یک بار برای هر پروسس)"""
+        with self._lock:
+            if self._started:
+                return
+            for partition in self.partitions:
+                partition.thread = threading.Thread(
+                    target=self._worker, args=(partition,),
+                    name=f"dispatcher-{partition.index}", daemon=True
+                )
+                partition.thread.start()
+            self._started = True
+            atexit.register(self.stop)
+
+        logger.info(f"Dispatcher started with {self.workers} partitions (queue size {self.maxsize})")
+
+    def partition_for(self, key):
+        return self.partitions[hash(key) % self.workers]
+
+    def submit(self, update):
+        """قرار دادن آپدیت در صف بخش مربوطه؛ در صورت پر بودن صف False برمی‌گرداند"""
+        if self._stopping:
+            return False
+        if not self._started:
+            self.start()
+
+        key = partition_key(update)
+        partition = self.partition_for(key)
+
+        # شمارش قبل از قرار دادن در صف تا ترد پردازشگر زودتر از ما آن را کم نکند
+        with self._lock:
+            partition.pending[key] += 1
+
+        try:
+            partition.queue.put_nowait((key, update))
+        except queue.Full:
+            with self._lock:
+                self._release(partition, key)
+                partition.stats['rejected'] += 1
+            logger.warning(f"Partition {partition.index} full, rejecting update {update.update_id} from {key}")
+            return False
+
+        depth = partition.queue.qsize()
+        with self._lock:
+            partition.stats['enqueued'] += 1
+            if depth > partition.stats['max_depth']:
+                partition.stats['max_depth'] = depth
+        return True
+
+    def _release(self, partition, key):
+        partition.pending[key] -= 1
+        if partition.pending[key] <= 0:
+            del partition.pending[key]
+
+    def _worker(self, partition):
+        while True:
+            item = partition.queue.get()
+            try:
+                if item is _STOP:
+                    return
+
+                key, update = item
+                with self._lock:
+                    partition.busy = True
+                try:
+                    self.handler([update])
+                    outcome = 'processed'
+                except Exception as e:
+                    outcome = 'failed'
+                    logger.error(f"Error processing update {update.update_id}: {e}")
+                with self._lock:
+                    partition.busy = False
+                    partition.stats[outcome] += 1
+                    self._release(partition, key)
+            finally:
+                partition.queue.task_done()
+
+    def stop(self, timeout=None):
+        """تخلیه منظم صف‌ها و توقف تردها"""
+        with self._lock:
+            if not self._started or self._stopping:
+                return
+            self._stopping = True
+
+        timeout = self.drain_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        pending = sum(p.queue.qsize() for p in self.partitions)
+        logger.info(f"Draining update queues ({pending} pending)...")
+
+        # علامت توقف پشت آپدیت‌های باقی‌مانده قرار می‌گیرد تا همه پردازش شوند
+        for partition in self.partitions:
+            try:
+                partition.queue.put(_STOP, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+
+        for partition in self.partitions:
+            partition.thread.join(max(0, deadline - time.monotonic()))
+
+        alive = sum(1 for p in self.partitions if p.thread.is_alive())
+        if alive:
+            pending = sum(p.queue.qsize() for p in self.partitions)
+            logger.warning(f"Dispatcher stopped with {alive} busy partitions and {pending} pending updates")
+        else:
+            logger.info("Dispatcher drained and stopped")
+
+    def get_stats(self, top=5):
+        """آمار کلی و آمار هر بخش همراه با پرترافیک‌ترین کاربران"""
+        totals = Counter()
+        partitions = []
+
+        with self._lock:
+            for partition in self.partitions:
+                stats = dict(partition.stats)
+                stats['index'] = partition.index
+                stats['depth'] = partition.queue.qsize()
+                stats['busy'] = partition.busy
+                stats['hot_keys'] = partition.pending.most_common(top)
+                partitions.append(stats)
+                totals.update({k: partition.stats[k] for k in ('enqueued', 'rejected', 'processed', 'failed')})
+
+        return {
+            **totals,
+            'depth': sum(p['depth'] for p in partitions),
+            'max_depth': max(p['max_depth'] for p in partitions),
+            'busy_workers': sum(1 for p in partitions if p['busy']),
+            'capacity': self.maxsize,
+            'workers': self.workers,
+            'partitions': partitions,
+        }
@@ -0,0 +1,226 @@
+"""
+ثبت رویدادهای بازی (جنگ، اتحاد، خیانت، تغییر منابع)
+
+- رویدادها در حافظه جمع و دسته‌ای با یک تراکنش نوشته می‌شوند: با پر شدن دسته
+  (EVENT_BATCH_SIZE)، پس از EVENT_FLUSH_INTERVAL ثانیه، و هنگام خروج پروسس
+- هر فصل جدول جداگانه events_s<season_id> دارد (رویدادهای بدون فصل در events_s0)؛
+  حذف یا بایگانی تاریخچه یک فصل با DROP TABLE و بدون اسکن ردیف‌ها انجام می‌شود
+- خواندن صفحه‌ای با مکان‌نما (id آخرین رویداد) به جای OFFSET
+"""
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime
+from config import EVENT_BATCH_SIZE, EVENT_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = ('season_id', 'event_type', 'from_country_id', 'to_country_id', 'description', 'created_at')
+
+def _values(row):
+    return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+def partition_table(season_id):
+    """نام جدول رویدادهای یک فصل"""
+    return f"events_s{int(season_id or 0)}"
+
+class EventJournal:
+    """بافر رویدادها و جدول‌های فصلی آن‌ها"""
+
+    def __init__(self, connections, batch_size=EVENT_BATCH_SIZE, flush_interval=EVENT_FLUSH_INTERVAL):
+        self.connections = connections
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        # فقط یک ترد در هر لحظه می‌نویسد تا ترتیب رویدادها حفظ شود
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self.stats = {'appended': 0, 'written': 0, 'batches': 0, 'errors': 0}
+        self._create_tables()
+        atexit.register(self.close)
+
+    def _create_tables(self):
+        with self.connections.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS event_partitions (
+                    season_id INTEGER PRIMARY KEY,
+                    table_name TEXT,
+                    created_at TIMESTAMP
+                )
+            ''')
+
+    def _create_partition(self, conn, season_id):
+        table = partition_table(season_id)
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                season_id INTEGER,
+                event_type TEXT, -- 'WAR', 'ALLIANCE', 'TREASON', 'RESOURCE_CHANGE'
+                from_country_id INTEGER,
+                to_country_id INTEGER,
+                description TEXT,
+                created_at TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            INSERT INTO event_partitions (season_id, table_name, created_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (season_id) DO NOTHING
+        ''', (int(season_id or 0), table, datetime.now()))
+        return table
+
+    def append(self, season_id, event_type, from_country_id, to_country_id, description, created_at=None):
+        """افزودن رویداد به بافر؛ با پر شدن دسته همین فراخوانی آن را می‌نویسد"""
+        event = (season_id, event_type, from_country_id, to_country_id, description, created_at or datetime.now())
+        with self._lock:
+            self._buffer.append(event)
+            self.stats['appended'] += 1
+            full = len(self._buffer) >= self.batch_size
+            if not full and self._thread is None and self.flush_interval > 0:
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='event-journal', daemon=True)
+                self._thread.start()
+        if full:
+            self.flush()
+
+    def _run(self):
+        # نوشتن دوره‌ای تا وقتی بافر خالی شود
+        try:
+            while not self._stopping.wait(self.flush_interval):
+                self.flush()
+                with self._lock:
+                    if not self._buffer:
+                        self._thread = None
+                        return
+            with self._lock:
+                self._thread = None
+        finally:
+            self.connections.release()
+
+    def flush(self):
+        """نوشتن همه رویدادهای بافر با یک تراکنش؛ خروجی: تعداد رویدادهای نوشته‌شده"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._buffer = self._buffer, []
+            if not events:
+                return 0
+
+            by_season = {}
+            for event in events:
+                by_season.setdefault(int(event[0] or 0), []).append(event)
+
+            started = time.perf_counter()
+            try:
+                with self.connections.transaction() as conn:
+                    for season_id, rows in by_season.items():
+                        table = self._create_partition(conn, season_id)
+                        conn.executemany(f'''
+                            INSERT INTO {table}
+                            ({', '.join(_COLUMNS)})
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        ''', rows)
+            except Exception as e:
+                # رویدادها به ابتدای بافر برمی‌گردند و در نوبت بعد دوباره نوشته می‌شوند
+                with self._lock:
+                    self._buffer[:0] = events
+                self.stats['errors'] += 1
+                logger.error(f"Event journal flush of {len(events)} events failed: {e}")
+                return 0
+
+            self.stats['written'] += len(events)
+            self.stats['batches'] += 1
+            logger.debug(f"Event journal wrote {len(events)} events in {(time.perf_counter() - started) * 1000:.1f} ms")
+            return len(events)
+
+    def close(self):
+        """توقف نوشتن دوره‌ای و نوشتن باقی‌مانده بافر"""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(5)
+        self.flush()
+
+    def partitions(self):
+        """شناسه فصل‌هایی که جدول رویداد دارند"""
+        rows = self.connections.get().execute('SELECT season_id FROM event_partitions ORDER BY season_id').fetchall()
+        return [_values(row)[0] for row in rows]
+
+    def drop_season(self, season_id):
+        """حذف همه رویدادهای یک فصل (بافرشده و ذخیره‌شده) با حذف جدول آن"""
+        season_id = int(season_id or 0)
+        with self._flush_lock:
+            with self._lock:
+                self._buffer = [event for event in self._buffer if int(event[0] or 0) != season_id]
+            with self.connections.transaction() as conn:
+                conn.execute(f'DROP TABLE IF EXISTS {partition_table(season_id)}')
+                conn.execute('DELETE FROM event_partitions WHERE season_id = ?', (season_id,))
+
+    def drop_all(self):
+        """حذف رویدادهای همه فصل‌ها (ریست بازی)"""
+        with self._lock:
+            self._buffer = []
+        for season_id in self.partitions():
+            self.drop_season(season_id)
+
+    def page(self, season_id, after_id=0, limit=50, event_type=None):
+        """
+        رویدادهای یک فصل به ترتیب ثبت، از بعد از after_id
+        خروجی: (رویدادها، مکان‌نمای صفحه بعد یا None)
+        """
+        self.flush()
+        table = partition_table(season_id)
+        exists = self.connections.get().execute('SELECT 1 FROM event_partitions WHERE season_id = ?',
+                                                (int(season_id or 0),)).fetchone()
+        if exists is None:
+            return [], None
+
+        sql = f'SELECT id, {", ".join(_COLUMNS)} FROM {table} WHERE id > ?'
+        params = [after_id]
+        if event_type is not None:
+            sql += ' AND event_type = ?'
+            params.append(event_type)
+        sql += ' ORDER BY id LIMIT ?'
+        params.append(limit)
+
+        cursor = self.connections.get().execute(sql, params)
+        columns = [description[0] for description in cursor.description]
+        events = [dict(zip(columns, _values(row))) for row in cursor.fetchall()]
+        next_cursor = events[-1]['id'] if len(events) == limit else None
+        return events, next_cursor
+
+    def iter_season(self, season_id, batch_size=500, event_type=None):
+        """پیمایش همه رویدادهای یک فصل صفحه به صفحه"""
+        after_id = 0
+        while after_id is not None:
+            events, after_id = self.page(season_id, after_id, batch_size, event_type)
+            yield from events
+
+    def import_table(self, table='events'):
+        """انتقال رویدادهای جدول قدیمی (یک جدول برای همه فصل‌ها) به جدول‌های فصلی و حذف آن"""
+        conn = self.connections.get()
+        try:
+            rows = conn.execute(f'SELECT {", ".join(_COLUMNS)} FROM {table} ORDER BY id').fetchall()
+        except Exception:
+            # جدول قدیمی وجود ندارد
+            return 0
+
+        with self._flush_lock:
+            with self.connections.transaction() as tx:
+                by_season = {}
+                for row in rows:
+                    row = _values(row)
+                    by_season.setdefault(int(row[0] or 0), []).append(row)
+                for season_id, events in by_season.items():
+                    partition = self._create_partition(tx, season_id)
+                    tx.executemany(f'INSERT INTO {partition} ({", ".join(_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)', events)
+                tx.execute(f'DROP TABLE {table}')
+        if rows:
+            logger.info(f"Moved {len(rows)} events from {table} into season tables")
+        return len(rows)
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, 'buffered': len(self._buffer), 'flushing': self._thread is not None}
@@ -1,12 +1,64 @@
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from config import Config
+import threading
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+from config import NEWS_CHANNEL_URL
 
-config = Config()
+class KeyboardRegistry:
+    """کش کیبوردهای ساخته‌شده به صورت JSON آماده ارسال، با کلید (منو، نقش، حالت)"""
+    
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+    
+    def get(self, key, builder, version=None):
+        """JSON کیبورد؛ فقط اگر در کش نباشد یا نسخه آن عوض شده باشد ساخته می‌شود"""
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == version:
+            self.stats['hits'] += 1
+            return entry[1]
+        
+        markup = builder()
+        payload = markup.to_json() if isinstance(markup, InlineKeyboardMarkup) else markup
+        with self._lock:
+            self._cache[key] = (version, payload)
+            self.stats['misses'] += 1
+        return payload
+    
+    def invalidate(self, menu=None):
+        """حذف همه کیبوردها یا فقط کیبوردهای یک منو"""
+        with self._lock:
+            if menu is None:
+                self._cache.clear()
+            else:
+                for key in [key for key in self._cache if key[0] == menu]:
+                    del self._cache[key]
+
+registry = KeyboardRegistry()
+
+def cached(menu):
+    """ذخیره خروجی سازنده کیبورد بر اساس نام منو و آرگومان‌ها؛ catalog جزو کلید نیست و نسخه آن نسخه کیبورد است"""
+    def decorator(builder):
+        def wrapper(*args, catalog=None, **kwargs):
+            key = (menu,) + args + tuple(sorted(kwargs.items()))
+            if catalog is None:
+                return registry.get(key, lambda: builder(*args, **kwargs))
+            # مثل app.countries_menu فقط با تغییر مالکیت کشورها دوباره ساخته می‌شود
+            return registry.get(key, lambda: builder(*args, catalog=catalog, **kwargs), version=catalog.version())
+        wrapper.__doc__ = builder.__doc__
+        wrapper.build = builder
+        return wrapper
+    return decorator
 
 class Keyboards:
     @staticmethod
     def get_main_menu(owner_id, user_id):
         """منوی اصلی"""
+        role = 'owner' if str(user_id) == str(owner_id) else 'player'
+        return Keyboards._main_menu(role)
+    
+    @staticmethod
+    @cached('main_menu')
+    def _main_menu(role):
         keyboard = []
         
         # دکمه‌های عمومی برای همه
@@ -17,18 +69,19 @@ class Keyboards:
         keyboard.append([InlineKeyboardButton("🏆 رتبه‌بندی بازیکنان", callback_data="leaderboard")])
         
         # دکمه‌های مخصوص مالک
-        if str(user_id) == str(owner_id):
+        if role == 'owner':
             keyboard.append([InlineKeyboardButton("➕ افزودن بازیکن", callback_data="add_player")])
             keyboard.append([InlineKeyboardButton("🎮 شروع فصل جدید", callback_data="start_season")])
             keyboard.append([InlineKeyboardButton("🏁 پایان فصل", callback_data="end_season")])
             keyboard.append([InlineKeyboardButton("🔄 ریست کامل بازی", callback_data="reset_game")])
         
-        keyboard.append([InlineKeyboardButton("📢 کانال اخبار", url=config.NEWS_CHANNEL)])
+        keyboard.append([InlineKeyboardButton("📢 کانال اخبار", url=NEWS_CHANNEL_URL)])
         keyboard.append([InlineKeyboardButton("❓ راهنما", callback_data="help")])
         
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @cached('back')
     def get_back_keyboard():
         """کیبورد بازگشت"""
         keyboard = [[
@@ -37,17 +90,22 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
-    def get_countries_keyboard(available_only=False, countries_list=None):
-        """کیبورد انتخاب کشور"""
+    def get_countries_keyboard(available_only=False, catalog=None):
+        """کیبورد انتخاب کشور؛ با catalog از کشورهای کش ساخته می‌شود"""
+        return Keyboards._countries_keyboard(bool(available_only), catalog=catalog)
+    
+    @staticmethod
+    @cached('countries')
+    def _countries_keyboard(available_only, catalog=None):
         keyboard = []
         
-        if countries_list:
-            for country_id, country_name, special_resource, color in countries_list:
-                emoji = "👑" if "هخامنشی" in country_name else "🏛️"
+        if catalog is not None:
+            for country in (catalog.available() if available_only else catalog.all()):
+                emoji = "👑" if "هخامنشی" in country['name'] else "🏛️"
                 keyboard.append([
                     InlineKeyboardButton(
-                        f"{emoji} {country_name} ({special_resource})",
-                        callback_data=f"country_{country_id}"
+                        f"{emoji} {country['name']} ({country['special_resource']})",
+                        callback_data=f"country_{country['id']}"
                     )
                 ])
         else:
@@ -85,6 +143,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @cached('confirmation')
     def get_confirmation_keyboard(action_type):
         """کیبورد تأیید عملیات"""
         keyboard = [
@@ -96,6 +155,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @cached('resource_management')
     def get_resource_management():
         """کیبورد مدیریت منابع"""
         keyboard = [
@@ -108,6 +168,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @cached('attack_targets')
     def get_attack_targets_keyboard(user_country_id):
         """کیبورد انتخاب هدف برای حمله"""
         keyboard = []
@@ -133,6 +194,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @cached('admin_panel')
     def get_admin_panel_keyboard():
         """کیبورد پنل مدیریت مالک"""
         keyboard = [
@@ -147,11 +209,13 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @cached('cancel')
     def get_cancel_keyboard():
         """کیبورد لغو"""
         return InlineKeyboardMarkup([[InlineKeyboardButton("❌ لغو", callback_data="main_menu")]])
     
     @staticmethod
+    @cached('yes_no')
     def get_yes_no_keyboard(yes_data="yes", no_data="no"):
         """کیبورد بله/خیر عمومی"""
         return InlineKeyboardMarkup([
@@ -0,0 +1,117 @@
+"""
+جدول رتبه‌بندی درون‌پروسسی
+
+امتیاز همه بازیکنان در یک فهرست مرتب (SortedList) نگهداری می‌شود؛
+n بازیکن برتر و رتبه هر بازیکن بدون پیمایش کل جدول با هزینه O(log n) به دست می‌آید.
+
+هر نوشتن روی امتیاز در همان تراکنش نسخه لیدربورد را در catalog_versions افزایش می‌دهد
+و پس از commit فقط امتیاز همان بازیکن دوباره خوانده می‌شود. اگر پروسس دیگری
+(مثلاً worker دیگر gunicorn) نسخه را تغییر داده باشد، فهرست از نو بارگذاری می‌شود.
+"""
+import time
+import threading
+from catalog import ensure_version, read_version, bump_version
+from config import CATALOG_SYNC_INTERVAL
+
+class Leaderboard:
+    """رتبه‌بندی با کلید بازیکن؛ load_sql: (کلید، امتیاز) همه اعضا، score_sql: امتیاز یک عضو"""
+
+    def __init__(self, connections, name, load_sql, score_sql, sync_interval=CATALOG_SYNC_INTERVAL):
+        self.connections = connections
+        self.name = name
+        self.load_sql = load_sql
+        self.score_sql = score_sql
+        self.sync_interval = sync_interval
+        self._lock = threading.RLock()
+        self._scores = None   # کلید -> امتیاز
+        self._order = None    # (-امتیاز، کلید) به ترتیب رتبه
+        self._version = None
+        self._checked_at = 0
+        self.stats = {'hits': 0, 'loads': 0, 'updates': 0}
+
+        with self.connections.transaction() as conn:
+            ensure_version(conn, name)
+
+    def _load(self):
+        # sortedcontainers فقط با اولین خواندن رتبه‌بندی import می‌شود
+        from sortedcontainers import SortedList
+        conn = self.connections.get()
+        version = read_version(conn, self.name)
+        scores = {key: score for key, score in (self._pair(row) for row in conn.execute(self.load_sql).fetchall())}
+
+        self._scores = scores
+        self._order = SortedList((-score, key) for key, score in scores.items())
+        self._version = version
+        self._checked_at = time.monotonic()
+        self.stats['loads'] += 1
+
+    @staticmethod
+    def _pair(row):
+        return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+    def _ensure_current(self):
+        # باید با قفل فراخوانی شود
+        if self._order is not None:
+            if not self.sync_interval or time.monotonic() - self._checked_at < self.sync_interval:
+                self.stats['hits'] += 1
+                return
+            # بررسی نسخه حداکثر یک بار در هر sync_interval ثانیه
+            if read_version(self.connections.get(), self.name) == self._version:
+                self._checked_at = time.monotonic()
+                self.stats['hits'] += 1
+                return
+        self._load()
+
+    def top(self, limit=10):
+        """limit عضو برتر؛ خروجی: [(کلید، امتیاز)]"""
+        with self._lock:
+            self._ensure_current()
+            return [(key, -negative) for negative, key in self._order.islice(0, limit)]
+
+    def rank(self, key):
+        """رتبه عضو (از ۱)، یا None اگر عضو رتبه‌بندی نیست"""
+        with self._lock:
+            self._ensure_current()
+            score = self._scores.get(key)
+            if score is None:
+                return None
+            return self._order.index((-score, key)) + 1
+
+    def score(self, key):
+        with self._lock:
+            self._ensure_current()
+            return self._scores.get(key)
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_current()
+            return len(self._scores)
+
+    def bump(self, conn):
+        """در همان تراکنش نوشتن امتیاز؛ خروجی را پس از commit به refresh یا invalidate بدهید"""
+        return bump_version(conn, self.name)
+
+    def refresh(self, key, version):
+        """خواندن دوباره امتیاز یک عضو پس از commit؛ اگر نوشتن دیگری از قلم افتاده باشد بارگذاری کامل"""
+        with self._lock:
+            if self._order is None:
+                return
+            if version != self._version + 1:
+                self._order = None
+                return
+
+            row = self.connections.get().execute(self.score_sql, (key,)).fetchone()
+            old = self._scores.pop(key, None)
+            if old is not None:
+                self._order.remove((-old, key))
+            if row is not None:
+                score = self._pair(row)[0]
+                self._scores[key] = score
+                self._order.add((-score, key))
+            self._version = version
+            self.stats['updates'] += 1
+
+    def invalidate(self):
+        """پاک کردن فهرست این پروسس (برای تغییرهای گروهی مثل ریست بازی)"""
+        with self._lock:
+            self._order = None
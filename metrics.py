@@ -0,0 +1,162 @@
+"""
+شمارنده‌ها و هیستوگرام‌ها با قالب متنی Prometheus
+
+هر ترد سهم جداگانه خود را از هر معیار دارد و فقط در همان می‌نویسد؛ ثبت مقدار
+بدون قفل انجام می‌شود و سهم همه تردها فقط هنگام خواندن /metrics جمع می‌شود.
+معیارهایی که داده آن‌ها جای دیگری نگهداری می‌شود (مثل جدول scheduler_jobs)
+با collector در زمان خواندن تولید می‌شوند.
+"""
+import threading
+from bisect import bisect_left
+
+# مرزهای پیش‌فرض هیستوگرام (ثانیه)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            # فقط اولین ثبت هر ترد قفل می‌گیرد
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _merged(self, shards):
+        raise NotImplementedError
+
+    def snapshot(self):
+        """مقدار جمع‌شده همه تردها به ازای هر ترکیب برچسب"""
+        with self._shards_lock:
+            shards = list(self._shards)
+        # کپی dict در CPython اتمیک است و با نوشتن همزمان ترد صاحب آن تداخل ندارد
+        return self._merged([shard.copy() for shard in shards])
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _merged(self, shards):
+        totals = {}
+        for shard in shards:
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def samples(self):
+        for key, value in sorted(self.snapshot().items()):
+            yield '', dict(zip(self.labels, key)), value
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        counts = shard.get(key)
+        if counts is None:
+            # تعداد هر بازه، بازه +Inf و در آخر مجموع مقدارها
+            counts = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merged(self, shards):
+        totals = {}
+        for shard in shards:
+            for key, counts in shard.items():
+                counts = list(counts)
+                merged = totals.get(key)
+                totals[key] = counts if merged is None else [a + b for a, b in zip(merged, counts)]
+        return totals
+
+    def samples(self):
+        for key, counts in sorted(self.snapshot().items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', {**labels, 'le': _format_value(float(bound))}, cumulative
+            yield '_sum', labels, counts[-1]
+            yield '_count', labels, cumulative
+
+class Registry:
+    """فهرست معیارها و collectorها؛ render خروجی متنی /metrics را می‌سازد"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def collector(self, func):
+        """ثبت تابعی که در زمان خواندن (نام، نوع، توضیح، [(پسوند، برچسب‌ها، مقدار)]) تولید می‌کند"""
+        with self._lock:
+            self._collectors.append(func)
+        return func
+
+    def _families(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            yield metric.name, metric.kind, metric.help, metric.samples()
+        for func in collectors:
+            yield from func()
+
+    def render(self):
+        lines = []
+        for name, kind, help, samples in self._families():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
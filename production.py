@@ -0,0 +1,36 @@
+"""
+محاسبه تنبل (lazy) تولید منابع
+
+منابع به صورت (مقدار پایه، نرخ روزانه، زمان آخرین ثبت) نگهداری می‌شوند.
+مقدار فعلی هنگام خواندن محاسبه و فقط هنگام نوشتن در دیتابیس ثبت می‌شود.
+"""
+from datetime import datetime, timedelta
+
+RESOURCE_KEYS = ('gold', 'iron', 'stone', 'food')
+DAY = timedelta(days=1)
+
+def parse_time(value):
+    """تبدیل مقدار TIMESTAMP (رشته در SQLite، datetime در PostgreSQL) به datetime"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+
+def accrued_days(since, now=None):
+    """تعداد روزهای کامل تولید از آخرین ثبت"""
+    since = parse_time(since)
+    if since is None:
+        return 0
+    now = now or datetime.now()
+    return max(0, (now - since) // DAY)
+
+def accrue(amounts, rate, since, now=None):
+    """مقدار فعلی منابع؛ خروجی: (منابع، زمان ثبت جدید، تعداد روزها)"""
+    resources = {key: amounts[key] for key in RESOURCE_KEYS}
+    days = accrued_days(since, now) if rate else 0
+    if not days:
+        return resources, parse_time(since), 0
+
+    for key in RESOURCE_KEYS:
+        resources[key] += rate.get(key, 0) * days
+    # فقط روزهای کامل مصرف می‌شوند تا کسر روز جاری از دست نرود
+    return resources, parse_time(since) + days * DAY, days
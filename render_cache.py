@@ -0,0 +1,74 @@
+"""
+کش آخرین رندر هر پیام
+
+برای هر (chat_id, message_id) فقط هش متن و کیبورد آخرین ویرایش نگهداری می‌شود؛
+اگر رندر جدید همان باشد ویرایش ارسال نمی‌شود (تلگرام در این حالت خطای
+"message is not modified" برمی‌گرداند).
+
+محدودیت: کش مخصوص هر پروسس است. اگر پروسس دیگری (worker دیگر gunicorn) همان پیام را
+ویرایش کند، هش این پروسس کهنه است و ویرایشی که باید ارسال شود حذف می‌شود و کاربر
+رندر پروسس دیگر را می‌بیند. برای همین ttl کوتاه است (چند ثانیه): کش فقط کلیک‌های
+تکراری پشت سر هم را حذف می‌کند و پس از آن همیشه ویرایش ارسال می‌شود.
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from config import RENDER_CACHE_SIZE, RENDER_CACHE_TTL
+
+def render_hash(text, reply_markup=None, parse_mode=None):
+    """هش متن، کیبورد (شیء یا JSON) و parse_mode"""
+    if reply_markup is not None and not isinstance(reply_markup, str):
+        reply_markup = reply_markup.to_json()
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (text, reply_markup, parse_mode):
+        digest.update(b'\0' if part is None else part.encode() + b'\1')
+    return digest.digest()
+
+class RenderCache:
+    """LRU از (chat_id, message_id) به هش آخرین رندر"""
+
+    def __init__(self, max_entries=RENDER_CACHE_SIZE, ttl=RENDER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+
+    def changed(self, chat_id, message_id, text, reply_markup=None, parse_mode=None):
+        """True اگر رندر با آخرین رندر این پیام فرق دارد (و ثبت آن به عنوان آخرین رندر)"""
+        key = (chat_id, message_id)
+        value = render_hash(text, reply_markup, parse_mode)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == value and now - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return False
+
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.stats['misses'] += 1
+            return True
+
+    def not_modified(self):
+        """ثبت پاسخ "message is not modified" تلگرام (رندری که کش از آن خبر نداشت)"""
+        with self._lock:
+            self.stats['not_modified'] += 1
+
+    def forget(self, chat_id, message_id):
+        """حذف مدخل پیام (مثلاً وقتی ویرایش ناموفق بود)"""
+        with self._lock:
+            self._entries.pop((chat_id, message_id), None)
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'entries': len(self._entries),
+                'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else None
+            }
@@ -0,0 +1,157 @@
+"""
+مسیریاب callback دکمه‌های اینلاین
+
+- کلیدهای دقیق (مثل main_menu) با یک جستجوی dict پیدا می‌شوند
+- کلیدهای پارامتری (مثل select_<نام کشور>) با درخت پیشوند (trie)
+- محدودیت مالک به صورت اعلانی روی هر مسیر
+- هیستوگرام زمان اجرای هر مسیر
+"""
+import time
+import logging
+import threading
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# مرزهای بازه‌های هیستوگرام (میلی‌ثانیه)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+class _Route:
+    def __init__(self, name, handler, admin_only):
+        self.name = name
+        self.handler = handler
+        self.admin_only = admin_only
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms, failed):
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+        if failed:
+            self.errors += 1
+
+class CallbackRouter:
+    """جدول مسیرهای callback با دسترسی O(1) برای کلیدهای دقیق"""
+
+    def __init__(self, is_admin=None, on_denied=None):
+        self.is_admin = is_admin or (lambda user_id: False)
+        self.on_denied = on_denied
+        self._exact = {}
+        self._trie = {}
+        self._lock = threading.Lock()
+        self.unmatched = 0
+
+    def route(self, key, admin_only=False):
+        """ثبت هندلر برای کلید دقیق؛ هندلر: handler(call)"""
+        def decorator(handler):
+            self._exact[key] = _Route(key, handler, admin_only)
+            return handler
+        return decorator
+
+    def prefix(self, prefix, admin_only=False):
+        """ثبت هندلر برای کلیدهای پارامتری؛ هندلر: handler(call, باقی‌مانده کلید)"""
+        def decorator(handler):
+            node = self._trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[None] = _Route(prefix + '*', handler, admin_only)
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """یافتن مسیر و پارامتر آن؛ کلید دقیق مقدم است و سپس بلندترین پیشوند"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route, None
+
+        match = None
+        node = self._trie
+        for i, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                match = (node[None], data[i + 1:])
+        return match or (None, None)
+
+    def dispatch(self, call):
+        """اجرای هندلر مربوط به call.data؛ خروجی False یعنی مسیری پیدا نشد"""
+        route, argument = self.resolve(call.data or '')
+        if route is None:
+            self.unmatched += 1
+            return False
+
+        if route.admin_only and not self.is_admin(call.from_user.id):
+            if self.on_denied:
+                self.on_denied(call)
+            return True
+
+        started = time.perf_counter()
+        failed = True
+        try:
+            if argument is None:
+                route.handler(call)
+            else:
+                route.handler(call, argument)
+            failed = False
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                route.observe(elapsed_ms, failed)
+            if failed:
+                logger.error(f"Callback route {route.name} failed after {elapsed_ms:.1f} ms")
+        return True
+
+    def _routes(self):
+        routes = list(self._exact.values())
+        stack = [self._trie]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char is None:
+                    routes.append(child)
+                else:
+                    stack.append(child)
+        return routes
+
+    def collect(self):
+        """هیستوگرام زمان اجرای مسیرها برای /metrics (ثانیه)"""
+        durations, errors = [], []
+        with self._lock:
+            for route in self._routes():
+                if not route.count:
+                    continue
+                labels = {'route': route.name}
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS_MS + (float('inf'),), route.buckets):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else str(bound / 1000)
+                    durations.append(('_bucket', {**labels, 'le': le}, cumulative))
+                durations.append(('_sum', labels, route.total_ms / 1000))
+                durations.append(('_count', labels, route.count))
+                errors.append(('', labels, route.errors))
+        yield 'callback_route_duration_seconds', 'histogram', 'Callback handler latency by route', durations
+        yield 'callback_route_errors_total', 'counter', 'Callback handlers that raised', errors
+        yield 'callback_unmatched_total', 'counter', 'Callbacks without a matching route', [('', {}, self.unmatched)]
+
+    def get_stats(self):
+        """آمار زمان اجرای هر مسیر همراه با هیستوگرام"""
+        stats = {}
+        with self._lock:
+            for route in self._routes():
+                if not route.count:
+                    continue
+                stats[route.name] = {
+                    'count': route.count,
+                    'errors': route.errors,
+                    'avg_ms': round(route.total_ms / route.count, 2),
+                    'max_ms': round(route.max_ms, 2),
+                    'histogram': dict(zip([f"le_{b}" for b in LATENCY_BUCKETS_MS] + ['inf'], route.buckets)),
+                }
+        return {'routes': stats, 'unmatched': self.unmatched}
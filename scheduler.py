@@ -0,0 +1,252 @@
+"""
+زمان‌بند کارهای دوره‌ای worker
+
+- زمان‌بندی به سبک cron (دقیقه ساعت روز‌ماه ماه روز‌هفته)
+- اجرای جبرانی کارهایی که در زمان خاموش بودن worker از دست رفته‌اند
+- قفل در دیتابیس تا با چند نمونه worker هر نوبت فقط یک بار اجرا شود
+- ثبت مدت اجرا و زمان آخرین اجرای موفق هر کار
+"""
+import os
+import time
+import socket
+import logging
+from datetime import datetime, timedelta
+from production import parse_time
+from database import ensure_column
+
+logger = logging.getLogger(__name__)
+
+# بازه مجاز هر فیلد cron
+_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7),  # 0 و 7 هر دو یکشنبه
+)
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"invalid step in '{text}'")
+
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+
+        if not low <= start <= end <= high:
+            raise ValueError(f"value out of range in '{text}' ({low}-{high})")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+class CronSchedule:
+    """عبارت cron پنج‌بخشی؛ روز هفته 0 یکشنبه است"""
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron expression needs 5 fields: '{expression}'")
+
+        self.expression = expression
+        for (name, low, high), part in zip(_FIELDS, parts):
+            setattr(self, name + 's', _parse_field(part, low, high))
+        self.weekdays = frozenset(day % 7 for day in self.weekdays)
+        # طبق cron اگر هر دو فیلد روز محدود باشند، تطابق با یکی کافی است
+        self._day_or = parts[2] != '*' and parts[4] != '*'
+
+    def _day_matches(self, moment):
+        in_days = moment.day in self.days
+        in_weekdays = (moment.weekday() + 1) % 7 in self.weekdays
+        return in_days or in_weekdays if self._day_or else in_days and in_weekdays
+
+    def next_after(self, moment):
+        """اولین زمان اجرا بعد از moment"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year, month = divmod(candidate.month, 12)
+                candidate = candidate.replace(year=candidate.year + year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+
+        raise ValueError(f"cron expression never fires: '{self.expression}'")
+
+class Job:
+    def __init__(self, name, schedule, func, lock_timeout=3600, retry_delay=None):
+        self.name = name
+        self.schedule = CronSchedule(schedule)
+        self.func = func
+        self.lock_timeout = lock_timeout
+        self.retry_delay = retry_delay
+
+class Scheduler:
+    """اجرای کارها در زمان دقیق با وضعیت و قفل ذخیره‌شده در جدول scheduler_jobs"""
+
+    def __init__(self, connections, poll_interval=60):
+        self.connections = connections
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.jobs = {}
+        self._create_table()
+
+    def _create_table(self):
+        with self.connections.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS scheduler_jobs (
+                    name TEXT PRIMARY KEY,
+                    schedule TEXT,
+                    next_fire_at TIMESTAMP,
+                    locked_by TEXT,
+                    locked_until TIMESTAMP,
+                    last_started_at TIMESTAMP,
+                    last_success_at TIMESTAMP,
+                    last_duration REAL,
+                    last_error TEXT,
+                    run_count INTEGER DEFAULT 0,
+                    failure_count INTEGER DEFAULT 0,
+                    total_duration REAL DEFAULT 0
+                )
+            ''')
+            ensure_column(conn, 'scheduler_jobs', 'total_duration', 'REAL DEFAULT 0')
+
+    def add_job(self, name, schedule, func, **options):
+        """ثبت کار؛ اگر زمان‌بندی تغییر کرده باشد نوبت بعدی از نو محاسبه می‌شود"""
+        job = Job(name, schedule, func, **options)
+        self.jobs[name] = job
+
+        with self.connections.transaction() as conn:
+            row = conn.execute('SELECT schedule FROM scheduler_jobs WHERE name = ?', (name,)).fetchone()
+            next_fire_at = job.schedule.next_after(datetime.now())
+            if row is None:
+                conn.execute('INSERT INTO scheduler_jobs (name, schedule, next_fire_at) VALUES (?, ?, ?) ON CONFLICT DO NOTHING',
+                             (name, schedule, next_fire_at))
+            elif row[0] != schedule:
+                conn.execute('UPDATE scheduler_jobs SET schedule = ?, next_fire_at = ? WHERE name = ?',
+                             (schedule, next_fire_at, name))
+        return job
+
+    def _due_times(self):
+        rows = self.connections.get().execute('SELECT name, next_fire_at FROM scheduler_jobs').fetchall()
+        return {name: parse_time(next_fire_at) for name, next_fire_at in rows if name in self.jobs}
+
+    def _acquire(self, job, now):
+        # فقط اگر نوبت هنوز اجرا نشده و قفل آزاد یا منقضی باشد
+        with self.connections.transaction() as conn:
+            cursor = conn.execute('''
+                UPDATE scheduler_jobs
+                SET locked_by = ?, locked_until = ?, last_started_at = ?
+                WHERE name = ? AND next_fire_at <= ? AND (locked_until IS NULL OR locked_until < ?)
+            ''', (self.owner, now + timedelta(seconds=job.lock_timeout), now, job.name, now, now))
+            return cursor.rowcount == 1
+
+    def run_job(self, job, now=None):
+        """اجرای یک نوبت کار در صورت گرفتن قفل؛ نوبت‌های از دست رفته یک بار جبران می‌شوند"""
+        now = now or datetime.now()
+        if not self._acquire(job, now):
+            return False
+
+        logger.info(f"⏰ اجرای کار {job.name}")
+        started = time.monotonic()
+        error = None
+        try:
+            job.func()
+        except Exception as e:
+            error = str(e)
+            logger.error(f"خطا در اجرای کار {job.name}: {e}")
+        duration = time.monotonic() - started
+
+        finished = datetime.now()
+        next_fire_at = job.schedule.next_after(finished)
+        if error and job.retry_delay:
+            next_fire_at = min(next_fire_at, finished + timedelta(seconds=job.retry_delay))
+
+        with self.connections.transaction() as conn:
+            if error:
+                conn.execute('''
+                    UPDATE scheduler_jobs
+                    SET locked_by = NULL, locked_until = NULL, next_fire_at = ?, last_duration = ?,
+                        last_error = ?, run_count = run_count + 1, failure_count = failure_count + 1,
+                        total_duration = total_duration + ?
+                    WHERE name = ?
+                ''', (next_fire_at, duration, error, duration, job.name))
+            else:
+                conn.execute('''
+                    UPDATE scheduler_jobs
+                    SET locked_by = NULL, locked_until = NULL, next_fire_at = ?, last_duration = ?,
+                        last_success_at = ?, last_error = NULL, run_count = run_count + 1,
+                        total_duration = total_duration + ?
+                    WHERE name = ?
+                ''', (next_fire_at, duration, finished, duration, job.name))
+
+        logger.info(f"✅ کار {job.name} در {duration:.2f} ثانیه تمام شد؛ نوبت بعدی: {next_fire_at}")
+        return True
+
+    def run_pending(self, now=None):
+        """اجرای همه کارهایی که نوبتشان رسیده؛ خروجی: زمان نزدیک‌ترین نوبت بعدی"""
+        now = now or datetime.now()
+        for name, next_fire_at in self._due_times().items():
+            if next_fire_at <= now:
+                self.run_job(self.jobs[name], now)
+
+        due_times = self._due_times().values()
+        return min(due_times) if due_times else None
+
+    def get_status(self):
+        """وضعیت همه کارها برای پایش"""
+        cursor = self.connections.get().execute('''
+            SELECT name, schedule, next_fire_at, locked_by, last_started_at, last_success_at,
+                   last_duration, last_error, run_count, failure_count, total_duration
+            FROM scheduler_jobs
+            ORDER BY name
+        ''')
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def collect(self):
+        """مدت و تعداد اجرای کارها برای /metrics؛ از جدول خوانده می‌شود تا اجراهای پروسس worker هم دیده شوند"""
+        durations, last_durations, failures, last_success = [], [], [], []
+        for job in self.get_status():
+            labels = {'job': job['name']}
+            durations.append(('_sum', labels, job['total_duration'] or 0))
+            durations.append(('_count', labels, job['run_count'] or 0))
+            last_durations.append(('', labels, job['last_duration'] or 0))
+            failures.append(('', labels, job['failure_count'] or 0))
+            if job['last_success_at']:
+                last_success.append(('', labels, parse_time(job['last_success_at']).timestamp()))
+        yield 'worker_job_duration_seconds', 'summary', 'Scheduled worker job run time', durations
+        yield 'worker_job_last_duration_seconds', 'gauge', 'Run time of the latest run of each job', last_durations
+        yield 'worker_job_failures_total', 'counter', 'Failed worker job runs', failures
+        yield 'worker_job_last_success_timestamp_seconds', 'gauge', 'Unix time of the latest successful run', last_success
+
+    def run_forever(self):
+        """حلقه اصلی: خواب تا نزدیک‌ترین نوبت (حداکثر poll_interval ثانیه)"""
+        while True:
+            try:
+                next_fire_at = self.run_pending()
+                delay = self.poll_interval
+                if next_fire_at is not None:
+                    delay = min(delay, (next_fire_at - datetime.now()).total_seconds())
+                self.connections.release()
+                time.sleep(max(1, delay))
+            except Exception as e:
+                logger.error(f"خطا در زمان‌بند: {e}")
+                self.connections.release()
+                time.sleep(self.poll_interval)
@@ -0,0 +1,140 @@
+"""
+پروفایل دستورهای SQL
+
+همه دستورها از کرسرهای database.py (InstrumentedCursor برای SQLite و PostgresCursor)
+به این ماژول گزارش می‌شوند. برای هر دستور نرمال‌شده تعداد اجرا، زمان کل و بیشینه
+(همراه با زمان fetch در SQLite) و تعداد ردیف‌ها نگهداری می‌شود.
+
+- آمار هر ترد جداگانه و بدون قفل ثبت و فقط هنگام گزارش جمع می‌شود
+- دستورهای کندتر از SLOW_QUERY_MS در لاگ slow_sql (و در صورت تنظیم، فایل SLOW_QUERY_LOG) ثبت می‌شوند
+- report و format_report گزارش لحظه‌ای؛ در worker با سیگنال SIGUSR1 در لاگ نوشته می‌شود
+"""
+import re
+import signal
+import logging
+import threading
+from functools import lru_cache
+from metrics import registry as metrics
+from config import SLOW_QUERY_MS, SLOW_QUERY_LOG
+
+slow_logger = logging.getLogger('slow_sql')
+if SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG)
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_logger.addHandler(_handler)
+
+QUERY_DURATION = metrics.histogram('db_query_duration_seconds', 'SQL statement execution time', ('statement',))
+
+_WHITESPACE = re.compile(r'\s+')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*(\?|%s)(\s*,\s*(\?|%s))*\s*\)', re.IGNORECASE)
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """متن یکسان برای هر دستور: فاصله‌های یکسان و IN (?, ?, ...) با هر طولی به صورت IN (...)"""
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('IN (...)', sql)[:200]
+
+# ستون‌های آمار هر دستور
+_CALLS, _TOTAL, _MAX, _ROWS, _SLOW = range(5)
+
+class QueryProfiler:
+    """آمار دستورها به تفکیک متن نرمال‌شده"""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS):
+        self.slow_seconds = slow_ms / 1000
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def executed(self, sql, elapsed, rowcount=-1):
+        """ثبت یک اجرا؛ خروجی را برای افزودن زمان و ردیف‌های fetch به fetched بدهید"""
+        statement = normalize_sql(sql)
+        QUERY_DURATION.observe(elapsed, statement=statement)
+
+        shard = self._shard()
+        entry = shard.get(statement)
+        if entry is None:
+            entry = shard[statement] = [0, 0.0, 0.0, 0, 0]
+        entry[_CALLS] += 1
+        entry[_TOTAL] += elapsed
+        if rowcount > 0:
+            entry[_ROWS] += rowcount
+
+        call = [statement, entry, elapsed, max(rowcount, 0), False]
+        self._finish(call)
+        return call
+
+    def fetched(self, call, rows, elapsed):
+        """افزودن ردیف‌ها و زمان یک fetch به اجرای مربوط"""
+        entry = call[1]
+        entry[_TOTAL] += elapsed
+        entry[_ROWS] += rows
+        call[2] += elapsed
+        call[3] += rows
+        self._finish(call)
+
+    def _finish(self, call):
+        statement, entry, elapsed, rows, logged = call
+        if elapsed > entry[_MAX]:
+            entry[_MAX] = elapsed
+        if elapsed >= self.slow_seconds and not logged:
+            call[4] = True
+            entry[_SLOW] += 1
+            slow_logger.warning(f"Slow query {elapsed * 1000:.1f} ms ({rows} rows so far): {statement}")
+
+    def report(self, order='total', limit=20):
+        """پرهزینه‌ترین دستورها؛ order یکی از total، calls، max، rows، avg"""
+        with self._lock:
+            shards = list(self._shards)
+
+        merged = {}
+        for shard in shards:
+            for statement, entry in shard.copy().items():
+                total = merged.setdefault(statement, [0, 0.0, 0.0, 0, 0])
+                total[_CALLS] += entry[_CALLS]
+                total[_TOTAL] += entry[_TOTAL]
+                total[_MAX] = max(total[_MAX], entry[_MAX])
+                total[_ROWS] += entry[_ROWS]
+                total[_SLOW] += entry[_SLOW]
+
+        rows = [{
+            'statement': statement,
+            'calls': calls,
+            'total_ms': round(total * 1000, 3),
+            'avg_ms': round(total * 1000 / calls, 3) if calls else 0,
+            'max_ms': round(peak * 1000, 3),
+            'rows': rows,
+            'slow': slow,
+        } for statement, (calls, total, peak, rows, slow) in merged.items()]
+        key = {'total': 'total_ms', 'avg': 'avg_ms', 'max': 'max_ms'}.get(order, order)
+        rows.sort(key=lambda row: row[key], reverse=True)
+        return rows[:limit]
+
+    def format_report(self, order='total', limit=20):
+        """گزارش متنی برای لاگ یا ترمینال"""
+        lines = [f"{'calls':>8} {'total ms':>10} {'avg ms':>8} {'max ms':>8} {'rows':>8} {'slow':>5}  statement"]
+        for row in self.report(order, limit):
+            lines.append(f"{row['calls']:>8} {row['total_ms']:>10.1f} {row['avg_ms']:>8.3f} {row['max_ms']:>8.1f} "
+                         f"{row['rows']:>8} {row['slow']:>5}  {row['statement'][:100]}")
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.clear()
+
+    def install_signal_dump(self, signum=getattr(signal, 'SIGUSR1', None)):
+        """نوشتن گزارش در لاگ با دریافت سیگنال (برای پروسس‌های بدون HTTP مثل worker)"""
+        if signum is None:
+            return
+        signal.signal(signum, lambda *_: logging.getLogger(__name__).info("SQL profile:\n" + self.format_report()))
+
+profiler = QueryProfiler()
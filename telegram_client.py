@@ -0,0 +1,178 @@
+"""
+کلاینت خروجی Bot API
+
+- یک Session مشترک با استخر اتصال‌های keep-alive به اندازه مشخص برای همه تردها
+- timeout و تلاش مجدد قابل تنظیم: خطای اتصال برای همه متدها، پاسخ 5xx فقط برای متدهای
+  بی‌اثر در تکرار (IDEMPOTENT_METHODS)؛ 429 به فراخواننده برمی‌گردد
+- ادغام ویرایش‌های یک پیام: تا وقتی ویرایشی از (chat_id, message_id) در حال ارسال است
+  فقط آخرین ویرایش رسیده نگه داشته و ارسال می‌شود
+"""
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from telebot import apihelper
+from metrics import registry as metrics
+from config import (TELEGRAM_POOL_SIZE, TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT,
+                    TELEGRAM_RETRIES, TELEGRAM_RETRY_BACKOFF)
+
+logger = logging.getLogger(__name__)
+
+# متدهایی که فقط آخرین درخواست هر پیام اهمیت دارد
+COALESCED_METHODS = ('editMessageText',)
+
+# متدهایی که تکرارشان نتیجه را عوض نمی‌کند و پس از پاسخ 5xx دوباره ارسال می‌شوند؛ sendMessage و
+# مانند آن ممکن است پیش از خطا تحویل شده باشند و تکرارشان پیام تکراری می‌فرستد
+IDEMPOTENT_METHODS = (
+    'getMe', 'getUpdates', 'getChat', 'getChatMember', 'getFile', 'getWebhookInfo', 'setWebhook', 'deleteWebhook',
+    'editMessageText', 'editMessageReplyMarkup', 'answerCallbackQuery'
+)
+RETRY_STATUSES = (500, 502, 503, 504)
+
+REQUEST_DURATION = metrics.histogram('telegram_request_duration_seconds', 'Outgoing Bot API request latency', ('method',))
+REQUEST_ERRORS = metrics.counter('telegram_request_errors_total', 'Outgoing Bot API requests that failed (HTTP status or exception)',
+                                 ('method', 'code'))
+EDITS_COALESCED = metrics.counter('telegram_edits_coalesced_total', 'Message edits dropped in favour of a newer edit')
+
+class _Pending:
+    """یک ویرایش در صف؛ اگر ویرایش جدیدتری برسد نتیجه آن را برمی‌گرداند"""
+
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.done = threading.Event()
+        self.superseded_by = None
+        self.response = None
+        self.error = None
+
+    def result(self):
+        pending = self
+        while True:
+            pending.done.wait()
+            if pending.superseded_by is None:
+                break
+            pending = pending.superseded_by
+        if pending.error is not None:
+            raise pending.error
+        return pending.response
+
+class TelegramClient:
+    """ارسال درخواست‌های pyTelegramBotAPI از طریق CUSTOM_REQUEST_SENDER"""
+
+    def __init__(self, pool_size=TELEGRAM_POOL_SIZE, connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+                 read_timeout=TELEGRAM_READ_TIMEOUT, retries=TELEGRAM_RETRIES, backoff=TELEGRAM_RETRY_BACKOFF):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        # فقط خطای اتصال (درخواست به تلگرام نرسیده است)؛ تکرار پس از 5xx در _send و فقط برای IDEMPOTENT_METHODS
+        retry = Retry(
+            total=retries, connect=retries, read=0, status=0, other=0, allowed_methods=None,
+            backoff_factor=backoff, respect_retry_after_header=False, raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._edits = {}  # (chat_id, message_id) -> [در حال ارسال، آخرین ویرایش منتظر]
+        self.coalesced = 0
+
+    def install(self):
+        """استفاده از این کلاینت برای همه درخواست‌های pyTelegramBotAPI"""
+        apihelper.CONNECT_TIMEOUT = self.connect_timeout
+        apihelper.READ_TIMEOUT = self.read_timeout
+        apihelper.CUSTOM_REQUEST_SENDER = self.request
+        return self
+
+    def request(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        method_name = url.rsplit('/', 1)[-1]
+        args = (method, url)
+        kwargs = {'params': params, 'files': files, 'timeout': timeout, 'proxies': proxies}
+
+        key = self._edit_key(method_name, params)
+        if key is None:
+            return self._send(method_name, args, kwargs)
+        return self._coalesce(method_name, key, _Pending(args, kwargs))
+
+    @staticmethod
+    def _edit_key(method_name, params):
+        if method_name not in COALESCED_METHODS or not params:
+            return None
+        if params.get('inline_message_id'):
+            return ('inline', str(params['inline_message_id']))
+        if params.get('chat_id') is None or params.get('message_id') is None:
+            return None
+        return (str(params['chat_id']), str(params['message_id']))
+
+    def _coalesce(self, method_name, key, pending):
+        with self._lock:
+            slot = self._edits.get(key)
+            if slot is None:
+                slot = self._edits[key] = [False, None]
+            if slot[1] is not None:
+                # ویرایش منتظر قبلی دیگر ارسال نمی‌شود
+                slot[1].superseded_by = pending
+                slot[1].done.set()
+                self.coalesced += 1
+                EDITS_COALESCED.inc()
+            slot[1] = pending
+            leader = not slot[0]
+            slot[0] = True
+
+        if leader:
+            # ترد اول ویرایش‌های رسیده در حین ارسال را هم به ترتیب ارسال می‌کند
+            while True:
+                with self._lock:
+                    job, slot[1] = slot[1], None
+                    if job is None:
+                        del self._edits[key]
+                        break
+                try:
+                    job.response = self._send(method_name, job.args, job.kwargs)
+                except Exception as e:
+                    job.error = e
+                job.done.set()
+        return pending.result()
+
+    def _send(self, method_name, args, kwargs):
+        retries = self.retries if method_name in IDEMPOTENT_METHODS else 0
+        for attempt in range(retries + 1):
+            response = self._send_once(method_name, args, kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def _send_once(self, method_name, args, kwargs):
+        started = time.perf_counter()
+        code = 'exception'
+        try:
+            response = self.session.request(*args, **kwargs)
+            code = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            REQUEST_DURATION.observe(elapsed, method=method_name)
+            if code == 'exception' or code >= 400:
+                REQUEST_ERRORS.inc(method=method_name, code=code)
+            if code == 'exception':
+                logger.warning(f"Telegram {method_name} failed after {elapsed * 1000:.1f} ms")
+
+    def get_stats(self):
+        """تعداد، خطا و زمان درخواست‌های هر متد و تعداد ویرایش‌های ادغام‌شده"""
+        errors = {}
+        for (method_name, _), count in REQUEST_ERRORS.snapshot().items():
+            errors[method_name] = errors.get(method_name, 0) + count
+
+        methods = {}
+        for (method_name,), counts in REQUEST_DURATION.snapshot().items():
+            count = sum(counts[:-1])
+            methods[method_name] = {
+                'count': count,
+                'errors': errors.get(method_name, 0),
+                'avg_ms': round(counts[-1] / count * 1000, 2)
+            }
+        return {'methods': methods, 'coalesced': self.coalesced, 'pending_edits': len(self._edits)}
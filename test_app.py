@@ -0,0 +1,162 @@
+"""
+تست‌های app.py و worker.py
+
+app در import تنظیمات محیط را می‌خواند و کلاینت تلگرام را نصب می‌کند؛ هر تست در پروسس
+جداگانه با دیتابیس موقت اجرا می‌شود.
+"""
+import os
+import sys
+import uuid
+import subprocess
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL', '')
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def database_env(request):
+    """متغیرهای محیطی دیتابیس app؛ PostgreSQL فقط با TEST_DATABASE_URL و در schema جداگانه"""
+    if request.param == 'sqlite':
+        yield {}
+        return
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    import psycopg2
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(TEST_DATABASE_URL)
+    admin.autocommit = True
+    admin.cursor().execute(f'CREATE SCHEMA {schema}')
+    separator = '&' if '?' in TEST_DATABASE_URL else '?'
+    yield {'DATABASE_URL': f"{TEST_DATABASE_URL}{separator}options=-csearch_path%3D{schema}"}
+    admin.cursor().execute(f'DROP SCHEMA {schema} CASCADE')
+    admin.close()
+
+def run_python(code, tmp_path, **env):
+    """اجرای کد در پروسس جدید با دیتابیس SQLite موقت؛ خروجی: stdout"""
+    env = {
+        **os.environ,
+        'DATABASE_PATH': str(tmp_path / 'game.db'),
+        'DATABASE_URL': '',
+        'BOT_TOKEN': '123:test',
+        'DB_WARMUP': '0',
+        'PYTHONPATH': ROOT,
+        **env
+    }
+    result = subprocess.run([sys.executable, '-c', code], cwd=str(tmp_path), env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def test_worker_cleanup_on_fresh_database(tmp_path, database_env):
+    out = run_python('''
+import app, worker
+app.ensure_db()
+conn = app.connections.get()
+conn.execute("INSERT INTO diplomacy (status, created_at, expires_at) VALUES ('accepted', '2000-01-01', '2000-01-02')")
+conn.commit()
+worker.cleanup_old_data()
+print(conn.execute('SELECT COUNT(*) FROM diplomacy').fetchone()[0])
+''', tmp_path, **database_env)
+    assert out.strip() == '0'
+
+def test_end_season_accrual_matches_per_player(tmp_path, database_env):
+    out = run_python('''
+import random
+from datetime import datetime, timedelta
+import app
+app.ensure_db()
+now = datetime(2026, 1, 10, 12, 0, 0)
+rng = random.Random(7)
+names = [name for name, _ in app.COUNTRIES]
+with app.connections.transaction() as conn:
+    for user_id in range(1, 201):
+        since = now - timedelta(seconds=rng.randint(0, 5 * 86400))
+        conn.execute('INSERT INTO players (user_id, username, country, join_date, resources_at) VALUES (?, ?, ?, ?, ?)',
+                     (user_id, f'p{user_id}', rng.choice(names + [None]), now, since))
+cursor = app.connections.get().cursor()
+expected = {user_id: app.player_resources(cursor, user_id, now) for user_id in range(1, 201)}
+with app.connections.transaction() as conn:
+    updated = app.materialize_all_players(conn, now)
+mismatches = 0
+for user_id, (resources, since, days) in expected.items():
+    actual = app.player_resources(cursor, user_id, now)
+    # بعد از ثبت، منابع همان مقدار محاسبه‌شده و روز ناقص باقی‌مانده است
+    mismatches += actual[0] != resources or actual[2] != 0 or (days and abs((actual[1] - since).total_seconds()) > 1)
+print(updated, sum(1 for result in expected.values() if result[2]), mismatches)
+''', tmp_path, **database_env)
+    updated, accrued, mismatches = map(int, out.split())
+    assert updated == accrued > 0
+    assert mismatches == 0
+
+def test_leaderboard_ranks_accrued_power(tmp_path, database_env):
+    out = run_python('''
+import random
+from datetime import datetime, timedelta
+import app
+app.ensure_db()
+now = datetime.now()
+rng = random.Random(11)
+names = [name for name, _ in app.COUNTRIES]
+with app.connections.transaction() as conn:
+    for user_id in range(1, 41):
+        # منابع ثبت‌شده کمتر با تولید انباشته بیشتر، تا ترتیب منابع ثبت‌شده با ترتیب واقعی فرق کند
+        days = rng.randint(0, 20)
+        conn.execute(\'\'\'INSERT INTO players (user_id, username, country, gold, army, join_date, resources_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)\'\'\',
+                     (user_id, f'p{user_id}', rng.choice(names), 5000 - days * 200 + rng.randint(0, 50),
+                      rng.randint(0, 20), now, now - timedelta(days=days, hours=1)))
+stale = [user_id for user_id, _ in app.leaderboard.top(40)]
+cursor = app.connections.get().cursor()
+power = {}
+for user_id in range(1, 41):
+    resources = app.player_resources(cursor, user_id, now)[0]
+    cursor.execute('SELECT army, defense FROM players WHERE user_id = ?', (user_id,))
+    army, defense = cursor.fetchone()
+    power[user_id] = sum(resources.values()) + army * 10 + defense * 5
+expected = sorted(power, key=lambda user_id: (-power[user_id], user_id))
+app.accrue_power()
+top = app.leaderboard.top(40)
+print(stale != expected, [user_id for user_id, _ in top] == expected, all(score == power[user_id] for user_id, score in top))
+# بدون روز کامل جدید چیزی ثبت نمی‌شود و دوباره افزوده نمی‌شود
+print(app.accrue_power(), app.leaderboard.top(40) == top)
+app.broadcaster.stop()
+''', tmp_path, **database_env)
+    first, second = out.strip().splitlines()[-2:]
+    assert first == 'True True True'
+    assert second == '0 True'
+
+# بودجه زمان import (همان بودجه benchmarks.bench_cold_start)
+IMPORT_BUDGET_MS = 1500
+
+def test_import_is_fast_and_does_not_touch_the_database(tmp_path):
+    out = run_python('''
+import os, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+# بررسی سلامت و پایش به دیتابیس نیاز ندارند
+statuses = [client.get(path).status_code for path in ('/', '/metrics', '/stats/sql')]
+print((imported - started) * 1000, os.path.exists(os.environ['DATABASE_PATH']), app._db_ready, *statuses)
+client.get('/stats')
+print(app._db_ready)
+app.broadcaster.stop()
+''', tmp_path)
+    first, second = out.strip().splitlines()[-2:]
+    import_ms, db_created, db_ready, *statuses = first.split()
+    assert float(import_ms) < IMPORT_BUDGET_MS
+    assert (db_created, db_ready) == ('False', 'False')
+    assert statuses == ['200', '200', '200']
+    assert second == 'True'
+
+def test_database_warms_up_in_background(tmp_path):
+    out = run_python('''
+import time
+import app
+deadline = time.monotonic() + 10
+while not app._db_ready and time.monotonic() < deadline:
+    time.sleep(0.01)
+print(app._db_ready)
+app.broadcaster.stop()
+''', tmp_path, DB_WARMUP='1')
+    assert out.strip() == 'True'
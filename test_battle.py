@@ -0,0 +1,53 @@
+"""تست‌های فرمول جنگ و بازپخش جنگ‌های ثبت‌شده (battle.py و GameLogic)"""
+from battle import BattleRandom, battle_rng
+from game_logic import GameLogic
+from test_database import backend, db  # noqa: F401 (fixtureها)
+
+def test_same_key_gives_same_stream():
+    first = BattleRandom(1, 2, 3, 42)
+    second = battle_rng(1, 2, 3, 42)
+    stream = [first.random() for _ in range(1000)]
+    assert stream == [second.random() for _ in range(1000)]
+    assert all(0 <= value < 1 for value in stream)
+    # هر جزء کلید دنباله را عوض می‌کند
+    for key in ((1, 2, 3, 43), (1, 3, 2, 42), (2, 2, 3, 42)):
+        assert [BattleRandom(*key).random() for _ in range(1000)] != stream
+
+def test_simulate_battle_with_same_seed(db):
+    logic = GameLogic(db)
+    results = [logic.simulate_battle(1, 2, season_id=1, seed=123) for _ in range(2)]
+    assert results[0] == results[1]
+    assert results[0]['seed'] == 123
+
+def test_recorded_battles_replay(db):
+    logic = GameLogic(db)
+    season_id = db.start_season(1)
+    db.update_country_military(1, army_size=300)
+    db.update_country_military(3, army_size=300)
+
+    recorded = []
+    for attacker_id, defender_id in ((1, 2), (2, 1), (3, 4), (4, 3)):
+        attack = logic.attack_country(attacker_id, defender_id, season_id)
+        assert attack['success']
+        recorded.append(attack)
+    # هم جنگ با غنیمت و هم جنگ بدون غنیمت بازپخش می‌شود
+    assert {attack['result']['result'].startswith('attacker') for attack in recorded} == {True, False}
+
+    for attack in recorded:
+        replay = logic.replay_battle(attack['battle_id'])
+        assert replay['matches_record']
+        for key in ('result', 'loot', 'attacker_losses', 'defender_losses', 'power_ratio'):
+            assert replay[key] == attack['result'][key]
+    assert logic.replay_battle(10 ** 6) is None
+
+def test_archived_battle_replays(db):
+    logic = GameLogic(db)
+    season_id = db.start_season(1)
+    db.update_country_military(1, army_size=300)
+    attack = logic.attack_country(1, 2, season_id)
+    db.end_season(season_id, 1, None)
+
+    # پس از پایان فصل جنگ فقط در بایگانی فصل است
+    replay = logic.replay_battle(attack['battle_id'])
+    assert replay['matches_record']
+    assert replay['loot'] == attack['result']['loot']
@@ -0,0 +1,37 @@
+"""تست‌های ارسال گروهی (broadcast.py)"""
+import time
+from broadcast import Broadcaster
+from database import ConnectionManager
+
+class _TelegramError(Exception):
+    def __init__(self, error_code):
+        super().__init__(f"error {error_code}")
+        self.error_code = error_code
+
+def test_failed_recipient_does_not_block_others(tmp_path):
+    sent = []
+    failures = {'bad': 1}
+
+    def send(chat_id, text, parse_mode):
+        if failures.get(chat_id):
+            failures[chat_id] -= 1
+            raise _TelegramError(502)
+        sent.append((chat_id, time.monotonic()))
+
+    connections = ConnectionManager(str(tmp_path / 'broadcast.db'))
+    broadcaster = Broadcaster(connections, send, rate=1000, chat_rate=1000)
+    started = time.monotonic()
+    broadcast_id = broadcaster.enqueue('hello', ['bad', 'a', 'b', 'c'])
+    while broadcaster.get_status(1)['running'] and time.monotonic() - started < 10:
+        time.sleep(0.05)
+
+    # بقیه بدون انتظار برای تلاش دوباره چت خطادار ارسال شده‌اند
+    delays = {chat_id: at - started for chat_id, at in sent}
+    assert max(delays['a'], delays['b'], delays['c']) < 1
+    assert 'bad' in delays and delays['bad'] >= 2
+    row = connections.get().execute('''
+        SELECT status, attempts, next_attempt_at FROM broadcast_recipients WHERE broadcast_id = ? AND chat_id = 'bad'
+    ''', (broadcast_id,)).fetchone()
+    assert row == ('sent', 1, None)
+    assert broadcaster.get_status(1)['broadcasts'][0]['status'] == 'done'
+    connections.close_all()
@@ -0,0 +1,362 @@
+"""
+تست‌های Database روی هر دو backend
+
+- sqlite: ConnectionManager معمولی روی فایل موقت
+- postgres-shim: PostgresConnectionManager با استخری که به جای psycopg2 به SQLite وصل می‌شود؛
+  دستورها همان مسیر translate_sql و PostgresCursor را طی می‌کنند و سپس به گویش SQLite برمی‌گردند
+- postgres: اگر TEST_DATABASE_URL تنظیم شده باشد، PostgreSQL واقعی در یک schema جداگانه
+
+اجرا: python -m pytest -q
+"""
+import os
+import re
+import uuid
+import sqlite3
+import threading
+import pytest
+import database
+from datetime import datetime, timedelta
+from archive import SeasonArchiver
+from database import ConnectionManager, PostgresConnectionManager, Database
+from game_logic import GameLogic
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL', '')
+
+# برگرداندن خروجی translate_sql به گویش SQLite
+_PARAMS = re.compile(r'%%|%s')
+
+def _to_sqlite(sql, has_params):
+    if sql.lstrip().upper().startswith('CREATE TABLE'):
+        sql = sql.replace('BIGSERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT').replace('BIGINT', 'INTEGER')
+    # SQLite قفل ردیف ندارد؛ BEGIN IMMEDIATE کل دیتابیس را قفل می‌کند
+    sql = re.sub(r'\bFOR UPDATE\b', '', sql)
+    if has_params:
+        sql = _PARAMS.sub(lambda match: '?' if match.group() == '%s' else '%', sql)
+    return sql
+
+class _ShimCursor:
+    """کرسر شبیه psycopg2: ردیف‌ها در execute خوانده می‌شوند و rowcount تعداد آن‌هاست"""
+
+    def __init__(self, raw, dict_rows):
+        self.raw = raw
+        self.dict_rows = dict_rows
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+
+    def _begin(self):
+        if not self.raw.autocommit and not self.raw.sqlite.in_transaction:
+            self.raw.sqlite.execute('BEGIN IMMEDIATE')
+
+    def execute(self, sql, params=None):
+        self._begin()
+        cursor = self.raw.sqlite.execute(_to_sqlite(sql, params is not None), params or ())
+        self._collect(cursor)
+
+    def executemany(self, sql, seq_of_params):
+        self._begin()
+        self._collect(self.raw.sqlite.executemany(_to_sqlite(sql, True), seq_of_params))
+
+    def _collect(self, cursor):
+        self.description = cursor.description
+        if cursor.description is None:
+            self._rows = []
+            self.rowcount = cursor.rowcount
+            return
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+        self._rows = [dict(zip(columns, row)) if self.dict_rows else tuple(row) for row in rows]
+        self.rowcount = len(rows)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._rows = []
+
+class _ShimConnection:
+    """اتصال شبیه psycopg2 با autocommit؛ بیرون از autocommit اولین دستور تراکنش را شروع می‌کند"""
+
+    def __init__(self, path):
+        self.sqlite = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.autocommit = False
+
+    def cursor(self, cursor_factory=None):
+        return _ShimCursor(self, cursor_factory is not None)
+
+    def commit(self):
+        if self.sqlite.in_transaction:
+            self.sqlite.execute('COMMIT')
+
+    def rollback(self):
+        if self.sqlite.in_transaction:
+            self.sqlite.execute('ROLLBACK')
+
+    def close(self):
+        self.sqlite.close()
+
+class _ShimPool:
+    """همان رفتار ThreadedConnectionPool: هر کلید تا putconn اتصال خودش را دارد"""
+
+    def __init__(self, path, maxconn):
+        self.path = path
+        self.maxconn = maxconn
+        self._used = {}
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def getconn(self, key=None):
+        with self._lock:
+            if key in self._used:
+                return self._used[key]
+            if len(self._used) >= self.maxconn:
+                raise RuntimeError('connection pool exhausted')
+            conn = self._idle.pop() if self._idle else _ShimConnection(self.path)
+            self._used[key] = conn
+            return conn
+
+    def putconn(self, conn, key=None):
+        with self._lock:
+            del self._used[key]
+            conn.rollback()
+            self._idle.append(conn)
+
+    def closeall(self):
+        with self._lock:
+            for conn in list(self._used.values()) + self._idle:
+                conn.close()
+            self._used, self._idle = {}, []
+
+def _manager(backend, tmp_path, maxconn=20):
+    if backend == 'sqlite':
+        return ConnectionManager(str(tmp_path / 'game.db'), dict_rows=True)
+
+    if backend == 'postgres-shim':
+        manager = PostgresConnectionManager('shim', dict_rows=True, maxconn=maxconn)
+        manager._pool = _ShimPool(str(tmp_path / 'game.db'), maxconn)
+        return manager
+
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    import psycopg2
+    from psycopg2.pool import ThreadedConnectionPool
+    # هر تست schema خودش را دارد تا جدول‌های تست‌ها با هم و با دیتابیس اصلی تداخل نکنند
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(TEST_DATABASE_URL)
+    admin.autocommit = True
+    admin.cursor().execute(f'CREATE SCHEMA {schema}')
+    manager = PostgresConnectionManager(TEST_DATABASE_URL, dict_rows=True, maxconn=maxconn)
+    manager._pool = ThreadedConnectionPool(1, maxconn, TEST_DATABASE_URL, options=f'-c search_path={schema}')
+    manager.drop_schema = lambda: (admin.cursor().execute(f'DROP SCHEMA {schema} CASCADE'), admin.close())
+    return manager
+
+BACKENDS = ['sqlite', 'postgres-shim', 'postgres']
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    return request.param
+
+@pytest.fixture
+def db(backend, tmp_path, monkeypatch):
+    manager = _manager(backend, tmp_path)
+    monkeypatch.setattr(database, 'connect', lambda path, dict_rows=False: manager)
+    db = Database(str(tmp_path / 'game.db'))
+    db._archiver = SeasonArchiver(db.connections, db.events, directory=str(tmp_path / 'archive'))
+    yield db
+    db.close()
+    if hasattr(manager, 'drop_schema'):
+        manager.drop_schema()
+
+def _count(db, sql, params=()):
+    row = db.conn.execute(sql, params).fetchone()
+    return list(row.values())[0]
+
+def test_initial_countries(db):
+    countries = db.get_available_countries()
+    assert len(countries) == 10
+    assert {country['name'] for country in countries} >= {'پارس', 'روم'}
+
+def test_schema_is_not_recreated(db, tmp_path):
+    # نسخه طرح ثبت شده است؛ Database دوم جدول‌ها را دوباره نمی‌سازد و کشورها را تکرار نمی‌کند
+    Database(str(tmp_path / 'game.db')).events.close()
+    assert _count(db, 'SELECT COUNT(*) FROM countries') == 10
+
+def test_add_player_claims_country(db):
+    assert db.add_player(1, 'alice', 1)
+    country = db.get_player_country(1)
+    assert country['id'] == 1
+    assert country['controller'] == 'HUMAN'
+    assert 1 not in [country['id'] for country in db.get_available_countries()]
+
+def test_add_player_without_country(db):
+    assert db.add_player(5, 'eve')
+    assert db.get_player_by_id(5)['username'] == 'eve'
+    assert db.get_player_country(5) is None
+
+def test_taken_country_is_refused_without_writes(db):
+    assert db.add_player(1, 'alice', 1)
+    assert not db.add_player(2, 'bob', 1)
+    assert db.get_player_by_id(2) is None
+
+def test_concurrent_claim_writes_nothing(db):
+    assert db.add_player(1, 'alice', 1)
+    # کش کشورها هنوز کشور را آزاد می‌بیند؛ UPDATE شرطی جلوی ثبت بازیکن را می‌گیرد
+    db.catalog.get = lambda country_id: {'id': country_id, 'controller': 'AI'}
+    assert not db.add_player(2, 'bob', 1)
+    assert db.get_player_by_id(2) is None
+    assert db.get_country_by_id(1)['player_id'] == 1
+
+def test_apply_deltas(db):
+    country = db.apply_deltas(2, {'gold': 50, 'army': 5})
+    assert (country['gold'], country['army']) == (150, 55)
+    # منابع کافی نیست؛ هیچ ستونی تغییر نمی‌کند
+    assert db.apply_deltas(2, {'gold': -500, 'iron': -10}) is None
+    country = db.get_country_by_id(2)
+    assert (country['gold'], country['iron']) == (150, 100)
+    with pytest.raises(ValueError):
+        db.apply_deltas(2, {'name': 1})
+
+def test_lock_and_save_countries(db):
+    with db.connections.transaction():
+        countries = db.lock_countries(3, 4)
+        assert sorted(countries) == [3, 4]
+        countries[3]['army'] = 80
+        db.save_country(countries[3])
+    assert db.get_country_by_id(3)['army'] == 80
+
+def test_transaction_rolls_back(db):
+    with pytest.raises(RuntimeError):
+        with db.connections.transaction() as conn:
+            conn.execute('UPDATE countries SET gold = 0 WHERE id = 1')
+            raise RuntimeError('boom')
+    assert db.get_country_by_id(1)['gold'] == 100
+
+def test_update_country_military(db):
+    assert db.update_country_military(4, army_size=70, defense_level=60)
+    country = db.get_country_by_id(4)
+    assert (country['army'], country['defense']) == (70, 60)
+    assert not db.update_country_military(4)
+
+def test_seasons_battles_and_events(db):
+    season_id = db.start_season(1)
+    assert db.get_active_season()['id'] == season_id
+
+    battle_id = db.record_battle(1, 2, season_id, 'WIN', {'gold': 10}, seed=7, inputs={'army': 5})
+    battle = db.get_battle(battle_id)
+    assert battle['loot'] == {'gold': 10}
+    assert battle['inputs'] == {'army': 5}
+
+    for i in range(5):
+        db.add_event(season_id, 'WAR', 1, 2, f'event {i}')
+    events, after_id = db.get_events(season_id, limit=3)
+    assert [event['description'] for event in events] == ['event 0', 'event 1', 'event 2']
+    events, after_id = db.get_events(season_id, after_id, limit=3)
+    assert len(events) == 2 and after_id is None
+
+    db.end_season(season_id, 1, None)
+    assert db.get_active_season() is None
+    # جنگ‌ها و رویدادهای فصل بایگانی و از دیتابیس حذف شده‌اند؛ جنگ از بایگانی خوانده می‌شود
+    assert _count(db, 'SELECT COUNT(*) FROM battles') == 0
+    battle = db.get_battle(battle_id)
+    assert (battle['season_id'], battle['loot'], battle['inputs']) == (season_id, {'gold': 10}, {'army': 5})
+    assert db.get_battle(battle_id + 1) is None
+    season = db.get_season_history()[0]
+    assert season['archive'].count('battles') == 1
+    assert [event['description'] for event in season['archive'].rows('events')][-1] == 'event 4'
+
+def test_leaderboard_follows_players(db):
+    for user_id, country_id in ((1, 1), (2, 2), (3, 3)):
+        assert db.add_player(user_id, f'user{user_id}', country_id)
+    db.conn.execute('UPDATE players SET score = user_id * 10')
+    db.leaderboard.invalidate()
+    assert [player['user_id'] for player in db.get_top_players(2)] == [3, 2]
+    assert db.get_player_rank(1) == 3
+
+    assert db.remove_player(3)
+    assert not db.remove_player(3)
+    assert db.get_country_by_id(3)['controller'] == 'AI'
+    assert [player['user_id'] for player in db.get_top_players()] == [2, 1]
+
+def test_reset_game(db):
+    db.add_player(1, 'alice', 1)
+    season_id = db.start_season(1)
+    db.add_event(season_id, 'WAR', 1, 2, 'war')
+    assert db.reset_game()
+    assert _count(db, 'SELECT COUNT(*) FROM players') == 0
+    assert db.get_active_season() is None
+    assert len(db.get_available_countries()) == 10
+    assert db.get_events(season_id) == ([], None)
+
+def test_threads_return_connections(backend, tmp_path):
+    # تعداد تردها از اندازه استخر بیشتر است؛ release اتصال هر ترد را برمی‌گرداند
+    manager = _manager(backend, tmp_path, maxconn=2)
+    errors = []
+
+    def work():
+        try:
+            with manager.transaction() as conn:
+                conn.execute('SELECT 1').fetchone()
+            manager.get().execute('SELECT 1').fetchone()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            manager.release()
+
+    for _ in range(5):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    manager.close_all()
+    if hasattr(manager, 'drop_schema'):
+        manager.drop_schema()
+    assert errors == []
+
+def test_hot_queries_use_indexes(db):
+    if db.connections.backend != 'sqlite':
+        pytest.skip('EXPLAIN QUERY PLAN is SQLite-only')
+    logic = GameLogic(db)
+    for user_id in range(1, 6):
+        db.add_player(user_id, f'player_{user_id}', user_id)
+    # حمله‌کننده قوی تا مسیر غنیمت و امتیاز هم اجرا شود
+    db.update_country_military(1, army_size=1000)
+    # بارگذاری کامل رتبه‌بندی عمداً کل جدول را می‌خواند و جزو مسیر پرتکرار نیست
+    db.get_top_players(10)
+
+    # ثبت دستورهایی که خود متدها اجرا می‌کنند تا فهرست پرسش‌ها از کد عقب نماند
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    try:
+        db.get_player_country(1)
+        logic.attack_country(1, 2, None)
+        logic.train_army(1, 1)
+        db.get_top_players(10)
+        db.remove_player(5)
+        # همان دستور worker.cleanup_old_data
+        with db.connections.transaction() as tx:
+            tx.execute('''
+                DELETE FROM diplomacy 
+                WHERE expires_at < ? OR (status = 'pending' AND created_at < ?)
+            ''', (datetime.now(), datetime.now() - timedelta(days=7)))
+    finally:
+        db.conn.set_trace_callback(None)
+
+    full_scans = []
+    for sql in dict.fromkeys(statements):
+        if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            continue
+        plan = [row['detail'] for row in db.conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()]
+        if any(detail.startswith('SCAN') and 'USING' not in detail for detail in plan):
+            full_scans.append((' '.join(sql.split()), plan))
+    assert len(statements) > 10
+    assert full_scans == []
@@ -0,0 +1,56 @@
+"""تست‌های صف پردازش آپدیت‌ها (dispatcher.py)"""
+import random
+import threading
+import time
+import telebot
+from telebot.types import Update
+from dispatcher import UpdateDispatcher
+
+def _update(update_id, user_id, text):
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'from': user,
+        'chat': {'id': user_id, 'type': 'private'}, 'text': text}})
+
+def _submit_all(dispatcher, users=8, per_user=25):
+    # آپدیت‌های کاربران در هم قرار می‌گیرند؛ ترتیب ارسال هر کاربر 0، 1، 2، ...
+    update_id = 0
+    for sequence in range(per_user):
+        for user_id in range(1, users + 1):
+            update_id += 1
+            assert dispatcher.submit(_update(update_id, user_id, str(sequence)))
+    dispatcher.stop(timeout=30)
+
+def test_updates_of_one_user_are_handled_in_order():
+    handled = {}
+    rng = random.Random(3)
+    lock = threading.Lock()
+
+    def handler(updates):
+        for update in updates:
+            # زمان پردازش متفاوت تا ترتیب فقط با بخش‌بندی حفظ شود
+            time.sleep(rng.random() / 1000)
+            with lock:
+                handled.setdefault(update.message.from_user.id, []).append(int(update.message.text))
+
+    dispatcher = UpdateDispatcher(handler, workers=4, maxsize=1000)
+    _submit_all(dispatcher)
+    assert sorted(handled) == list(range(1, 9))
+    assert all(sequence == list(range(25)) for sequence in handled.values())
+    assert dispatcher.get_stats()['processed'] == 200
+
+def test_bot_handlers_keep_order_in_dispatcher_threads():
+    # مثل app در حالت صف: هندلرهای telebot در ترد همان بخش اجرا می‌شوند
+    bot = telebot.TeleBot('123:test', threaded=False)
+    handled = {}
+    rng = random.Random(5)
+
+    @bot.message_handler(func=lambda message: True)
+    def record(message):
+        time.sleep(rng.random() / 1000)
+        handled.setdefault(message.from_user.id, []).append(int(message.text))
+
+    dispatcher = UpdateDispatcher(bot.process_new_updates, workers=4, maxsize=1000)
+    _submit_all(dispatcher)
+    assert sorted(handled) == list(range(1, 9))
+    assert all(sequence == list(range(25)) for sequence in handled.values())
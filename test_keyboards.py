@@ -0,0 +1,42 @@
+"""تست‌های کش کیبوردها (keyboards.py)"""
+import json
+from keyboards import Keyboards, registry
+
+class _Catalog:
+    def __init__(self):
+        self._version = 0
+        self.countries = [
+            {'id': 1, 'name': 'پارس', 'special_resource': 'اسب', 'controller': 'AI'},
+            {'id': 2, 'name': 'روم', 'special_resource': 'آهن', 'controller': 'AI'},
+        ]
+
+    def version(self):
+        return self._version
+
+    def all(self):
+        return list(self.countries)
+
+    def available(self):
+        return [country for country in self.countries if country['controller'] == 'AI']
+
+def _buttons(payload):
+    return [row[0]['callback_data'] for row in json.loads(payload)['inline_keyboard']]
+
+def test_countries_keyboard_follows_catalog_version():
+    registry.invalidate()
+    catalog = _Catalog()
+    assert _buttons(Keyboards.get_countries_keyboard(True, catalog=catalog)) == ['country_1', 'country_2', 'main_menu']
+    assert Keyboards.get_countries_keyboard(True, catalog=catalog) is Keyboards.get_countries_keyboard(True, catalog=catalog)
+
+    # تغییر مالکیت بدون افزایش نسخه از کش خوانده می‌شود؛ با افزایش نسخه کیبورد دوباره ساخته می‌شود
+    catalog.countries[0] = {**catalog.countries[0], 'controller': 'HUMAN'}
+    assert _buttons(Keyboards.get_countries_keyboard(True, catalog=catalog)) == ['country_1', 'country_2', 'main_menu']
+    catalog._version += 1
+    assert _buttons(Keyboards.get_countries_keyboard(True, catalog=catalog)) == ['country_2', 'main_menu']
+
+    # هر حالت یک ورودی دارد، نه یک ورودی برای هر فهرست کشورها
+    for _ in range(5):
+        catalog._version += 1
+        Keyboards.get_countries_keyboard(True, catalog=catalog)
+        Keyboards.get_countries_keyboard(False, catalog=catalog)
+    assert len([key for key in registry._cache if key[0] == 'countries']) == 2
@@ -0,0 +1,71 @@
+"""تست‌های زمان‌بند worker (scheduler.py)"""
+from datetime import datetime, timedelta
+import pytest
+from database import ConnectionManager
+from scheduler import CronSchedule, Scheduler
+
+def test_parse_fields():
+    schedule = CronSchedule('*/15 1-5 1,15,31 10-12/2 7')
+    assert schedule.minutes == {0, 15, 30, 45}
+    assert schedule.hours == {1, 2, 3, 4, 5}
+    assert schedule.days == {1, 15, 31}
+    assert schedule.months == {10, 12}
+    # 7 همان یکشنبه (0) است
+    assert schedule.weekdays == {0}
+
+    everything = CronSchedule('* * * * *')
+    assert everything.minutes == set(range(60))
+    assert everything.weekdays == set(range(7))
+    # مقدار تکی با گام یعنی از آن مقدار تا انتهای بازه
+    assert CronSchedule('5/20 * * * *').minutes == {5, 25, 45}
+
+@pytest.mark.parametrize('expression', [
+    '60 * * * *', '* 24 * * *', '* * 0 * *', '*/0 * * * *', '5-1 * * * *', '* * * *',
+])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+@pytest.mark.parametrize('expression, moment, expected', [
+    # همان دقیقه اجرا حساب نمی‌شود
+    ('30 2 * * *', datetime(2026, 3, 10, 2, 30, 15), datetime(2026, 3, 11, 2, 30)),
+    # عبور از مرز روز و ماه
+    ('0 3 * * *', datetime(2026, 1, 31, 23, 59), datetime(2026, 2, 1, 3, 0)),
+    # عبور از مرز سال
+    ('0 0 1 * *', datetime(2026, 12, 15, 8, 0), datetime(2027, 1, 1, 0, 0)),
+    # ماه‌های بدون روز 31 رد می‌شوند
+    ('0 12 31 * *', datetime(2026, 4, 1), datetime(2026, 5, 31, 12, 0)),
+    ('0 0 29 2 *', datetime(2026, 3, 1), datetime(2028, 2, 29, 0, 0)),
+    # 2026-10-18 یکشنبه است
+    ('0 9 * * 1', datetime(2026, 10, 18, 10, 0), datetime(2026, 10, 19, 9, 0)),
+    # با محدود بودن هر دو فیلد روز، تطابق با یکی کافی است (جمعه 2026-10-23 زودتر از روز 30)
+    ('0 0 30 * 5', datetime(2026, 10, 18), datetime(2026, 10, 23, 0, 0)),
+])
+def test_next_after(expression, moment, expected):
+    assert CronSchedule(expression).next_after(moment) == expected
+
+def test_never_firing_expression():
+    with pytest.raises(ValueError):
+        CronSchedule('0 0 31 2 *').next_after(datetime(2026, 1, 1))
+
+def test_second_scheduler_cannot_acquire_held_lock(tmp_path):
+    # دو نمونه worker با اتصال‌های جداگانه روی یک دیتابیس
+    first_connections = ConnectionManager(str(tmp_path / 'scheduler.db'))
+    second_connections = ConnectionManager(str(tmp_path / 'scheduler.db'))
+    calls = []
+    first = Scheduler(first_connections)
+    second = Scheduler(second_connections)
+    first_job = first.add_job('cleanup', '* * * * *', lambda: calls.append('first'), lock_timeout=600)
+    second_job = second.add_job('cleanup', '* * * * *', lambda: calls.append('second'), lock_timeout=600)
+
+    now = datetime.now() + timedelta(minutes=2)
+    assert first._acquire(first_job, now)
+    assert not second._acquire(second_job, now)
+    assert not second.run_job(second_job, now)
+    assert calls == []
+    assert second.get_status()[0]['locked_by'] == first.owner
+
+    # قفل منقضی‌شده (worker از کار افتاده) دوباره گرفته می‌شود
+    assert second._acquire(second_job, now + timedelta(seconds=601))
+    first_connections.close_all()
+    second_connections.close_all()
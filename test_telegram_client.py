@@ -0,0 +1,46 @@
+"""تست‌های کلاینت خروجی Bot API (telegram_client.py)"""
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from telegram_client import TelegramClient
+
+def _server(statuses):
+    """سرور محلی که برای هر متد به ترتیب وضعیت‌های statuses و سپس 200 برمی‌گرداند"""
+    calls = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            method = self.path.split('?')[0].rsplit('/', 1)[-1]
+            calls[method] = calls.get(method, 0) + 1
+            queue = statuses.get(method, [])
+            status = queue[calls[method] - 1] if calls[method] <= len(queue) else 200
+            data = json.dumps({'ok': status == 200, 'result': True}).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/bot0", calls
+
+def test_server_errors_retry_only_idempotent_methods():
+    server, base, calls = _server({'sendMessage': [502], 'editMessageText': [502, 503]})
+    client = TelegramClient(retries=2, backoff=0.01)
+    try:
+        # sendMessage ممکن است تحویل شده باشد؛ پاسخ 502 بدون تکرار به فراخواننده برمی‌گردد
+        response = client.request('post', f"{base}/sendMessage", params={'chat_id': 1, 'text': 'hi'})
+        assert response.status_code == 502
+        assert calls['sendMessage'] == 1
+
+        response = client.request('post', f"{base}/editMessageText", params={'chat_id': 1, 'message_id': 2, 'text': 'hi'})
+        assert response.status_code == 200
+        assert calls['editMessageText'] == 3
+    finally:
+        server.shutdown()